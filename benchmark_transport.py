@@ -0,0 +1,202 @@
+"""
+Compares the Lunch Money transports at the connection level.
+
+Sends a burst of concurrent requests through each transport to a server and reports how long
+they took and how many connections the server saw. By default, local stand-ins for Lunch Money
+are started: one speaking HTTP/1.1 for the requests transport, and one speaking HTTP/2 (over
+plain HTTP, so without negotiating it) for the http2 transport, which multiplexes the requests
+over a single connection. Pass ``--url`` to point both at a real server (like Lunch Money itself).
+
+    python benchmark_transport.py --requests 200 --concurrency 16 --transports requests,http2
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import statistics
+import threading
+import time
+from typing import Any, List, Set, Tuple
+
+from lunchmoney_automate.transport import HTTP2Transport, Transport, create_transport
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:  # pragma: no cover - only needed for the HTTP/2 stand-in
+    h2 = None
+
+# Roughly the time Lunch Money takes to answer a small request
+RESPONSE_DELAY = 0.02
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections: Set[Tuple[str, int]] = set()
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        self._respond({"transactions": [], "has_more": False})
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond(84389)
+
+    def _respond(self, data) -> None:
+        with self.lock:
+            self.connections.add(self.client_address)
+
+        time.sleep(RESPONSE_DELAY)
+
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class H2StandIn:
+    """
+    A stand-in for Lunch Money which speaks HTTP/2 over plain HTTP (to clients which know it
+    does), answering each stream after ``delay`` so that concurrent streams overlap.
+    """
+
+    def __init__(self, delay: float = RESPONSE_DELAY) -> None:
+        if h2 is None:
+            raise ImportError("The HTTP/2 stand-in needs h2 (pip install h2)")
+
+        self.delay = delay
+        self.connections = 0
+        self.streams = 0
+        self._sock = socket.create_server(("127.0.0.1", 0))
+        self._stopped = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._sock.getsockname()[1]}"
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._sock.close()
+
+    def _serve(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(sock,), daemon=True).start()
+
+    def _handle(self, sock: socket.socket) -> None:
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        lock = threading.Lock()
+        conn.initiate_connection()
+        sock.sendall(conn.data_to_send())
+
+        def respond(stream_id: int, data: Any) -> None:
+            body = json.dumps(data).encode("utf-8")
+            with lock:
+                conn.send_headers(stream_id, [
+                    (":status", "200"),
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(body))),
+                ])
+                conn.send_data(stream_id, body, end_stream=True)
+                sock.sendall(conn.data_to_send())
+
+        methods = {}
+        with sock:
+            while not self._stopped.is_set():
+                try:
+                    data = sock.recv(65535)
+                except OSError:
+                    return
+                if not data:
+                    return
+
+                with lock:
+                    events = conn.receive_data(data)
+                    for event in events:
+                        if isinstance(event, h2.events.RequestReceived):
+                            methods[event.stream_id] = dict(event.headers)[b":method"]
+                        elif isinstance(event, h2.events.DataReceived):
+                            conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                        elif isinstance(event, h2.events.StreamEnded):
+                            self.streams += 1
+                            response = 84389 if methods.pop(event.stream_id) == b"POST" else {"transactions": [], "has_more": False}
+                            threading.Timer(self.delay, respond, args=(event.stream_id, response)).start()
+                    sock.sendall(conn.data_to_send())
+
+
+def benchmark(transport: Transport, url: str, requests: int, concurrency: int) -> List[float]:
+    def send(i: int) -> float:
+        started = time.perf_counter()
+        if i % 2:
+            resp = transport.request("POST", f"{url}/v1/transactions/group", json={"transactions": [i]}, timeout=30)
+        else:
+            resp = transport.request("GET", f"{url}/v1/transactions", params={"offset": i}, timeout=30)
+        resp.raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(send, range(requests)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="the server to benchmark against (defaults to a local stand-in)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--transports", default="requests,http2")
+    args = parser.parse_args()
+
+    for name in args.transports.split(","):
+        server = None
+        try:
+            if args.url is not None:
+                url, transport = args.url, create_transport(name)
+            elif name == "http2":
+                server = H2StandIn()
+                url, transport = server.url, HTTP2Transport(prior_knowledge=True)
+            else:
+                StandInHandler.connections.clear()
+                server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                url, transport = f"http://127.0.0.1:{server.server_address[1]}", create_transport(name)
+        except ImportError as ex:
+            print(f"{name:>10}: skipped ({ex})")
+            continue
+
+        try:
+            started = time.perf_counter()
+            latencies = benchmark(transport, url, args.requests, args.concurrency)
+            elapsed = time.perf_counter() - started
+        finally:
+            transport.close()
+            if server is not None:
+                server.shutdown()
+
+        latencies.sort()
+        if isinstance(server, H2StandIn):
+            connections = f"{server.connections} connections"
+        elif server is not None:
+            connections = f"{len(StandInHandler.connections)} connections"
+        else:
+            connections = "n/a"
+        print(
+            f"{name:>10}: {args.requests / elapsed:8.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:6.1f}ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.1f}ms, {connections}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .columnar import NONE, date_ordinal, to_minor_units
+from .utils import Transaction
+
+# The layout of each archived transaction. Strings (and each transaction's list of tags) are
+# stored as codes into the archive's string dictionary, and missing IDs as NONE.
+RECORD = np.dtype([
+    ("id", "<i8"),
+    ("date", "<i4"),
+    ("amount", "<i8"),
+    ("currency", "<i4"),
+    ("payee", "<i4"),
+    ("notes", "<i4"),
+    ("status", "<i4"),
+    ("tags", "<i4"),
+    ("category_id", "<i8"),
+    ("asset_id", "<i8"),
+    ("plaid_account_id", "<i8"),
+    ("parent_id", "<i8"),
+    ("group_id", "<i8"),
+    ("recurring_id", "<i8"),
+    ("is_group", "?"),
+])
+
+STRING_FIELDS = ("currency", "payee", "notes", "status")
+ID_FIELDS = ("category_id", "asset_id", "plaid_account_id", "parent_id", "group_id", "recurring_id")
+
+# The date of the records which mark that a transaction has moved to another partition (account)
+MOVED = NONE
+
+# Marks the entries of the string dictionary which hold a (JSON) list of tags
+TAGS_PREFIX = "#tags:"
+
+# Archived history is fetched again in full once it is this old, to pick up edits to older transactions
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def shape_key(params: Dict[str, Any]) -> str:
+    """Identifies a query by its filters (ignoring its dates)."""
+    return json.dumps({k: v for k, v in params.items() if k not in ("start_date", "end_date")}, sort_keys=True)
+
+
+class TransactionArchive:
+    """
+    An append-only archive of the transactions fetched from Lunch Money, kept in a directory
+    of memory-mapped columnar files (one per account) so that history can be read back without
+    fetching or parsing it again.
+
+    Updated transactions are appended rather than rewritten, and the last record for each
+    transaction wins. A transaction which moves to another account is appended to that account's
+    file, with a record marking it as moved left in the file it was in before. For each query,
+    the archive remembers the range of dates it holds every matching transaction for, so that
+    later queries only need to fetch the dates after that (less ``overlap_days``, to pick up
+    recent changes) until the history is ``max_age`` seconds old, when it is fetched in full
+    again.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        overlap_days: int = 3,
+        max_age: float = DEFAULT_MAX_AGE,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.overlap_days = overlap_days
+        self.max_age = max_age
+        self.clock = clock
+
+        os.makedirs(path, exist_ok=True)
+
+        self.strings: List[str] = []
+        self.string_codes: Dict[str, int] = {}
+        self.coverage: Dict[str, Dict[str, Any]] = {}
+        self._latest: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {}
+        self._partition_ids: Optional[Dict[int, str]] = None
+        self._lock = threading.RLock()
+
+        if os.path.exists(self._strings_path):
+            with open(self._strings_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    value = json.loads(line)
+                    self.string_codes[value] = len(self.strings)
+                    self.strings.append(value)
+
+        if os.path.exists(self._coverage_path):
+            with open(self._coverage_path, "r") as f:
+                self.coverage = json.load(f)
+
+    def fetch_from(self, params: Dict[str, Any]) -> Optional[str]:
+        """
+        The date from which a query's transactions need to be fetched, when those before it can
+        be read from the archive (or None if the query needs to be fetched in full).
+        """
+        if "start_date" not in params or "end_date" not in params:
+            return None
+
+        with self._lock:
+            covered = self.coverage.get(shape_key(params))
+
+        if (
+            covered is None
+            or self.clock() - covered["refreshed_at"] >= self.max_age
+            or covered["start_date"] > params["start_date"]
+            or covered["end_date"] < params["start_date"]
+        ):
+            return None
+
+        fetch_from = (date.fromisoformat(covered["end_date"]) - timedelta(days=self.overlap_days)).isoformat()
+        return min(max(fetch_from, params["start_date"]), params["end_date"])
+
+    def read(self, params: Dict[str, Any], until: str) -> List[Dict[str, Any]]:
+        """Reads the archived transactions matching a query which are dated before ``until``."""
+        with self._lock:
+            selected = [self._select(params, until, partition) for partition in self._partitions(params)]
+
+        if not selected:
+            return []
+
+        records = np.concatenate(selected)
+        records = records[np.argsort(records["date"], kind="stable")]
+        return [self._decode(record) for record in records]
+
+    def append(self, transactions: Iterable[Transaction]) -> None:
+        """Adds (new versions of) transactions to the archive."""
+        with self._lock:
+            partition_ids = self._load_partition_ids()
+            by_partition: Dict[str, List[Tuple]] = {}
+            new_strings: List[str] = []
+            for t in transactions:
+                partition = self._partition(t.asset_id, t.plaid_account_id)
+                previous = partition_ids.get(t.id)
+                if previous is not None and previous != partition:
+                    by_partition.setdefault(previous, []).append(self._moved(t.id))
+                partition_ids[t.id] = partition
+                by_partition.setdefault(partition, []).append(self._encode(t, new_strings))
+
+            if new_strings:
+                with open(self._strings_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(s) + "\n" for s in new_strings)
+
+            for partition, rows in by_partition.items():
+                with open(os.path.join(self.path, f"{partition}.bin"), "ab") as f:
+                    f.write(np.array(rows, dtype=RECORD).tobytes())
+
+    def cover(self, params: Dict[str, Any], full: bool) -> None:
+        """Records that the archive holds every transaction for a query's dates (``full`` if they were all fetched)."""
+        if "start_date" not in params or "end_date" not in params:
+            return
+
+        with self._lock:
+            key = shape_key(params)
+            covered = self.coverage.get(key)
+            if full or covered is None:
+                self.coverage[key] = {
+                    "start_date": params["start_date"],
+                    "end_date": params["end_date"],
+                    "refreshed_at": self.clock(),
+                }
+            else:
+                covered["start_date"] = min(covered["start_date"], params["start_date"])
+                covered["end_date"] = max(covered["end_date"], params["end_date"])
+
+            # Write to a temporary file first so that an interrupted write can't corrupt the coverage
+            temp_path = f"{self._coverage_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.coverage, f)
+            os.replace(temp_path, self._coverage_path)
+
+    @property
+    def _strings_path(self) -> str:
+        return os.path.join(self.path, "strings.jsonl")
+
+    @property
+    def _coverage_path(self) -> str:
+        return os.path.join(self.path, "coverage.json")
+
+    @staticmethod
+    def _partition(asset_id: Optional[int], plaid_account_id: Optional[int]) -> str:
+        if asset_id is not None:
+            return f"asset-{asset_id}"
+        if plaid_account_id is not None:
+            return f"plaid_account-{plaid_account_id}"
+        return "unassigned"
+
+    def _partitions(self, params: Dict[str, Any]) -> List[str]:
+        if "asset_id" in params or "plaid_account_id" in params:
+            return [self._partition(params.get("asset_id"), params.get("plaid_account_id"))]
+
+        return [
+            os.path.splitext(os.path.basename(path))[0]
+            for path in sorted(glob.glob(os.path.join(self.path, "*.bin")))
+        ]
+
+    def _latest_records(self, partition: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A partition's records (memory-mapped, rather than read into memory) and the positions of
+        the most recent record for each transaction still in the partition.
+        """
+        path = os.path.join(self.path, f"{partition}.bin")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        cached = self._latest.get(partition)
+        if cached is not None and cached[0] == size:
+            return cached[1], cached[2]
+
+        if size < RECORD.itemsize:
+            return np.empty(0, dtype=RECORD), np.empty(0, dtype=np.int64)
+
+        records = np.memmap(path, dtype=RECORD, mode="r", shape=(size // RECORD.itemsize,))
+
+        # Later records supersede earlier ones, so keep the last occurrence of each ID (unless it moved)
+        _, last = np.unique(records["id"][::-1], return_index=True)
+        latest = np.sort(len(records) - 1 - last)
+        latest = latest[records["date"][latest] != MOVED]
+        self._latest[partition] = (size, records, latest)
+        return records, latest
+
+    def _select(self, params: Dict[str, Any], until: str, partition: str) -> np.ndarray:
+        """
+        The latest records in a partition matching a query. Only the columns being filtered on are
+        read for every transaction, and only the matching records are read in full.
+        """
+        records, latest = self._latest_records(partition)
+
+        def column(name: str) -> np.ndarray:
+            return records[name][latest]
+
+        dates = column("date")
+        mask = dates < date_ordinal(until)
+        if "start_date" in params:
+            mask &= dates >= date_ordinal(params["start_date"])
+        if "end_date" in params:
+            mask &= dates <= date_ordinal(params["end_date"])
+        for key in ("category_id", "asset_id", "plaid_account_id"):
+            if key in params:
+                mask &= column(key) == int(params[key])
+        if "status" in params:
+            mask &= column("status") == self.string_codes.get(params["status"], NONE)
+        if "is_group" in params:
+            mask &= column("is_group") == (str(params["is_group"]).lower() == "true")
+        if "tag_id" in params:
+            mask &= np.isin(column("tags"), self._tag_codes(params["tag_id"]))
+
+        return np.asarray(records[latest[mask]])
+
+    def _load_partition_ids(self) -> Dict[int, str]:
+        """The partition each archived transaction is currently in, read from the archive the first time it's needed."""
+        if self._partition_ids is None:
+            self._partition_ids = {}
+            for partition in self._partitions({}):
+                records, latest = self._latest_records(partition)
+                self._partition_ids.update((int(id), partition) for id in records["id"][latest])
+
+        return self._partition_ids
+
+    @staticmethod
+    def _moved(id: int) -> Tuple:
+        """A record marking that a transaction has moved out of the partition it's written to."""
+        return tuple(id if field == "id" else MOVED if field == "date" else NONE for field in RECORD.names)
+
+    def _tag_codes(self, tag_id: Any) -> List[int]:
+        return [
+            code
+            for code, value in enumerate(self.strings)
+            if value.startswith(TAGS_PREFIX)
+            and any(tag.get("id") == tag_id for tag in json.loads(value[len(TAGS_PREFIX):]))
+        ]
+
+    def _code(self, value: Optional[str], new_strings: List[str]) -> int:
+        if value is None:
+            return NONE
+
+        code = self.string_codes.get(value)
+        if code is None:
+            code = self.string_codes[value] = len(self.strings)
+            self.strings.append(value)
+            new_strings.append(value)
+
+        return code
+
+    def _encode(self, t: Transaction, new_strings: List[str]) -> Tuple:
+        values = {
+            "id": t.id,
+            "date": date_ordinal(t.date),
+            "amount": to_minor_units(t.amount),
+            "tags": self._code(
+                TAGS_PREFIX + json.dumps([tag.__dict__ for tag in t.tags], sort_keys=True), new_strings
+            ),
+            "is_group": bool(t.is_group),
+            **{field: self._code(getattr(t, field), new_strings) for field in STRING_FIELDS},
+            **{field: NONE if getattr(t, field) is None else getattr(t, field) for field in ID_FIELDS},
+        }
+        return tuple(values[field] for field in RECORD.names)
+
+    def _decode(self, record: np.void) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "id": int(record["id"]),
+            "date": date.fromordinal(int(record["date"])).isoformat(),
+            "amount": f"{Decimal(int(record['amount'])).scaleb(-4):.4f}",
+            "tags": json.loads(self.strings[record["tags"]][len(TAGS_PREFIX):]),
+            "is_group": bool(record["is_group"]),
+        }
+        for field in STRING_FIELDS:
+            code = int(record[field])
+            data[field] = None if code == NONE else self.strings[code]
+        for field in ID_FIELDS:
+            value = int(record[field])
+            data[field] = None if value == NONE else value
+
+        return data
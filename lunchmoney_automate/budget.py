@@ -0,0 +1,186 @@
+from datetime import date, timedelta
+import logging
+import math
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from .query import TransactionQuery
+from .slicing import DateSlicer
+from .store import TransactionStore
+from .task import Task
+from .usage import Usage
+from .utils import Transaction, group
+
+log = logging.getLogger(__name__)
+
+# The typical size (in bytes) of a transaction in Lunch Money's responses
+TRANSACTION_BYTES = 800
+
+# The number of transactions per day assumed for a query before any have been fetched
+TRANSACTIONS_PER_DAY = 2.0
+
+
+class Estimate:
+    """
+    The requests a run is expected to make, and the data it is expected to fetch. Writes are an
+    upper bound, and both writes and bytes are unknown (None) when the number of transactions
+    a query will return can't be estimated (when it isn't limited to a range of dates).
+    """
+
+    def __init__(self, reads: int = 0, writes: Optional[int] = 0, bytes: Optional[int] = 0) -> None:
+        self.reads = reads
+        self.writes = writes
+        self.bytes = bytes
+
+    def add(self, reads: int, writes: Optional[int], bytes: Optional[int]) -> None:
+        self.reads += reads
+        self.writes = None if self.writes is None or writes is None else self.writes + writes
+        self.bytes = None if self.bytes is None or bytes is None else self.bytes + bytes
+
+    def __str__(self) -> str:
+        writes = "?" if self.writes is None else self.writes
+        bytes = "?" if self.bytes is None else self.bytes
+        return f"reads={self.reads} writes<={writes} bytes~{bytes}"
+
+
+class CostEstimator:
+    """
+    Estimates the requests each task will make in a run, from the queries they describe with
+    ``rules`` and the transactions already known to the store (or its archive).
+
+    Reads are the number of (sliced) requests for each query which isn't already cached. Writes
+    come from each task's ``max_writes`` for the transactions matching its rules, and bytes from
+    the number of transactions fetched. Queries which aren't cached are read from the archive,
+    and queries for accounts the archive doesn't cover yet (like a new spare change pair) are
+    estimated from whatever the archive has for the account. Without an archive, the number of
+    transactions is estimated from their dates, at the rate the slicer has seen so far (or
+    ``transactions_per_day`` before any have been fetched), with writes from each task's
+    ``max_writes_for_count``.
+    """
+
+    def __init__(
+        self,
+        store: TransactionStore,
+        slicer: Optional[DateSlicer] = None,
+        transaction_bytes: int = TRANSACTION_BYTES,
+        transactions_per_day: float = TRANSACTIONS_PER_DAY,
+    ) -> None:
+        self.store = store
+        self.slicer = slicer or DateSlicer()
+        self.transaction_bytes = transaction_bytes
+        self.transactions_per_day = transactions_per_day
+
+    def estimate(self, tasks: Mapping[str, Task], fused: bool = False) -> Dict[str, Estimate]:
+        """
+        Estimates a run of each task. When the run fetches the transactions for every task at
+        once (``fused``), those reads are estimated under ``rules`` instead of the tasks.
+        """
+        estimates: Dict[str, Estimate] = {}
+        rules: Dict[str, Tuple[str, str, TransactionQuery]] = {}
+        for name, task in tasks.items():
+            try:
+                rules.update({f"{name}.{rule}": (name, rule, query) for rule, query in task.rules().items()})
+            except Exception as ex:
+                # The task will most likely fail the same way when it runs
+                log.warning(f"Unable to estimate the cost of task {name}: {ex}")
+                continue
+            estimates[name] = Estimate()
+
+        fetched: Dict[Tuple, Tuple[Optional[List[Transaction]], Optional[int]]] = {}
+        if fused:
+            # Every distinct query is fetched once for all of the rules sharing it
+            estimates["rules"] = Estimate()
+            queries = group(rules.values(), key=lambda rule: tuple(sorted(rule[2].params().items())))
+            for key, sharing in queries.items():
+                reads, transactions, count, size = self._query(dict(key), fetched)
+                estimates["rules"].add(reads, 0, size)
+
+                for name, rule, query in sharing:
+                    estimates[name].add(0, self._writes(tasks[name], rule, query, transactions, count), 0)
+        else:
+            for name, rule, query in rules.values():
+                reads, transactions, count, size = self._query(query.params(), fetched)
+                estimates[name].add(reads, self._writes(tasks[name], rule, query, transactions, count), size)
+
+        return estimates
+
+    def _query(
+        self, params: Dict[str, Any], fetched: Dict[Tuple, Tuple[Optional[List[Transaction]], Optional[int]]]
+    ) -> Tuple[int, Optional[List[Transaction]], Optional[int], Optional[int]]:
+        """
+        The requests for a query, the transactions it's expected to return (or just how many, when
+        they can't be known yet), and the bytes it's expected to fetch.
+        """
+        key = tuple(sorted(params.items()))
+        if key in fetched:
+            # Queries made earlier in the run are cached by then
+            return (0, *fetched[key], 0)
+
+        transactions = self.store.cached(params)
+        if transactions is not None:
+            return 0, transactions, len(transactions), 0
+
+        fetched[key] = (None, None)
+        if "start_date" not in params or "end_date" not in params:
+            return 1, None, None, None
+
+        fetch_from = params["start_date"]
+        archive = self.store.archive
+        if archive is None:
+            days = (date.fromisoformat(params["end_date"]) - date.fromisoformat(fetch_from)).days + 1
+            count = math.ceil(max(days, 0) * (self.slicer.per_day() or self.transactions_per_day))
+            fetched[key] = (None, count)
+            return len(self.slicer.slices(fetch_from, params["end_date"])), None, count, count * self.transaction_bytes
+
+        fetch_from = archive.fetch_from(params) or fetch_from
+        until = (date.fromisoformat(params["end_date"]) + timedelta(days=1)).isoformat()
+        transactions = [Transaction(**item) for item in archive.read(params, until=until)]
+        size = sum(1 for t in transactions if t.date >= fetch_from) * self.transaction_bytes
+        fetched[key] = (transactions, len(transactions))
+
+        return len(self.slicer.slices(fetch_from, params["end_date"])), transactions, len(transactions), size
+
+    def _writes(
+        self,
+        task: Task,
+        rule: str,
+        query: TransactionQuery,
+        transactions: Optional[List[Transaction]],
+        count: Optional[int],
+    ) -> Optional[int]:
+        if transactions is not None:
+            return task.max_writes(rule, query.filter(transactions))
+        if count is not None:
+            return task.max_writes_for_count(rule, count)
+
+        return None
+
+
+def report(estimates: Mapping[str, Estimate], actuals: Mapping[str, Usage]) -> List[str]:
+    """
+    Compares the requests each task actually made in a run with its estimate, with a line per
+    task (marking those which exceeded their estimate) and a line for the totals.
+    """
+    lines = []
+    total, total_estimate = Usage(), Estimate()
+    for name in [*estimates, *(name for name in actuals if name not in estimates)]:
+        estimate, usage = estimates.get(name), actuals.get(name)
+        over = (
+            estimate is not None
+            and usage is not None
+            and (usage.reads > estimate.reads or (estimate.writes is not None and usage.writes > estimate.writes))
+        )
+        lines.append(
+            f"{name}: estimated {estimate if estimate is not None else '-'}, "
+            f"actual {usage if usage is not None else '-'}" + (" (over estimate)" if over else "")
+        )
+
+        if estimate is not None:
+            total_estimate.add(estimate.reads, estimate.writes, estimate.bytes)
+        if usage is not None:
+            total.reads += usage.reads
+            total.writes += usage.writes
+            total.bytes += usage.bytes
+            total.seconds += usage.seconds
+
+    lines.append(f"total: estimated {total_estimate}, actual {total}")
+    return lines
@@ -0,0 +1,160 @@
+from collections import defaultdict, deque
+from datetime import date, datetime
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODES = ("record", "replay", "replay-fast")
+
+# Response headers which are worth keeping (the rest are either noise or could identify the session)
+RECORDED_HEADERS = {"content-type", "retry-after"}
+
+REDACTED = "<redacted>"
+
+
+class CassetteError(Exception):
+    pass
+
+
+def request_key(method: str, endpoint: str, kwargs: Dict[str, Any]) -> str:
+    """Identifies a request by everything which could affect its response (other than the token)."""
+    return json.dumps(
+        {
+            "method": method,
+            "endpoint": endpoint,
+            "params": kwargs.get("params"),
+            "json": kwargs.get("json"),
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+
+class Cassette:
+    """
+    Records the Lunch Money API requests made during a run (and their responses), so that the
+    run can be replayed offline later.
+
+    Interactions are stored as gzipped JSON lines, without the API token. When replaying,
+    each request is answered with the next recorded response for the same method, endpoint
+    and parameters, after waiting as long as the original request took (or immediately, in
+    ``replay-fast`` mode).
+
+    Each interaction records the (UTC) day it was recorded on, so that a replayed run can work
+    on the same dates (which the requests' date ranges are worked out from) on a later day.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "record",
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}' (expected one of {', '.join(MODES)})")
+
+        self.path = path
+        self.mode = mode
+        self.sleep = sleep
+
+        self.interactions: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.recorded_on: Optional[date] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+        if self.replaying:
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        """Configures a cassette using ``LUNCHMONEY_CASSETTE`` and ``LUNCHMONEY_CASSETTE_MODE``, if set."""
+        path = os.getenv("LUNCHMONEY_CASSETTE")
+        if not path:
+            return None
+
+        return cls(path, os.getenv("LUNCHMONEY_CASSETTE_MODE", "record"))
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode != "record"
+
+    def record(
+        self,
+        method: str,
+        endpoint: str,
+        kwargs: Dict[str, Any],
+        response: requests.Response,
+        elapsed: float,
+        token: Optional[str] = None,
+    ) -> None:
+        line = json.dumps(
+            {
+                "request": json.loads(request_key(method, endpoint, kwargs)),
+                "response": {
+                    "status_code": response.status_code,
+                    "headers": {
+                        k: v for k, v in response.headers.items() if k.lower() in RECORDED_HEADERS
+                    },
+                    "body": response.text,
+                },
+                "elapsed": elapsed,
+                "recorded_on": datetime.utcnow().date().isoformat(),
+            },
+            default=str,
+        )
+        if token:
+            line = line.replace(token, REDACTED)
+
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.path, "wt", encoding="utf-8")
+
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def replay(self, method: str, endpoint: str, kwargs: Dict[str, Any], url: str) -> requests.Response:
+        key = request_key(method, endpoint, kwargs)
+        with self._lock:
+            queue = self.interactions.get(key)
+            if not queue:
+                raise CassetteError(f"No recorded response for {method} {endpoint} in {self.path}")
+
+            interaction = queue.popleft()
+
+        if self.mode == "replay":
+            self.sleep(interaction["elapsed"])
+
+        response = requests.Response()
+        response.status_code = interaction["response"]["status_code"]
+        response.headers = CaseInsensitiveDict(interaction["response"]["headers"])
+        response._content = interaction["response"]["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = url
+        response.reason = "Replayed"
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                interaction = json.loads(line)
+                if self.recorded_on is None and "recorded_on" in interaction:
+                    self.recorded_on = date.fromisoformat(interaction["recorded_on"])
+
+                request = interaction["request"]
+                key = request_key(request["method"], request["endpoint"], request)
+                self.interactions[key].append(interaction)
@@ -0,0 +1,166 @@
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .utils import Account, Transaction
+
+# Lunch Money reports amounts with four decimal places
+MINOR_UNITS = 10_000
+
+# The value used to represent a missing ID in the integer columns
+NONE = -1
+
+
+# The same amounts and (especially) dates recur across transactions and tasks, so their
+# conversions are cached rather than repeated for every table
+@lru_cache(maxsize=65536)
+def to_minor_units(amount: Union[str, Decimal]) -> int:
+    return int((Decimal(amount) * MINOR_UNITS).to_integral_value())
+
+
+@lru_cache(maxsize=65536)
+def date_ordinal(value: str) -> int:
+    return date.fromisoformat(value[:10]).toordinal()
+
+
+class TransactionTable:
+    """
+    A columnar view over a set of transactions which allows candidate transactions to be
+    selected using vectorized masks rather than by filtering each transaction in turn.
+
+    Transactions can be removed from the table (once they have been linked, for example),
+    after which they are excluded from ``active`` and from iteration.
+
+    Candidates can also be found by amount using a sorted index. When ``exchange_rates`` (the
+    value of each currency in a common base currency) are provided, the index holds amounts
+    converted to the base currency, so that transactions in different currencies can be compared.
+    """
+
+    def __init__(
+        self,
+        transactions: Iterable[Transaction],
+        exchange_rates: Optional[Dict[str, Union[str, float, Decimal]]] = None,
+    ) -> None:
+        self.transactions: List[Transaction] = list(transactions)
+        self.payee_codes: Dict[str, int] = {}
+        self.currency_codes: Dict[str, int] = {}
+        self.exchange_rates = (
+            None if exchange_rates is None else {k.lower(): float(v) for k, v in exchange_rates.items()}
+        )
+
+        count = len(self.transactions)
+        self.ids = np.fromiter((t.id for t in self.transactions), dtype=np.int64, count=count)
+        self.asset_ids = self._ids(t.asset_id for t in self.transactions)
+        self.plaid_account_ids = self._ids(t.plaid_account_id for t in self.transactions)
+        self.category_ids = self._ids(t.category_id for t in self.transactions)
+        self.amounts = np.fromiter(
+            (to_minor_units(t.amount) for t in self.transactions), dtype=np.int64, count=count
+        )
+        self.dates = np.fromiter(
+            (date_ordinal(t.date) for t in self.transactions), dtype=np.int64, count=count
+        )
+        self.payees = np.fromiter(
+            (self.payee_codes.setdefault(t.payee, len(self.payee_codes)) for t in self.transactions),
+            dtype=np.int64,
+            count=count,
+        )
+
+        self.currencies = np.fromiter(
+            (self.currency_codes.setdefault((t.currency or "").lower(), len(self.currency_codes)) for t in self.transactions),
+            dtype=np.int64,
+            count=count,
+        )
+
+        self.active = np.ones(count, dtype=bool)
+        self._rows = {t.id: i for i, t in enumerate(self.transactions)}
+        self._amount_index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.active))
+
+    def __iter__(self) -> Iterator[Transaction]:
+        return iter(self.select(self.active))
+
+    def __contains__(self, transaction: Transaction) -> bool:
+        row = self._rows.get(transaction.id)
+        return row is not None and bool(self.active[row])
+
+    def payee_code(self, payee: str) -> int:
+        return self.payee_codes.get(payee, NONE)
+
+    def account_mask(self, account: Account) -> np.ndarray:
+        return self.active & (getattr(self, f"{account.kind}_ids") == account.id)
+
+    def date_offsets(self, value: str) -> np.ndarray:
+        return np.abs(self.dates - date_ordinal(value))
+
+    def convert(self, amount: Union[str, Decimal], currency: Optional[str]) -> float:
+        """Converts an amount into the minor units used by the amount index (NaN if its currency has no rate)."""
+        if self.exchange_rates is None:
+            return float(to_minor_units(amount))
+
+        return to_minor_units(amount) * self.exchange_rates.get((currency or "").lower(), np.nan)
+
+    def amounts_between(self, low: float, high: float) -> np.ndarray:
+        """
+        A mask of the active transactions whose (converted) amount is in ``[low, high]``, which is
+        empty when either bound is NaN (an amount in a currency without a rate).
+        """
+        mask = np.zeros(len(self.transactions), dtype=bool)
+        if np.isnan(low) or np.isnan(high):
+            return mask
+
+        order, values = self._index_amounts()
+        start = np.searchsorted(values, low, side="left")
+        end = np.searchsorted(values, high, side="right")
+
+        mask[order[start:end]] = True
+        return mask & self.active
+
+    def amounts_near(self, amount: float, tolerance: float = 0.0) -> np.ndarray:
+        """A mask of the active transactions whose (converted) amount is within a relative ``tolerance`` of ``amount``."""
+        margin = abs(amount) * tolerance
+        return self.amounts_between(amount - margin, amount + margin)
+
+    def select(self, mask: np.ndarray) -> List[Transaction]:
+        return [self.transactions[i] for i in np.flatnonzero(mask)]
+
+    def first(self, mask: np.ndarray, key: Optional[np.ndarray] = None) -> Optional[Transaction]:
+        """
+        Gets the first transaction selected by the mask, or the one with the lowest key if
+        provided (ties are broken by the order of the table).
+        """
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return None
+
+        if key is None:
+            return self.transactions[rows[0]]
+
+        return self.transactions[rows[np.argmin(key[rows])]]
+
+    def remove(self, transaction: Transaction) -> None:
+        self.active[self._rows[transaction.id]] = False
+
+    def _index_amounts(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._amount_index is None:
+            if self.exchange_rates is None:
+                values = self.amounts.astype(np.float64)
+            else:
+                rates = np.array(
+                    [self.exchange_rates.get(c, np.nan) for c in self.currency_codes], dtype=np.float64
+                )
+                values = self.amounts * rates[self.currencies]
+
+            # NaNs (amounts in currencies without a rate) sort last, so range queries with numeric bounds never include them
+            order = np.argsort(values, kind="stable")
+            self._amount_index = (order, values[order])
+
+        return self._amount_index
+
+    @staticmethod
+    def _ids(values: Iterable[Optional[int]]) -> np.ndarray:
+        return np.fromiter((NONE if v is None else v for v in values), dtype=np.int64)
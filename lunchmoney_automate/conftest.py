@@ -164,7 +164,7 @@ def lunchmoney_api_calls():
                     "notes": None,
                     "category_id": 83,
                     "recurring_id": None,
-                    "asset_id": 153,
+                    "asset_id": 73,
                     "plaid_account_id": None,
                     "status": "uncleared",
                     "is_group": False,
@@ -301,11 +301,32 @@ def lunchmoney_api_calls():
                 },
             ]
         },
+        "GET /v1/tags": [
+            { "id": 801, "name": "needs-pair", "description": "This transaction needs a pair to be created for it automatically" },
+            { "id": 802, "name": "Fun", "description": "This transaction has added fun" },
+        ],
         "POST /v1/transactions": {"ids": [609]},
         "POST /v1/transactions/group": 84389,
         "DELETE /v1/transactions/group/701": {"transactions":[606, 607]}
     }
 
+def matches_params(transaction: dict, params: dict) -> bool:
+    """Applies the /v1/transactions filters (other than the dates, since the fixtures are in the past)."""
+    for key, value in params.items():
+        if key in ("start_date", "end_date"):
+            continue
+        elif key == "is_group":
+            if transaction["is_group"] != (value == "true"):
+                return False
+        elif key == "tag_id":
+            if not any(tag["id"] == value for tag in transaction.get("tags") or []):
+                return False
+        elif transaction.get(key) != value:
+            return False
+
+    return True
+
+
 @pytest.fixture
 def call_lunchmoney(lunchmoney_api_calls):
     def call(method: str, endpoint: str, headers: dict = None, **kwargs):
@@ -313,6 +334,14 @@ def call_lunchmoney(lunchmoney_api_calls):
 
         print(f"{call_spec}: {kwargs}")
 
+        if call_spec == "GET /v1/transactions":
+            return {
+                "transactions": [
+                    t for t in lunchmoney_api_calls[call_spec]["transactions"]
+                    if matches_params(t, kwargs.get("params") or {})
+                ]
+            }
+
         if call_spec in lunchmoney_api_calls:
             return lunchmoney_api_calls[call_spec]
 
@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS members (
+    grp TEXT NOT NULL, owner TEXT NOT NULL, seen_at REAL NOT NULL, PRIMARY KEY (grp, owner)
+);
+"""
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class Coordinator:
+    """
+    Coordinates the runners (processes, or nodes sharing a file system) working on the same
+    budgets, using a SQLite database.
+
+    A runner can either take a lease on a task, so that only one runner works on it at a time,
+    or join the task's group, so that the task's independent units of work (like account
+    pairs) are partitioned between every runner in the group. Each unit is claimed (with a
+    lease of its own) before it is worked on, so a unit is never worked on by two runners at
+    once, even while runners are joining or leaving. Leases and memberships expire after
+    ``ttl`` seconds, so a runner which dies doesn't block (or keep work from) the others, which
+    means ``ttl`` should be longer than a run takes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        owner: Optional[str] = None,
+        ttl: float = 900.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.clock = clock
+
+        # The units this runner has claimed in each group it has joined
+        self._claims: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["Coordinator"]:
+        """Creates a coordinator from a ``{"path": ..., "ttl": ...}`` configuration, if there is one."""
+        if not config:
+            return None
+
+        return cls(config["path"], owner=config.get("owner"), ttl=config.get("ttl", 900.0))
+
+    def acquire(self, name: str) -> bool:
+        """Takes (or renews) the lease on ``name``, unless another runner holds it."""
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            now = self.clock()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                db.execute("ROLLBACK")
+                return False
+
+            db.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, self.owner, now + self.ttl),
+            )
+            db.execute("COMMIT")
+            return True
+
+    def release(self, name: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    @contextmanager
+    def lease(self, name: str) -> Iterator[bool]:
+        """Holds the lease on ``name`` for the duration of the block, yielding whether it was acquired."""
+        acquired = self.acquire(name)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(name)
+
+    def join(self, group: str) -> List[str]:
+        """Joins (or renews membership of) a group, returning the group's current members."""
+        now = self.clock()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO members (grp, owner, seen_at) VALUES (?, ?, ?)",
+                (group, self.owner, now),
+            )
+            db.execute("DELETE FROM members WHERE seen_at <= ?", (now - self.ttl,))
+            members = self._members(db, group, now)
+
+        with self._lock:
+            self._claims.setdefault(group, set())
+
+        return members
+
+    def leave(self, group: str) -> None:
+        with self._lock:
+            claims = self._claims.pop(group, set())
+
+        with self._connect() as db:
+            db.execute("DELETE FROM members WHERE grp = ? AND owner = ?", (group, self.owner))
+            db.executemany(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                [(f"{group}:{unit}", self.owner) for unit in claims],
+            )
+
+    def owns(self, group: str, unit: str) -> bool:
+        """
+        Determines whether this runner is responsible for a unit of work in a group, given the
+        group's current members. Units are assigned by rendezvous hashing, so that when runners
+        join or leave, only the units of those runners move.
+        """
+        with self._connect() as db:
+            return self._owner(self._members(db, group, self.clock()), unit) == self.owner
+
+    def claim(self, group: str, unit: str) -> bool:
+        """
+        Claims a unit of work in a group this runner has joined, if the unit is this runner's
+        (given the group's current members) and no other runner has claimed it. Claims are held
+        until the runner leaves the group.
+        """
+        with self._lock:
+            if unit in self._claims.get(group, ()):
+                return True
+
+        name = f"{group}:{unit}"
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            now = self.clock()
+            if self._owner(self._members(db, group, now), unit) != self.owner:
+                db.execute("ROLLBACK")
+                return False
+
+            row = db.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                # Claimed by a runner which owned the unit before this one joined
+                db.execute("ROLLBACK")
+                return False
+
+            db.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, self.owner, now + self.ttl),
+            )
+            db.execute("COMMIT")
+
+        with self._lock:
+            self._claims.setdefault(group, set()).add(unit)
+        return True
+
+    def _members(self, db: sqlite3.Connection, group: str, now: float) -> List[str]:
+        members = set(
+            row[0]
+            for row in db.execute("SELECT owner FROM members WHERE grp = ? AND seen_at > ?", (group, now - self.ttl))
+        )
+        return sorted(members | {self.owner})
+
+    def _owner(self, members: List[str], unit: str) -> str:
+        return max(members, key=lambda member: hashlib.sha1(f"{member}:{unit}".encode("utf-8")).digest())
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+@contextmanager
+def coordinated(coordinator: Optional[Coordinator], name: str, task: Any, partition: bool = False) -> Iterator[bool]:
+    """
+    Runs the block as the only runner of a task (yielding False if another runner has it), or,
+    when ``partition`` is set, as one of the runners sharing the task's units of work.
+    """
+    if coordinator is None:
+        yield True
+        return
+
+    if not partition:
+        with coordinator.lease(name) as acquired:
+            yield acquired
+        return
+
+    coordinator.join(name)
+    task.partition = (coordinator, name)
+    try:
+        yield True
+    finally:
+        task.partition = None
+        coordinator.leave(name)
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from opentelemetry import trace
+
+from .coordination import Coordinator, coordinated
+from .store import TransactionStore
+from .task import Task
+
+
+class Job:
+    def __init__(self, name: str, task: Task, interval: float) -> None:
+        self.name = name
+        self.task = task
+        self.interval = interval
+
+        self.next_run = 0.0
+        self.running = False
+
+
+class Daemon:
+    """
+    Keeps the automation running in a long-lived process, rather than as a one-shot job.
+
+    Each task runs on its own interval (on a small worker pool, so that slow tasks don't hold
+    up quick ones) and all of them share a single store. That keeps reference data and the
+    transactions we've already seen warm between runs, so each run only needs to fetch the
+    most recent transactions.
+
+    With a ``coordinator``, replicas of the daemon can run side by side: each task either runs
+    on one replica at a time or, with ``partition``, has its work split between the replicas.
+    """
+
+    def __init__(
+        self,
+        tasks: Dict[str, Task],
+        intervals: Dict[str, float],
+        store: TransactionStore,
+        default_interval: float = 3600,
+        workers: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+        coordinator: Optional[Coordinator] = None,
+        partition: bool = False,
+    ) -> None:
+        self.jobs = [
+            Job(name, task, intervals.get(name, default_interval))
+            for name, task in tasks.items()
+        ]
+        self.store = store
+        self.workers = workers
+        self.clock = clock
+        self.coordinator = coordinator
+        self.partition = partition
+
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.tracer = trace.get_tracer(self.__class__.__name__)
+
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+        for job in self.jobs:
+            job.task.store = store
+
+    def run(self, max_runs: Optional[int] = None) -> None:
+        """Runs tasks as they become due until ``stop`` is called (or ``max_runs`` tasks have been started)."""
+        runs = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lunchmoney") as pool:
+            while not self._stopped.is_set():
+                with self._lock:
+                    now = self.clock()
+                    for job in self.jobs:
+                        if job.running or job.next_run > now:
+                            continue
+                        if max_runs is not None and runs >= max_runs:
+                            break
+
+                        job.running = True
+                        runs += 1
+                        pool.submit(self._run_job, job)
+
+                    idle = [job.next_run for job in self.jobs if not job.running]
+
+                if max_runs is not None and runs >= max_runs:
+                    break
+
+                self._wake.wait(max(0.0, min(idle) - now) if idle else None)
+                self._wake.clear()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+
+    def _run_job(self, job: Job) -> None:
+        started = self.clock()
+        with self.tracer.start_as_current_span(
+            f"daemon.{job.name}", attributes={"interval": job.interval}
+        ) as span:
+            try:
+                # Events may be processing changes with the same task
+                with job.task.lock, coordinated(self.coordinator, job.name, job.task, self.partition) as held:
+                    if held:
+                        job.task.refresh_window()
+                        self.store.invalidate()
+                        job.task.run()
+                    else:
+                        self.log.info(f"Skipping task {job.name} since another replica is running it")
+            except Exception as ex:
+                self.log.exception(f"Task {job.name} failed: {ex}")
+                span.record_exception(ex)
+            finally:
+                with self._lock:
+                    job.running = False
+                    job.next_run = started + job.interval
+                self._wake.set()
+
+            span.set_attribute("duration", self.clock() - started)
@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# The (monotonic) time by which the current run needs to have finished, if any
+current_deadline: ContextVar[Optional[float]] = ContextVar("lunchmoney_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bounds the time that the work within the block may take. Deadlines nest, so an inner
+    deadline can shorten (but never extend) an outer one, and they are carried into any
+    threads which copy the current context.
+    """
+    if seconds is None:
+        yield
+        return
+
+    outer = current_deadline.get()
+    at = time.monotonic() + seconds
+    token = current_deadline.set(at if outer is None else min(outer, at))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """The number of seconds left before the current deadline (or None if there isn't one)."""
+    at = current_deadline.get()
+    if at is None:
+        return None
+
+    return max(0.0, at - time.monotonic())
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
@@ -0,0 +1,100 @@
+from collections import Counter
+import logging
+import threading
+from typing import Any, Callable, Collection, Dict, Optional
+
+from opentelemetry.trace import Span
+
+# How many of each kind of message are always emitted, before sampling kicks in
+SAMPLE_FIRST = 5
+
+# After the first few, every this-many-th message of a kind is emitted
+SAMPLE_EVERY = 100
+
+# The kinds of message which record a change made to Lunch Money, and so are never sampled, so
+# that the log is a complete record of what was changed
+MUTATIONS = frozenset({"created", "grouped", "linked", "split"})
+
+
+class lazy:
+    """Defers computing a message argument until the message is actually rendered."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn: Callable[[], Any]) -> None:
+        self.fn = fn
+
+    def __str__(self) -> str:
+        return str(self.fn())
+
+
+class Diagnostics:
+    """
+    Structured diagnostics for the per-transaction (and per-account) messages in a task's loops.
+
+    Each message has a kind (like ``no_match``) and a %-style template, which is only rendered
+    when its level is enabled and the message survives sampling: the first ``sample_first``
+    messages of each kind are emitted, then only every ``sample_every``-th. Messages of the
+    ``unsampled`` kinds (the changes made to Lunch Money) are always emitted. Every message is
+    counted regardless, and ``summary`` emits a single record with the counts for the run, so
+    the cost of logging scales with what is actually written.
+    """
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        sample_first: int = SAMPLE_FIRST,
+        sample_every: int = SAMPLE_EVERY,
+        unsampled: Collection[str] = MUTATIONS,
+    ) -> None:
+        self.log = log
+        self.sample_first = sample_first
+        self.sample_every = sample_every
+        self.unsampled = frozenset(unsampled)
+
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def debug(self, kind: str, message: str, *args: Any) -> None:
+        self.emit(logging.DEBUG, kind, message, *args)
+
+    def info(self, kind: str, message: str, *args: Any) -> None:
+        self.emit(logging.INFO, kind, message, *args)
+
+    def warning(self, kind: str, message: str, *args: Any) -> None:
+        self.emit(logging.WARNING, kind, message, *args)
+
+    def emit(self, level: int, kind: str, message: str, *args: Any) -> None:
+        with self._lock:
+            self.counts[kind] += 1
+            n = self.counts[kind]
+
+        if not self.log.isEnabledFor(level):
+            return
+
+        if kind not in self.unsampled and n > self.sample_first and n % self.sample_every != 0:
+            return
+
+        self.log.log(level, message, *args, extra={"diagnostic": kind, "occurrence": n})
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+
+    def summary(self, span: Optional[Span] = None) -> Dict[str, int]:
+        """Emits a summary record with the number of messages of each kind (and adds them to ``span``)."""
+        with self._lock:
+            counts = dict(self.counts)
+
+        if span is not None:
+            for kind, count in counts.items():
+                span.set_attribute(f"diagnostics.{kind}", count)
+
+        if counts and self.log.isEnabledFor(logging.INFO):
+            self.log.info(
+                "Summary: %s",
+                ", ".join(f"{kind}={count}" for kind, count in sorted(counts.items())),
+                extra={"diagnostic": "summary", "counts": counts},
+            )
+
+        return counts
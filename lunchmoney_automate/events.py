@@ -0,0 +1,151 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+from typing import Iterable, List, Optional
+
+from opentelemetry import trace
+import requests
+
+from .store import TransactionStore
+from .task import Task
+from .utils import call_lunchmoney
+
+
+class EventProcessor:
+    """
+    Processes notifications about new or changed transactions.
+
+    Rather than polling the full window of transactions, only the changed transactions are
+    fetched and handed to each task's ``process`` method, which fetches just the candidates
+    that could be linked to them.
+    """
+
+    def __init__(self, tasks: List[Task], store: TransactionStore) -> None:
+        self.tasks = tasks
+        self.store = store
+
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.tracer = trace.get_tracer(self.__class__.__name__)
+
+        for task in tasks:
+            task.store = store
+
+    def process(self, transaction_ids: Iterable[int]) -> None:
+        transaction_ids = sorted(set(transaction_ids))
+        with self.tracer.start_as_current_span("events.process", attributes={"transactions": transaction_ids}):
+            # Candidates need to reflect the latest changes, so we can't rely on earlier queries
+            self.store.invalidate()
+
+            changed = []
+            for id in transaction_ids:
+                try:
+                    changed.append(self.store.put(call_lunchmoney("GET", f"/v1/transactions/{id}")))
+                except requests.HTTPError as ex:
+                    self.log.warning(f"Unable to fetch changed transaction {id}: {ex}")
+
+            if not changed:
+                return
+
+            for task in self.tasks:
+                try:
+                    # The daemon may be running the same task
+                    with task.lock:
+                        task.refresh_window()
+                        task.process(changed)
+                except Exception as ex:
+                    self.log.exception(f"{task.__class__.__name__} failed to process {transaction_ids}: {ex}")
+
+
+class EventConsumer:
+    """
+    Consumes transaction IDs from a queue, processing them in batches so that a burst of
+    notifications (for example when an account syncs) is handled together.
+    """
+
+    def __init__(self, processor: EventProcessor, events: "queue.Queue[int]" = None, batch_delay: float = 1.0) -> None:
+        self.processor = processor
+        self.events = events or queue.Queue()
+        self.batch_delay = batch_delay
+
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="lunchmoney-events", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                batch = [self.events.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            # Give any related notifications a moment to arrive
+            self._stopped.wait(self.batch_delay)
+            while True:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.processor.process(batch)
+
+
+class EventServer(ThreadingHTTPServer):
+    """
+    A small HTTP endpoint which accepts notifications of new or changed transactions.
+
+    Notifications are sent as ``POST /transactions`` with a body of ``{"transaction_ids": [...]}``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, events: "queue.Queue[int]", host: str = "127.0.0.1", port: int = 8080) -> None:
+        super().__init__((host, port), EventHandler)
+        self.events = events
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="lunchmoney-events-http", daemon=True).start()
+
+
+class EventHandler(BaseHTTPRequestHandler):
+    server: EventServer
+
+    def do_POST(self):
+        if self.path != "/transactions":
+            self.send_error(404)
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            transaction_ids = [int(id) for id in body["transaction_ids"]]
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, "Expected a JSON body of the form {\"transaction_ids\": [...]}")
+            return
+
+        for id in transaction_ids:
+            self.server.events.put(id)
+
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        logging.getLogger(EventServer.__name__).debug(format, *args)
+
+
+def publish(url: str, transaction_ids: Iterable[int]) -> None:
+    """Notifies an event server about new or changed transactions (a stand-in for a real publisher)."""
+    requests.post(f"{url}/transactions", json={"transaction_ids": list(transaction_ids)}).raise_for_status()
@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+from opentelemetry import trace
+
+from .deadline import DeadlineExceeded, expired
+
+tracer = trace.get_tracer(__name__)
+
+
+def ref(step: int, *path: str) -> Dict[str, Any]:
+    """
+    A placeholder for (part of) the result of an earlier step in a journaled operation.
+
+    When used as an item in a list, a list result is merged into its parent (which is then
+    treated as a sorted set of IDs) so that, for example, newly created transactions can be
+    grouped with the transaction they were created for.
+    """
+    return {"$ref": [step, *path]}
+
+
+def resolve(value: Any, results: List[Any]) -> Any:
+    if isinstance(value, dict):
+        if "$ref" in value:
+            step, *path = value["$ref"]
+            out = results[step]
+            for key in path:
+                out = out[key]
+            return out
+
+        return {k: resolve(v, results) for k, v in value.items()}
+
+    if isinstance(value, list):
+        out = []
+        spliced = False
+        for item in value:
+            resolved = resolve(item, results)
+            if isinstance(item, dict) and "$ref" in item and isinstance(resolved, list):
+                out.extend(resolved)
+                spliced = True
+            else:
+                out.append(resolved)
+        return sorted(set(out)) if spliced else out
+
+    return value
+
+
+class JournalEntry:
+    def __init__(self, id: str, name: str, steps: List[Dict[str, Any]]) -> None:
+        self.id = id
+        self.name = name
+        self.steps = steps
+        self.results: Dict[int, Any] = {}
+        self.started: set = set()
+        self.failed: set = set()
+        self.finished = False
+
+    @property
+    def in_doubt(self) -> bool:
+        """Whether a step was sent but we never learned whether it was applied."""
+        return any(
+            step not in self.results and step not in self.failed
+            for step in self.started
+        )
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.id}, {len(self.results)}/{len(self.steps)} steps completed)"
+
+
+class Journal:
+    """
+    An append-only journal of the mutations we intend to make against Lunch Money.
+
+    Every operation is recorded (along with each of its steps) before it is sent, and the
+    result of each step is recorded once it completes. If a run dies partway through an
+    operation, ``resume`` finishes it on the next run using the recorded results instead
+    of re-fetching and re-matching transactions. Operations which were interrupted while a
+    request was in flight are skipped, since we cannot tell whether the request was applied
+    and retrying it could create duplicate transactions.
+
+    When no path is provided the journal is kept in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+
+    def execute(self, name: str, steps: List[Dict[str, Any]], call: Callable[..., Any]) -> List[Any]:
+        """
+        Executes each of the provided steps in order, journaling them as it goes.
+        Steps are dictionaries of the ``method``, ``endpoint`` and any keyword arguments
+        for ``call``, and may reference earlier results using ``ref``.
+        """
+        entry = JournalEntry(uuid.uuid4().hex, name, steps)
+        self._append({"type": "intent", "entry": entry.id, "name": name, "steps": steps})
+        return self._run(entry, call)
+
+    def pending(self) -> List[JournalEntry]:
+        entries: Dict[str, JournalEntry] = {}
+        for record in self._records():
+            if record["type"] == "intent":
+                entries[record["entry"]] = JournalEntry(record["entry"], record["name"], record["steps"])
+                continue
+
+            entry = entries.get(record["entry"])
+            if entry is None:
+                continue
+
+            if record["type"] == "started":
+                entry.started.add(record["step"])
+                entry.failed.discard(record["step"])
+            elif record["type"] == "failed":
+                entry.failed.add(record["step"])
+            elif record["type"] == "completed":
+                entry.results[record["step"]] = record["result"]
+            elif record["type"] in ("done", "abandoned"):
+                entry.finished = True
+
+        return [entry for entry in entries.values() if not entry.finished]
+
+    def resume(self, call: Callable[..., Any]) -> int:
+        """Finishes (or skips) any operations left incomplete by a previous run, returning the number finished."""
+        with tracer.start_as_current_span("journal.resume") as span:
+            pending = self.pending()
+            span.set_attribute("pending", len(pending))
+
+            finished = 0
+            for entry in pending:
+                if entry.in_doubt:
+                    self.log.warning(f"Skipping {entry} because it was interrupted while a request was in flight")
+                    self._append({"type": "abandoned", "entry": entry.id, "reason": "in doubt"})
+                    continue
+
+                self.log.info(f"Resuming {entry}")
+                try:
+                    self._run(entry, call)
+                    finished += 1
+                except DeadlineExceeded as ex:
+                    # Nothing was sent, so the rest can be resumed by the next run
+                    self.log.warning(f"Stopped resuming operations since there was no time left: {ex}")
+                    break
+                except requests.HTTPError as ex:
+                    self.log.error(f"Failed to resume {entry}: {ex}")
+                    self._append({"type": "abandoned", "entry": entry.id, "reason": str(ex)})
+
+            if not self.pending():
+                self._truncate()
+
+            span.set_attribute("finished", finished)
+            return finished
+
+    def _run(self, entry: JournalEntry, call: Callable[..., Any]) -> List[Any]:
+        results = [entry.results.get(i) for i in range(len(entry.steps))]
+        for i, step in enumerate(entry.steps):
+            if i in entry.results:
+                continue
+
+            kwargs = resolve({k: v for k, v in step.items() if k not in ("method", "endpoint")}, results)
+
+            # Don't mark the step as started if there's no time left to send it
+            if expired():
+                raise DeadlineExceeded(f"No time left to run step {i} of {entry}")
+
+            self._append({"type": "started", "entry": entry.id, "step": i})
+            try:
+                results[i] = call(step["method"], step["endpoint"], **kwargs)
+            except (requests.HTTPError, DeadlineExceeded):
+                # The API rejected the request (or it was never sent), so we know it wasn't
+                # applied and can retry it
+                self._append({"type": "failed", "entry": entry.id, "step": i})
+                raise
+
+            entry.results[i] = results[i]
+            self._append({"type": "completed", "entry": entry.id, "step": i, "result": results[i]})
+
+        self._append({"type": "done", "entry": entry.id})
+        return results
+
+    def _records(self) -> Iterable[Dict[str, Any]]:
+        if self.path is None or not os.path.exists(self.path):
+            return []
+
+        records = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn write from a crash, which we can safely ignore
+                    continue
+        return records
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if self.path is None:
+            return
+
+        with self._lock, open(self.path, "ab+") as f:
+            # Make sure a torn write from a crash doesn't swallow this record
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+            f.write(json.dumps(record).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate(self) -> None:
+        if self.path is None:
+            return
+
+        with self._lock, open(self.path, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
@@ -1,15 +1,23 @@
-from datetime import datetime, timedelta
-from typing import Iterable, List
+from datetime import date, timedelta
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
 from decimal import Decimal
-import dateparser
 import math
+import numpy as np
 from opentelemetry.trace import Status, StatusCode
 
-from .task import Task
-from .utils import Account, Category, Transaction, call_lunchmoney, parse_date
+from .columnar import TransactionTable, date_ordinal, to_minor_units
+from .diagnostics import lazy
+from .journal import ref
+from .negative_cache import fingerprint, transaction_fingerprint
+from .query import TransactionQuery
+from .task import LOOKBACK_MARGIN_DAYS, Task
+from .utils import Account, Transaction, call_lunchmoney, group
 
 
-class LinkSpareChangeTask(Task):
+class SpareChangePair:
+    """The configuration for a main account whose purchases are rounded up into a savings account."""
+
     def __init__(
         self,
         main_account: str,
@@ -18,13 +26,6 @@ class LinkSpareChangeTask(Task):
         ignore_categories: List[str] = ["Transfers"],
         max_offset_days: int = 1,
     ) -> None:
-        super().__init__()
-
-        now = datetime.utcnow().date()
-
-        self.start_date = (now - timedelta(days=30)).isoformat()
-        self.end_date = now.isoformat()
-
         self.main_account = main_account
         self.savings_account = savings_account
 
@@ -33,162 +34,389 @@ class LinkSpareChangeTask(Task):
 
         self.max_offset_days = max_offset_days
 
+    def spare_change(self, amount: Decimal) -> Decimal:
+        return -self.multiplier * (
+            (math.ceil(abs(amount)) - abs(amount)) or Decimal(1)
+        )
+
+    def __str__(self) -> str:
+        return f"{self.main_account} -> {self.savings_account}"
+
+
+class SpareChangeEngine(Task):
+    """
+    Links spare change for every configured account pair in a single pass.
+
+    Each distinct main and savings account is only fetched once, no matter how many pairs
+    it is part of, and the transactions from every savings account are indexed together so
+    that each purchase can be matched against the pairs for its account.
+    """
+
+    def __init__(self, pairs: List[Dict[str, Any]]) -> None:
+        self.pairs = [SpareChangePair(**pair) for pair in pairs]
+
+        super().__init__()
+
+    def window_days(self) -> int:
+        lag = self.settlement.widest(
+            "link_spare_change:",
+            max((pair.max_offset_days for pair in self.pairs), default=1),
+            keys=[f"link_spare_change:{pair}" for pair in self.pairs],
+        )
+        if lag is None:
+            return self.lookback_days
+
+        return min(self.lookback_days, lag + LOOKBACK_MARGIN_DAYS)
+
     def run(self):
-        with self.tracer.start_as_current_span("link_spare_change"):
-            with self.tracer.start_as_current_span("lunchmoney.accounts"):
-                accounts = [
-                    *(
-                        Account("asset", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/assets")["assets"]
-                    ),
-                    *(
-                        Account("plaid_account", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/plaid_accounts")[
-                            "plaid_accounts"
-                        ]
-                    ),
-                ]
-
-            self.log.debug(f"{len(accounts)} accounts loaded from Lunch Money")
-            for account in accounts:
-                self.log.debug(" - %s %s", account.alias, f"({account.id})")
-
-            with self.tracer.start_as_current_span("lunchmoney.categories"):
-                categories = [
-                    Category(**cat)
-                    for cat in call_lunchmoney("GET", "/v1/categories")["categories"]
-                ]
-
-            self.log.debug(f"{len(categories)} categories loaded from Lunch Money")
-            ignore_categories = list(
-                cat for cat in categories if cat.name in self.ignore_categories
-            )
-            ignored_category_ids = [c.id for c in ignore_categories]
-            for cat in categories:
-                self.log.debug(f"{cat.name} ({cat.id}, ignored:{cat in ignore_categories})")
-
-            main_account = next(a for a in accounts if a.alias == self.main_account)
-            savings_account = next(a for a in accounts if a.alias == self.savings_account)
-
-            with self.tracer.start_as_current_span("lunchmoney.transactions", attributes={"account": main_account.name}):
-                main_transactions = [
-                    Transaction(**cat)
-                    for cat in call_lunchmoney(
-                        "GET",
-                        "/v1/transactions",
-                        params={
-                            f"{main_account.kind}_id": main_account.id,
-                            "start_date": self.start_date,
-                            "end_date": self.end_date,
-                            "is_group": "false",
-                        },
-                    )["transactions"]
-                ]
-
-            self.log.debug(
-                f"{len(main_transactions)} transactions loaded from Lunch Money for {main_account.alias}"
-            )
-            main_transactions = list(
-                filter(
-                    lambda t: t.category_id not in ignored_category_ids, main_transactions
-                )
+        with self.profile("link_spare_change", pairs=[str(p) for p in self.pairs]):
+            self._link_pairs(self._resolve_pairs(), self.start_date, self.end_date)
+
+    def process(self, changed: List[Transaction]) -> None:
+        with self.profile("link_spare_change.changed", transactions=[t.id for t in changed]):
+            resolved_pairs = self._resolve_pairs()
+
+            def in_account(account: Account) -> bool:
+                return any(getattr(t, f"{account.kind}_id") == account.id for t in changed)
+
+            # A new spare change transaction could complete any purchase near it, while a new
+            # purchase can only be completed by spare change near to it.
+            savings_changed = [p for p in resolved_pairs if in_account(p[2])]
+            main_changed = [p for p in resolved_pairs if p not in savings_changed and in_account(p[1])]
+            if not savings_changed and not main_changed:
+                return
+
+            max_offset_days = max(
+                self.settlement.max_offset(f"link_spare_change:{p[0]}", p[0].max_offset_days)
+                for p in [*savings_changed, *main_changed]
             )
-            self.log.debug(
-                f"{len(main_transactions)} transactions in {main_account.alias} account which aren't in the ignored categories"
+            dates = [date.fromisoformat(t.date) for t in changed]
+            start_date = (min(dates) - timedelta(days=max_offset_days)).isoformat()
+            end_date = (max(dates) + timedelta(days=max_offset_days)).isoformat()
+
+            if savings_changed:
+                self._link_pairs(savings_changed, start_date, end_date)
+            if main_changed:
+                self._link_pairs(main_changed, start_date, end_date, sources=set(t.id for t in changed))
+
+    def rules(self) -> Dict[str, TransactionQuery]:
+        return {
+            f"{role}:{kind}:{id}": query
+            for (role, (kind, id)), query in self._queries(self._resolve_pairs(), self.start_date, self.end_date).items()
+        }
+
+    def max_writes(self, rule: str, transactions: List[Transaction]) -> int:
+        # Each purchase is grouped with its spare change, and each existing group of spare change
+        # may need to be split first
+        if rule.startswith("main:"):
+            return len(transactions)
+
+        return len(set(t.group_id for t in transactions if t.group_id is not None))
+
+    def max_writes_for_count(self, rule: str, count: int) -> int:
+        # At most every spare change transaction is in a group of its own
+        return count
+
+    def _resolve_pairs(self) -> List[Tuple[SpareChangePair, Account, Account, Set[int]]]:
+        """Finds the main account, savings account and ignored category IDs for each pair."""
+        with self.phase("fetch"):
+            accounts, categories = self._load_reference_data(call_lunchmoney)
+
+        resolved_pairs = [
+            (
+                pair,
+                next(a for a in accounts if a.alias == pair.main_account),
+                next(a for a in accounts if a.alias == pair.savings_account),
+                set(cat.id for cat in categories if cat.name in pair.ignore_categories),
             )
+            for pair in self.pairs
+        ]
+        for pair, _, _, ignored_category_ids in resolved_pairs:
+            self.diagnostics.debug("pair", "%s (ignored categories: %s)", pair, sorted(ignored_category_ids))
+
+        return resolved_pairs
+
+    def _link_pairs(
+        self,
+        resolved_pairs: List[Tuple[SpareChangePair, Account, Account, Set[int]]],
+        start_date: str,
+        end_date: str,
+        sources: Optional[Set[int]] = None,
+    ) -> None:
+        """
+        Links the purchases in each pair's main account to their spare change. When ``sources``
+        is provided, only those purchases are linked.
+
+        Every purchase is matched before anything is grouped, so that purchases whose spare
+        change sits in the same existing group can be merged into it together.
+        """
+        units = self._work_units(resolved_pairs)
+        resolved_pairs = [p for p, unit in zip(resolved_pairs, units) if self._owns(unit)]
+        if not resolved_pairs:
+            return
+
+        pairs_by_account = group(resolved_pairs, key=lambda p: (p[1].kind, p[1].id))
+        savings_accounts = {(s.kind, s.id): s for _, _, s, _ in resolved_pairs}
+        queries = self._queries(resolved_pairs, start_date, end_date)
 
-            with self.tracer.start_as_current_span("lunchmoney.transactions", attributes={"account": savings_account.name}):
-                savings_transactions = [
-                    Transaction(**cat)
-                    for cat in call_lunchmoney(
-                        "GET",
-                        "/v1/transactions",
-                        params={
-                            f"{savings_account.kind}_id": savings_account.id,
-                            "start_date": self.start_date,
-                            "end_date": self.end_date,
-                            "is_group": "false",
-                        },
-                    )["transactions"]
-                ]
-
-            self.log.debug(
-                f"{len(savings_transactions)} transactions loaded from Lunch Money for {savings_account.alias}"
+        # None of the accounts depend on one another, so fetch all of them at once
+        with self.phase("fetch"):
+            fetched = dict(zip(queries.keys(), self._prefetch(*(
+                partial(self._fetch_transactions, query)
+                for query in queries.values()
+            ))))
+
+        savings_transactions = TransactionTable({
+            t.id: t
+            for key in savings_accounts.keys()
+            for t in fetched[("savings", key)]
+        }.values())
+
+        self.log.debug(
+            "%d transactions loaded from Lunch Money for %d savings accounts",
+            len(savings_transactions),
+            len(savings_accounts),
+        )
+
+        purchases: List[Transaction] = []
+        pairs_for: Dict[int, List[Tuple[SpareChangePair, Account, Account, Set[int]]]] = {}
+        for key, pairs in pairs_by_account.items():
+            main_account = pairs[0][1]
+            main_transactions = fetched[("main", key)]
+
+            self.diagnostics.debug(
+                "account", "%d transactions loaded from Lunch Money for %s", len(main_transactions), main_account.alias
             )
 
             for t in main_transactions:
-                if t.group_id is not None:
-                    # Don't attempt to group transactions which are already grouped
-                    self.log.debug(f"Skipping {t} because it is already grouped")
-                    continue
-
-                if t.status == "recurring":
-                    # We can't group recurring transactions
-                    self.log.debug(
-                        f"Skipping {t} because it is part of a recurring transaction (which can't be grouped)"
-                    )
+                if sources is not None and t.id not in sources:
                     continue
 
                 amt = Decimal(t.amount)
                 if amt < 0:
                     # Ignore incoming transactions since they don't generate spare change
-                    self.log.debug(
-                        f"Skipping {t} because it is an inbound transfer which doesn't generate spare change"
+                    self.diagnostics.debug(
+                        "inbound", "Skipping %s because it is an inbound transfer which doesn't generate spare change", t
                     )
                     continue
 
-                with self.tracer.start_as_current_span("link_spare_change", attributes={"transaction": t.id}) as span:
-                    spare_change = -self.multiplier * (
-                        (math.ceil(abs(amt)) - abs(amt)) or Decimal(1)
-                    )
-                    self.log.debug(f"{t} (spare change: {spare_change})")
+                purchases.append(t)
+                pairs_for[t.id] = pairs
 
-                    date_candidates = list(
-                        filter(
-                            lambda c: abs(parse_date(c.date) - parse_date(t.date))
-                            < timedelta(days=self.max_offset_days),
-                            savings_transactions,
-                        )
-                    )
-                    value_candidates = list(
-                        filter(lambda c: Decimal(c.amount) == spare_change, date_candidates)
-                    )
+        links: List[Tuple[Transaction, Transaction, SpareChangePair]] = []
+        work = self._prioritise(purchases)
+        for i, t in enumerate(work):
+            if self._out_of_time(work[i:]):
+                break
 
-                    st = next((c for c in value_candidates), None)
-                    if not st:
-                        self.log.info(
-                            f"Skipping {t} because no spare matching change transactions were found (in date range:{len(date_candidates)}, +amount:{len(value_candidates)})"
-                        )
-                        span.set_status(Status(StatusCode.ERROR, "No matching change transactions found"))
-                        continue
-
-                    self.log.debug("%s ---> %s", t, st)
-                    savings_transactions.remove(st)
-
-                    transactions = set([t.id, st.id])
-
-                    if st.group_id is not None:
-                        with self.tracer.start_as_current_span("lunchmoney.ungroup"):
-                            old_group = call_lunchmoney(
-                                "DELETE", f"/v1/transactions/group/{st.group_id}"
-                            )["transactions"]
-                        transactions = transactions.union(old_group)
-                        self.log.debug(f"Split old group containing {old_group}")
-
-                    with self.tracer.start_as_current_span("lunchmoney.group", attributes={"name": t.payee, "transactions": list(transactions)}):
-                        new_group = call_lunchmoney(
-                            "POST",
-                            "/v1/transactions/group",
-                            json={
-                                "date": t.date,
-                                "payee": t.payee,
-                                "category_id": t.category_id,
-                                "notes": t.notes,
-                                "tags": [tag.id for tag in t.tags],
-                                "transactions": list(transactions),
-                            },
+            for pair, _, savings_account, ignored_category_ids in pairs_for[t.id]:
+                if t.category_id in ignored_category_ids:
+                    self.diagnostics.debug("ignored_category", "Skipping %s for %s because it is in an ignored category", t, pair)
+                    continue
+
+                st = self._find_spare_change(pair, t, savings_account, savings_transactions)
+                if st is not None:
+                    links.append((t, st, pair))
+                    break
+
+        self._group_links(links)
+
+    def _work_units(self, resolved_pairs: List[Tuple[SpareChangePair, Account, Account, Set[int]]]) -> List[str]:
+        """
+        Names the unit of work each pair belongs to. Pairs which share an account (directly or
+        through other pairs) compete for the same transactions, so they belong to the same unit.
+        """
+        units: List[Set[Tuple[str, int]]] = []
+        for _, main_account, savings_account, _ in resolved_pairs:
+            keys = {(main_account.kind, main_account.id), (savings_account.kind, savings_account.id)}
+            for unit in [u for u in units if u & keys]:
+                units.remove(unit)
+                keys |= unit
+            units.append(keys)
+
+        def name(p: Tuple[SpareChangePair, Account, Account, Set[int]]) -> str:
+            keys = next(u for u in units if (p[1].kind, p[1].id) in u)
+            return ",".join(f"{kind}:{id}" for kind, id in sorted(keys))
+
+        return [name(p) for p in resolved_pairs]
+
+    def _queries(
+        self,
+        resolved_pairs: List[Tuple[SpareChangePair, Account, Account, Set[int]]],
+        start_date: str,
+        end_date: str,
+    ) -> Dict[Tuple[str, Tuple[str, int]], TransactionQuery]:
+        """The queries for the purchases in each main account and the spare change in each savings account."""
+        pairs_by_account = group(resolved_pairs, key=lambda p: (p[1].kind, p[1].id))
+        savings_accounts = {(s.kind, s.id): s for _, _, s, _ in resolved_pairs}
+
+        # Purchases which are already grouped, recurring or in a category every pair ignores can't
+        # generate spare change, while spare change may need to be taken out of an existing group
+        return {
+            **{
+                ("main", key): TransactionQuery(
+                    start_date,
+                    end_date,
+                    account=pairs[0][1],
+                    is_group=False,
+                    grouped=False,
+                    exclude_category_ids=set.intersection(*(p[3] for p in pairs)),
+                    exclude_statuses={"recurring"},
+                )
+                for key, pairs in pairs_by_account.items()
+            },
+            **{
+                ("savings", key): TransactionQuery(start_date, end_date, account=account, is_group=False)
+                for key, account in savings_accounts.items()
+            },
+        }
+
+    def _fetch_transactions(self, query: TransactionQuery) -> List[Transaction]:
+        with self.phase("fetch"), self.tracer.start_as_current_span("lunchmoney.transactions", attributes={"account": query.account.name}):
+            return self._query(query, call_lunchmoney)
+
+    def _find_spare_change(
+        self,
+        pair: SpareChangePair,
+        t: Transaction,
+        savings_account: Account,
+        savings_transactions: TransactionTable,
+    ) -> Optional[Transaction]:
+        with self.tracer.start_as_current_span("link_spare_change", attributes={"transaction": t.id, "pair": str(pair)}) as span:
+            spare_change = pair.spare_change(Decimal(t.amount))
+            self.diagnostics.debug("spare_change", "%s (spare change: %s)", t, spare_change)
+
+            with self.phase("match"):
+                account_candidates = savings_transactions.account_mask(savings_account)
+
+                # Skip purchases which had no spare change last time, unless they (or their candidates) have changed
+                scope = f"link_spare_change:{pair}"
+                match_fingerprint = fingerprint(
+                    pair.multiplier,
+                    pair.max_offset_days,
+                    transaction_fingerprint(t),
+                    [
+                        transaction_fingerprint(c)
+                        for c in savings_transactions.select(
+                            account_candidates & (savings_transactions.amounts == to_minor_units(spare_change))
                         )
-                    self.log.info(
-                        f"Completed {t} by forming new group {new_group} with transactions {list(transactions)}"
+                    ],
+                )
+                if self.negative_cache.is_hopeless(scope, t.id, match_fingerprint):
+                    self.diagnostics.debug(
+                        "hopeless", "Skipping %s because nothing has changed since no spare change was found for it", t
                     )
+                    return None
+
+                date_candidates = account_candidates & (
+                    savings_transactions.date_offsets(t.date) < pair.max_offset_days
+                )
+                value_candidates = date_candidates & (
+                    savings_transactions.amounts == to_minor_units(spare_change)
+                )
+
+                st = savings_transactions.first(value_candidates)
+            if not st:
+                self.diagnostics.info(
+                    "no_match",
+                    "Skipping %s because no spare matching change transactions were found (in date range:%s, +amount:%s)",
+                    t,
+                    lazy(partial(np.count_nonzero, date_candidates)),
+                    lazy(partial(np.count_nonzero, value_candidates)),
+                )
+                span.set_status(Status(StatusCode.ERROR, "No matching change transactions found"))
+                self.negative_cache.add(scope, t.id, match_fingerprint)
+                return None
+
+            self.diagnostics.debug("linked", "%s ---> %s", t, st)
+            savings_transactions.remove(st)
+            return st
 
+    def _group_links(self, links: List[Tuple[Transaction, Transaction, SpareChangePair]]) -> None:
+        """
+        Groups each purchase with its spare change. Spare change which is already grouped has its
+        old group split and merged into the new one, and when several are in the same old group we
+        only split it once, rebuilding it as a single group (described by the last purchase). Each
+        link's lag is recorded once it has been grouped.
+        """
+        plans = group(
+            links,
+            key=lambda link: ("existing", link[1].group_id) if link[1].group_id is not None else ("new", link[0].id),
+        )
+
+        plans = list(plans.items())
+        for i, ((kind, old_group_id), plan) in enumerate(plans):
+            if self._out_of_time(t for _, remaining_plan in plans[i:] for t, _, _ in remaining_plan):
+                break
+
+            purchases = [t for t, _, _ in plan]
+            t = purchases[-1]
+
+            transactions = [*(p.id for p in purchases), *(st.id for _, st, _ in plan)]
+            grouped = set(transactions)
+
+            steps = []
+            if kind == "existing":
+                # Split the old group so that its transactions can be merged into the new one
+                steps.append({
+                    "method": "DELETE",
+                    "endpoint": f"/v1/transactions/group/{old_group_id}",
+                })
+                transactions.append(ref(0, "transactions"))
+
+            steps.append({
+                "method": "POST",
+                "endpoint": "/v1/transactions/group",
+                "json": {
+                    "date": t.date,
+                    "payee": t.payee,
+                    "category_id": t.category_id,
+                    "notes": t.notes,
+                    "tags": [tag.id for tag in t.tags],
+                    "transactions": transactions,
+                },
+            })
+
+            with self.phase("mutate"), self.tracer.start_as_current_span("lunchmoney.group", attributes={"name": t.payee, "transactions": sorted(grouped)}):
+                *old_groups, new_group = self.journal.execute(
+                    "link_spare_change.group",
+                    steps,
+                    call_lunchmoney,
+                )
+
+            for old_group in old_groups:
+                self.store.apply_ungroup(old_group["transactions"])
+                grouped = grouped.union(old_group["transactions"])
+                self.diagnostics.debug("split", "Split old group containing %s", old_group["transactions"])
+
+            self.store.apply_group(new_group, grouped)
+            for purchase, st, pair in plan:
+                self.settlement.record(f"link_spare_change:{pair}", date_ordinal(st.date) - date_ordinal(purchase.date))
+
+            self.diagnostics.info(
+                "grouped",
+                "Completed %s by forming new group %s with transactions %s",
+                lazy(lambda: ", ".join(str(p) for p in purchases)),
+                new_group,
+                sorted(grouped),
+            )
+
+
+class LinkSpareChangeTask(SpareChangeEngine):
+    """Links spare change for a single pair of accounts."""
+
+    def __init__(
+        self,
+        main_account: str,
+        savings_account: str,
+        multiplier: int = 1,
+        ignore_categories: List[str] = ["Transfers"],
+        max_offset_days: int = 1,
+    ) -> None:
+        super().__init__([{
+            "main_account": main_account,
+            "savings_account": savings_account,
+            "multiplier": multiplier,
+            "ignore_categories": ignore_categories,
+            "max_offset_days": max_offset_days,
+        }])
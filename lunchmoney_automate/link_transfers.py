@@ -1,118 +1,186 @@
-from datetime import datetime, timedelta
-from typing import Iterable
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set
 from decimal import Decimal
-import dateparser
+from functools import partial
+import numpy as np
 from opentelemetry.trace import Status, StatusCode
 
-from .task import Task
-from .utils import Account, Category, Transaction, call_lunchmoney, parse_date
+from .columnar import TransactionTable, date_ordinal
+from .diagnostics import lazy
+from .journal import ref
+from .negative_cache import fingerprint, transaction_fingerprint
+from .query import TransactionQuery
+from .task import LOOKBACK_MARGIN_DAYS, Task
+from .utils import Account, Category, Transaction, call_lunchmoney
 
 
 class LinkTransfersTask(Task):
+    """
+    Links transfers between accounts ("From ..." and "To ..." transactions) into groups.
+
+    When ``exchange_rates`` (the value of each currency in a common base currency) are provided,
+    transfers between accounts in different currencies are linked if their converted amounts are
+    within ``amount_tolerance`` (a fraction, like ``0.02``) of one another.
+    """
+
     def __init__(
         self,
         transfer_category: str = "Transfers",
         max_offset_days: int = 14,
         create_if_missing: bool = False,
+        exchange_rates: Optional[Dict[str, float]] = None,
+        amount_tolerance: float = 0.0,
     ) -> None:
-        super().__init__()
-
-        now = datetime.utcnow().date()
-
-        self.start_date = (now - timedelta(days=30)).isoformat()
-        self.end_date = now.isoformat()
-
         self.transfer_category = transfer_category
         self.max_offset_days = max_offset_days
         self.create_if_missing = create_if_missing
+        self.exchange_rates = exchange_rates
+        self.amount_tolerance = amount_tolerance
+
+        super().__init__()
+
+    def window_days(self) -> int:
+        lag = self.settlement.widest("link_transfers:", self.max_offset_days)
+        if lag is None:
+            return self.lookback_days
+
+        return min(self.lookback_days, lag + LOOKBACK_MARGIN_DAYS)
 
     def run(self):
-        with self.tracer.start_as_current_span("link_transfers"):
-            with self.tracer.start_as_current_span("lunchmoney.accounts"):
-                accounts = [
-                    *(
-                        Account("asset", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/assets")["assets"]
-                    ),
-                    *(
-                        Account("plaid_account", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/plaid_accounts")[
-                            "plaid_accounts"
-                        ]
-                    ),
-                ]
-
-            self.log.debug(f"{len(accounts)} accounts loaded from Lunch Money")
-            for account in accounts:
-                self.log.debug(f"{account.alias} ({account.id})")
-
-            with self.tracer.start_as_current_span("lunchmoney.categories"):
-                categories = [
-                    Category(**cat)
-                    for cat in call_lunchmoney("GET", "/v1/categories")["categories"]
-                ]
-            self.log.debug(f"{len(categories)} categories loaded from Lunch Money")
-            category = next(cat for cat in categories if cat.name == self.transfer_category)
-            for cat in categories:
-                self.log.debug(f"{cat.name} ({cat.id}, selected:{category == cat})")
-
-            with self.tracer.start_as_current_span("lunchmoney.transactions"):
-                transactions = [
-                    Transaction(**cat)
-                    for cat in call_lunchmoney(
-                        "GET",
-                        "/v1/transactions",
-                        params={
-                            "category_id": category.id,
-                            "start_date": self.start_date,
-                            "end_date": self.end_date,
-                            "is_group": "false",
-                        },
-                    )["transactions"]
-                ]
+        with self.profile("link_transfers"):
+            with self.phase("fetch"):
+                accounts, categories = self._load_reference_data(call_lunchmoney)
+                category = self._select_category(categories)
+                transactions = self._fetch_transactions(category, self.start_date, self.end_date)
 
-            self.log.debug(f"{len(transactions)} transactions loaded from Lunch Money")
+            self._link_transactions(transactions, category, accounts)
 
-            transactions = sorted(
-                [t for t in transactions if t.group_id is None], key=lambda t: t.date
-            )
-            self.log.debug(f"{len(transactions)} transactions not yet linked")
-
-            from_transactions = [t for t in transactions if t.payee.startswith("From ")]
-            to_transactions = [t for t in transactions if t.payee.startswith("To ")]
-
-            from_transactions = [
-                ft for ft in from_transactions if not self._link_transaction(
-                    "From",
-                    ft,
-                    "To",
-                    to_transactions,
-                    category=category,
-                    accounts=accounts,
-                    max_offset_days=self.max_offset_days,
-                    create_if_missing=self.create_if_missing,
-                )
-            ]   
-
-            to_transactions = [
-                tt for tt in to_transactions if not self._link_transaction(
-                    "To",
-                    tt,
-                    "From",
-                    from_transactions,
-                    category=category,
-                    accounts=accounts,
-                    max_offset_days=self.max_offset_days,
-                    create_if_missing=self.create_if_missing,
+    def rules(self) -> Dict[str, TransactionQuery]:
+        _, categories = self._load_reference_data(call_lunchmoney)
+        return {"transfers": self._transfers(self._select_category(categories), self.start_date, self.end_date)}
+
+    def max_writes(self, rule: str, transactions: List[Transaction]) -> int:
+        # Each link groups two transfers, while a transfer without one may have its counterpart created
+        return self.max_writes_for_count(rule, len(transactions))
+
+    def max_writes_for_count(self, rule: str, count: int) -> int:
+        return 2 * count if self.create_if_missing else count // 2
+
+    def process(self, changed: List[Transaction]) -> None:
+        with self.profile("link_transfers.changed", transactions=[t.id for t in changed]):
+            with self.phase("fetch"):
+                accounts, categories = self._load_reference_data(call_lunchmoney)
+                category = self._select_category(categories)
+
+            query = self._transfers(category)
+            changed = [t for t in changed if query.matches(t)]
+            if not changed:
+                return
+
+            # Only the transactions within reach of a changed transaction can be linked to it
+            dates = [date.fromisoformat(t.date) for t in changed]
+            reach = self.settlement.widest("link_transfers:", self.max_offset_days) or self.max_offset_days
+            with self.phase("fetch"):
+                transactions = self._fetch_transactions(
+                    category,
+                    (min(dates) - timedelta(days=reach)).isoformat(),
+                    (max(dates) + timedelta(days=reach)).isoformat(),
                 )
-            ]
+
+            self._link_transactions(transactions, category, accounts, sources=set(t.id for t in changed))
+
+    def _select_category(self, categories: List[Category]) -> Category:
+        category = next(cat for cat in categories if cat.name == self.transfer_category)
+        for cat in categories:
+            self.diagnostics.debug("category", "%s (%s, selected:%s)", cat.name, cat.id, category == cat)
+
+        return category
+
+    def _transfers(
+        self, category: Category, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> TransactionQuery:
+        """The transfers which haven't been linked yet."""
+        return TransactionQuery(start_date, end_date, category_id=category.id, is_group=False, grouped=False)
+
+    def _fetch_transactions(self, category: Category, start_date: str, end_date: str) -> List[Transaction]:
+        with self.tracer.start_as_current_span("lunchmoney.transactions"):
+            transactions = self._query(self._transfers(category, start_date, end_date), call_lunchmoney)
+
+        self.log.debug("%d unlinked transfers loaded from Lunch Money", len(transactions))
+        return transactions
+
+    def _link_transactions(
+        self,
+        transactions: List[Transaction],
+        category: Category,
+        accounts: List[Account],
+        sources: Optional[Set[int]] = None,
+    ) -> None:
+        """
+        Links "From" transactions to their "To" counterparts (and vice versa). When ``sources``
+        is provided, only those transactions are linked (using the others as candidates).
+        """
+        with self.phase("match"):
+            transactions = sorted(transactions, key=lambda t: t.date)
+
+            from_transactions = TransactionTable(
+                (t for t in transactions if t.payee.startswith("From ")), exchange_rates=self.exchange_rates
+            )
+            to_transactions = TransactionTable(
+                (t for t in transactions if t.payee.startswith("To ")), exchange_rates=self.exchange_rates
+            )
+
+        tables = {
+            "From": (from_transactions, "To", to_transactions),
+            "To": (to_transactions, "From", from_transactions),
+        }
+
+        def is_pending(t: Transaction) -> bool:
+            # Transactions can be linked as another transaction's candidate before we get to them
+            return t in from_transactions or t in to_transactions
+
+        # Both sides of a transfer are between the same accounts, so runners sharing the task split it by account pair
+        work = self._prioritise(
+            t
+            for t in [*from_transactions, *to_transactions]
+            if (sources is None or t.id in sources) and self._owns(self._account_pair(t, accounts))
+        )
+        for i, t in enumerate(work):
+            if not is_pending(t):
+                continue
+
+            if self._out_of_time(filter(is_pending, work[i:])):
+                break
+
+            kind = "From" if t.payee.startswith("From ") else "To"
+            pending, candidate_kind, candidates = tables[kind]
+            if self._link_transaction(
+                kind,
+                t,
+                candidate_kind,
+                candidates,
+                category=category,
+                accounts=accounts,
+                max_offset_days=self.max_offset_days,
+                create_if_missing=self.create_if_missing,
+            ):
+                pending.remove(t)
+
+    def _account_pair(self, transaction: Transaction, accounts: Iterable[Account]) -> str:
+        """Identifies the accounts a transfer is between (the same for transfers in either direction)."""
+        kind = "From" if transaction.payee.startswith("From ") else "To"
+        ft_account = next(
+            (account for account in accounts if account.id in [transaction.asset_id, transaction.plaid_account_id]),
+            None,
+        )
+        return "|".join(sorted([ft_account.alias if ft_account is not None else "", transaction.payee[len(kind) + 1:]]))
 
     def _link_transaction(
         self,
         kind: str,
         transaction: Transaction,
         candidate_kind: str,
-        candidates: Iterable[Transaction],
+        candidates: TransactionTable,
         category: Category,
         accounts: Iterable[Account],
         max_offset_days: int = 1,
@@ -136,119 +204,125 @@ class LinkTransfersTask(Task):
                 None,
             )
             if to_account is None:
-                self.log.warning(
-                    f"No account matching '{transaction.payee[len(kind)+1:]}' for {transaction}"
+                self.diagnostics.warning(
+                    "no_account", "No account matching '%s' for %s", transaction.payee[len(kind)+1:], transaction
                 )
                 span.set_status(Status(StatusCode.ERROR, "No account matching"))
                 return False
 
-            # Find candidate transactions which are from the correct account
-            account_candidates = list(
-                filter(
-                    lambda t: getattr(t, f"{to_account.kind}_id") == to_account.id,
-                    candidates,
-                )
-            )
+            with self.phase("match"):
+                # Find candidate transactions which are from the correct account
+                account_candidates = candidates.account_mask(to_account)
 
-            # Find candidate transactions which are the complement of one another in value
-            amount_candidates = list(
-                filter(
-                    lambda t: Decimal(t.amount) == -Decimal(transaction.amount),
-                    account_candidates,
+                # Find candidate transactions which are the complement of one another in value
+                amount_candidates = account_candidates & candidates.amounts_near(
+                    -candidates.convert(transaction.amount, transaction.currency), self.amount_tolerance
                 )
-            )
 
-            # Find candidates which use the correct payee naming scheme
-            named_candidates = list(
-                filter(
-                    lambda t: t.payee == f"{candidate_kind} {ft_account.alias}",
-                    amount_candidates,
-                )
-            )
+                # Skip transactions which had no match last time, unless they (or their candidates) have changed
+                if not create_if_missing:
+                    match_fingerprint = fingerprint(
+                        max_offset_days,
+                        self.exchange_rates,
+                        self.amount_tolerance,
+                        ft_account.alias,
+                        to_account.id,
+                        transaction_fingerprint(transaction),
+                        [transaction_fingerprint(t) for t in candidates.select(amount_candidates)],
+                    )
+                    if self.negative_cache.is_hopeless("link_transfers", transaction.id, match_fingerprint):
+                        self.diagnostics.debug(
+                            "hopeless", "Skipping %s because nothing has changed since no match was found for it", transaction
+                        )
+                        return False
 
-            # Find candidates which are within the max day offset of one another
-            time_offset = timedelta(days=max_offset_days)
-            date_candidates = list(
-                filter(
-                    lambda t: abs(parse_date(t.date) - parse_date(transaction.date))
-                    <= time_offset,
-                    named_candidates,
+                # Find candidates which use the correct payee naming scheme
+                named_candidates = amount_candidates & (
+                    candidates.payees == candidates.payee_code(f"{candidate_kind} {ft_account.alias}")
                 )
-            )
 
-            # Order the transactions by "nearness"
-            final_candidates = sorted(
-                date_candidates,
-                key=lambda t: abs(parse_date(t.date) - parse_date(transaction.date)),
-            )
+                # Find candidates which are within the max day offset of one another
+                date_offsets = candidates.date_offsets(transaction.date)
+                date_candidates = named_candidates & (date_offsets <= max_offset_days)
 
-            best_link = next((c for c in final_candidates), None)
+                # Pick the transaction which is "nearest"
+                best_link = candidates.first(date_candidates, key=date_offsets)
             if best_link is None and not create_if_missing:
-                self.log.warning(
-                    f"No match for {transaction} (account:{len(account_candidates)}, +amount:{len(amount_candidates)}, +name:{len(named_candidates)}, +time:{len(date_candidates)})"
+                self.diagnostics.warning(
+                    "no_match",
+                    "No match for %s (account:%s, +amount:%s, +name:%s, +time:%s)",
+                    transaction,
+                    *(lazy(partial(np.count_nonzero, mask)) for mask in [account_candidates, amount_candidates, named_candidates, date_candidates]),
                 )
                 span.set_status(Status(StatusCode.ERROR, "No match"))
+                self.negative_cache.add("link_transfers", transaction.id, match_fingerprint)
+
+                # Its counterpart may arrive later than the window allows for
+                self.settlement.expect(f"link_transfers:{self._account_pair(transaction, accounts)}")
                 return False
 
             if best_link is None:
-                with self.tracer.start_as_current_span("lunchmoney.create_transaction"):
-                    created_ids = call_lunchmoney(
-                        "POST",
-                        "/v1/transactions",
-                        json={
-                            "apply_rules": True,
-                            "skip_duplicates": False,
-                            "transactions": [
-                                {
-                                    "id": transaction.id,
+                counterpart = {
+                    "id": transaction.id,
+                    "date": transaction.date,
+                    "payee": f"{candidate_kind} {ft_account.alias}",
+                    "amount": (
+                        ""
+                        if transaction.amount.startswith("-")
+                        else "-"
+                    )
+                    + transaction.amount.lstrip("-"),
+                    "currency": transaction.currency,
+                    "notes": transaction.notes,
+                    "category_id": category.id,
+                    f"{to_account.kind}_id": to_account.id,
+                    "tags": [
+                        tag.id for tag in transaction.tags
+                    ],
+                }
+
+                with self.phase("mutate"), self.tracer.start_as_current_span(
+                    "lunchmoney.create_and_group",
+                    attributes={"transaction": transaction.id},
+                ):
+                    created, group_id = self.journal.execute(
+                        "link_transfers.create_and_group",
+                        [
+                            {
+                                "method": "POST",
+                                "endpoint": "/v1/transactions",
+                                "json": {
+                                    "apply_rules": True,
+                                    "skip_duplicates": False,
+                                    "transactions": [counterpart],
+                                },
+                            },
+                            {
+                                "method": "POST",
+                                "endpoint": "/v1/transactions/group",
+                                "json": {
                                     "date": transaction.date,
-                                    "payee": f"{candidate_kind} {ft_account.alias}",
-                                    "amount": (
-                                        ""
-                                        if transaction.amount.startswith("-")
-                                        else "-"
-                                    )
-                                    + transaction.amount.lstrip("-"),
-                                    "currency": transaction.currency,
-                                    "notes": transaction.notes,
+                                    "payee": f"{to_account.alias} {candidate_kind.lower()} {ft_account.alias}",
                                     "category_id": category.id,
-                                    f"{to_account.kind}_id": to_account.id,
+                                    "notes": transaction.notes,
                                     "tags": [
                                         tag.id for tag in transaction.tags
-                                    ],
-                                }
-                            ],
-                        },
-                    )["ids"]
-
-                self.log.info(f"Created new pair for {transaction}: {created_ids}")
-
-                with self.tracer.start_as_current_span(
-                    "lunchmoney.group",
-                    attributes={"transactions": [transaction.id, *created_ids]},
-                ):
-                    group_id = call_lunchmoney(
-                        "POST",
-                        "/v1/transactions/group",
-                        json={
-                            "date": transaction.date,
-                            "payee": f"{to_account.alias} {candidate_kind.lower()} {ft_account.alias}",
-                            "category_id": category.id,
-                            "notes": transaction.notes,
-                            "tags": [
-                                tag.id for tag in transaction.tags
-                            ],  # We exclude the original trigger tag
-                            "transactions": [transaction.id, *created_ids],
-                        },
+                                    ],  # We exclude the original trigger tag
+                                    "transactions": [transaction.id, ref(0, "ids")],
+                                },
+                            },
+                        ],
+                        call_lunchmoney,
                     )
 
-                self.log.debug(
-                    "Created group with ID/error: %s",
-                    group_id,
-                )
+                self.store.apply_create(created["ids"], [counterpart])
+                self.store.apply_group(group_id, [transaction.id, *created["ids"]])
+
+                self.diagnostics.info("created", "Created new pair for %s: %s", transaction, created["ids"])
+                self.diagnostics.debug("grouped", "Created group with ID/error: %s", group_id)
                 return True
 
-            self.log.info(f"Found link {transaction} => {best_link}")
+            self.diagnostics.info("linked", "Found link %s => %s", transaction, best_link)
             candidates.remove(best_link)
 
             bl_account = next(
@@ -257,33 +331,44 @@ class LinkTransfersTask(Task):
                 if account.id in [best_link.asset_id, best_link.plaid_account_id]
             )
 
-            with self.tracer.start_as_current_span("lunchmoney.group", attributes={"transactions": [transaction.id, best_link.id]}):
-                group_id = call_lunchmoney(
-                    "POST",
-                    "/v1/transactions/group",
-                    json={
-                        "date": min(transaction.date, best_link.date),
-                        "payee": f"{bl_account.alias} {candidate_kind.lower()} {ft_account.alias}",
-                        "category_id": category.id,
-                        "notes": "; ".join(
-                            filter(
-                                lambda x: x,
-                                [
-                                    f"{transaction.currency.upper()} {abs(Decimal(transaction.amount))}",
-                                    transaction.notes,
-                                    best_link.notes,
-                                ],
-                            )
-                        ),
-                        "tags": [
-                            tag.id
-                            for tag in [
-                                *transaction.tags,
-                                *best_link.tags,
-                            ]
-                        ],  # We exclude the original trigger tag
-                        "transactions": [transaction.id, best_link.id],
-                    },
+            with self.phase("mutate"), self.tracer.start_as_current_span("lunchmoney.group", attributes={"transactions": [transaction.id, best_link.id]}):
+                group_id, = self.journal.execute(
+                    "link_transfers.group",
+                    [
+                        {
+                            "method": "POST",
+                            "endpoint": "/v1/transactions/group",
+                            "json": {
+                                "date": min(transaction.date, best_link.date),
+                                "payee": f"{bl_account.alias} {candidate_kind.lower()} {ft_account.alias}",
+                                "category_id": category.id,
+                                "notes": "; ".join(
+                                    filter(
+                                        lambda x: x,
+                                        [
+                                            f"{transaction.currency.upper()} {abs(Decimal(transaction.amount))}",
+                                            transaction.notes,
+                                            best_link.notes,
+                                        ],
+                                    )
+                                ),
+                                "tags": [
+                                    tag.id
+                                    for tag in [
+                                        *transaction.tags,
+                                        *best_link.tags,
+                                    ]
+                                ],  # We exclude the original trigger tag
+                                "transactions": [transaction.id, best_link.id],
+                            },
+                        },
+                    ],
+                    call_lunchmoney,
                 )
-            self.log.debug(f" ---> {group_id}")
+            self.store.apply_group(group_id, [transaction.id, best_link.id])
+            self.settlement.record(
+                f"link_transfers:{self._account_pair(transaction, accounts)}",
+                date_ordinal(best_link.date) - date_ordinal(transaction.date),
+            )
+            self.diagnostics.debug("grouped", " ---> %s", group_id)
             return True
@@ -1,11 +1,12 @@
-from datetime import datetime, timedelta
-from typing import Iterable
+from typing import Dict, Iterable, List, Optional
+import sys
 from decimal import Decimal
-import dateparser
 from opentelemetry.trace import Status, StatusCode
 
+from .journal import ref
+from .query import TransactionQuery
 from .task import Task
-from .utils import Account, Category, Transaction, call_lunchmoney, parse_date
+from .utils import Account, Category, Tag, Transaction, call_lunchmoney
 
 
 class MatchTransfersTask(Task):
@@ -16,87 +17,108 @@ class MatchTransfersTask(Task):
     ) -> None:
         super().__init__()
 
-        now = datetime.utcnow().date()
-
-        self.start_date = (now - timedelta(days=30)).isoformat()
-        self.end_date = now.isoformat()
-
         self.transfer_category = transfer_category
-        self.needs_match_tag = needs_match_tag
+        # Interned, like tag names, so that comparing them is usually an identity check
+        self.needs_match_tag = sys.intern(needs_match_tag)
 
     def run(self):
-        with self.tracer.start_as_current_span("match_transfers"):
-            with self.tracer.start_as_current_span("lunchmoney.accounts"):
-                accounts = [
-                    *(
-                        Account("asset", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/assets")["assets"]
-                    ),
-                    *(
-                        Account("plaid_account", **asset)
-                        for asset in call_lunchmoney("GET", "/v1/plaid_accounts")[
-                            "plaid_accounts"
-                        ]
-                    ),
-                ]
-
-            self.log.debug(f"{len(accounts)} accounts loaded from Lunch Money")
-            for account in accounts:
-                self.log.debug(f"{account.alias} ({account.id})")
-
-            with self.tracer.start_as_current_span("lunchmoney.categories"):
-                categories = [
-                    Category(**cat)
-                    for cat in call_lunchmoney("GET", "/v1/categories")["categories"]
-                ]
-            self.log.debug(f"{len(categories)} categories loaded from Lunch Money")
+        with self.profile("match_transfers"):
+            with self.phase("fetch"):
+                (accounts, categories), tags = self._prefetch(
+                    lambda: self._load_reference_data(call_lunchmoney),
+                    lambda: self._load_tags(call_lunchmoney),
+                )
             category = next(cat for cat in categories if cat.name == self.transfer_category)
             for cat in categories:
-                self.log.debug(f"{cat.name} ({cat.id}, selected:{category == cat})")
-
-            with self.tracer.start_as_current_span("lunchmoney.transactions"):
-                transactions = [
-                    Transaction(**cat)
-                    for cat in call_lunchmoney(
-                        "GET",
-                        "/v1/transactions",
-                        params={
-                            "category_id": category.id,
-                            "start_date": self.start_date,
-                            "end_date": self.end_date,
-                            "is_group": "false",
-                        },
-                    )["transactions"]
-                ]
+                self.diagnostics.debug("category", "%s (%s, selected:%s)", cat.name, cat.id, category == cat)
+
+            tag = self._select_tag(tags)
+            if tag is None:
+                return
 
-            self.log.debug(f"{len(transactions)} transactions loaded from Lunch Money")
+            with self.phase("fetch"), self.tracer.start_as_current_span("lunchmoney.transactions"):
+                transactions = self._query(
+                    self._needs_match(category, tag, self.start_date, self.end_date), call_lunchmoney
+                )
 
-            transactions = [t for t in transactions if t.group_id is None]
-            self.log.debug(f"{len(transactions)} transactions not yet linked")
+            self.log.debug("%d unlinked transactions tagged to have missing transaction created", len(transactions))
+            self._match_transactions(transactions, category, accounts)
+
+    def rules(self) -> Dict[str, TransactionQuery]:
+        (_, categories), tags = self._prefetch(
+            lambda: self._load_reference_data(call_lunchmoney),
+            lambda: self._load_tags(call_lunchmoney),
+        )
+        category = next(cat for cat in categories if cat.name == self.transfer_category)
+        tag = self._select_tag(tags)
+        if tag is None:
+            return {}
+
+        return {"needs_match": self._needs_match(category, tag, self.start_date, self.end_date)}
+
+    def max_writes(self, rule: str, transactions: List[Transaction]) -> int:
+        # Each transaction has its counterpart created, then is grouped with it
+        return self.max_writes_for_count(rule, len(transactions))
+
+    def max_writes_for_count(self, rule: str, count: int) -> int:
+        return 2 * count
+
+    def process(self, changed: List[Transaction]) -> None:
+        with self.profile("match_transfers.changed", transactions=[t.id for t in changed]):
+            with self.phase("fetch"):
+                (accounts, categories), tags = self._prefetch(
+                    lambda: self._load_reference_data(call_lunchmoney),
+                    lambda: self._load_tags(call_lunchmoney),
+                )
+            category = next(cat for cat in categories if cat.name == self.transfer_category)
 
-            transactions = [t for t in transactions if any(tag.name == self.needs_match_tag for tag in t.tags)]
-            self.log.debug(f"{len(transactions)} transactions tagged to have missing transaction created")
+            tag = self._select_tag(tags)
+            if tag is None:
+                return
 
-            from_transactions = [t for t in transactions if t.payee.startswith("From ")]
-            to_transactions = [t for t in transactions if t.payee.startswith("To ")]
+            # Matching doesn't depend on any other transactions, so there's nothing else to fetch
+            query = self._needs_match(category, tag)
+            self._match_transactions([t for t in changed if query.matches(t)], category, accounts)
 
-            for ft in from_transactions:
-                self._match_transaction(
-                    "From",
-                    ft,
-                    "To",
-                    category=category,
-                    accounts=accounts,
-                )
+    def _select_tag(self, tags: List[Tag]) -> Optional[Tag]:
+        tag = next((tag for tag in tags if tag.name == self.needs_match_tag), None)
+        if tag is None:
+            self.log.info(f"No transactions need to be matched since there is no '{self.needs_match_tag}' tag")
 
-            for tt in to_transactions:
-                self._match_transaction(
-                    "To",
-                    tt,
-                    "From",
-                    category=category,
-                    accounts=accounts,
-                )
+        return tag
+
+    def _needs_match(
+        self, category: Category, tag: Tag, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> TransactionQuery:
+        """The transfers which haven't been linked yet and are tagged to have their counterpart created."""
+        return TransactionQuery(
+            start_date, end_date, category_id=category.id, tag_id=tag.id, is_group=False, grouped=False
+        )
+
+    def _match_transactions(
+        self,
+        transactions: List[Transaction],
+        category: Category,
+        accounts: Iterable[Account],
+    ) -> None:
+        # Each transaction gets its own counterpart, so runners sharing the task can split it by transaction
+        work = self._prioritise(
+            t
+            for t in transactions
+            if (t.payee.startswith("From ") or t.payee.startswith("To ")) and self._owns(f"transaction:{t.id}")
+        )
+        for i, t in enumerate(work):
+            if self._out_of_time(work[i:]):
+                break
+
+            kind, candidate_kind = ("From", "To") if t.payee.startswith("From ") else ("To", "From")
+            self._match_transaction(
+                kind,
+                t,
+                candidate_kind,
+                category=category,
+                accounts=accounts,
+            )
 
     def _match_transaction(
         self,
@@ -124,72 +146,75 @@ class MatchTransfersTask(Task):
                 None,
             )
             if to_account is None:
-                self.log.warning(
-                    f"No account matching '{transaction.payee[len(kind)+1:]}' for {transaction}"
+                self.diagnostics.warning(
+                    "no_account", "No account matching '%s' for %s", transaction.payee[len(kind)+1:], transaction
                 )
                 span.set_status(Status(StatusCode.ERROR, "No account matching"))
                 return
 
-            with self.tracer.start_as_current_span("lunchmoney.create_transaction"):
-                created_ids = call_lunchmoney(
-                    "POST",
-                    "/v1/transactions",
-                    json={
-                        "apply_rules": True,
-                        "skip_duplicates": False,
-                        "transactions": [
-                            {
+            counterpart = {
+                "date": transaction.date,
+                "payee": f"{candidate_kind} {ft_account.alias}",
+                "amount": (
+                    ""
+                    if transaction.amount.startswith("-")
+                    else "-"
+                )
+                + transaction.amount.lstrip("-"),
+                "currency": transaction.currency,
+                "notes": transaction.notes,
+                "category_id": category.id,
+                f"{to_account.kind}_id": to_account.id,
+                "tags": [
+                    tag.id for tag in transaction.tags if tag.name != self.needs_match_tag
+                ],
+            }
+
+            with self.phase("mutate"), self.tracer.start_as_current_span(
+                "lunchmoney.create_and_group",
+                attributes={"transaction": transaction.id},
+            ):
+                created, group_id = self.journal.execute(
+                    "match_transfers.create_and_group",
+                    [
+                        {
+                            "method": "POST",
+                            "endpoint": "/v1/transactions",
+                            "json": {
+                                "apply_rules": True,
+                                "skip_duplicates": False,
+                                "transactions": [counterpart],
+                            },
+                        },
+                        {
+                            "method": "POST",
+                            "endpoint": "/v1/transactions/group",
+                            "json": {
                                 "date": transaction.date,
-                                "payee": f"{candidate_kind} {ft_account.alias}",
-                                "amount": (
-                                    ""
-                                    if transaction.amount.startswith("-")
-                                    else "-"
-                                )
-                                + transaction.amount.lstrip("-"),
-                                "currency": transaction.currency,
-                                "notes": transaction.notes,
+                                "payee": f"{to_account.alias} {candidate_kind.lower()} {ft_account.alias}",
                                 "category_id": category.id,
-                                f"{to_account.kind}_id": to_account.id,
+                                "notes": "; ".join(
+                                    filter(
+                                        lambda x: x,
+                                        [
+                                            f"{transaction.currency.upper()} {abs(Decimal(transaction.amount))}",
+                                            transaction.notes,
+                                        ],
+                                    )
+                                ),
                                 "tags": [
-                                    tag.id for tag in transaction.tags if tag.name != self.needs_match_tag
-                                ],
-                            }
-                        ],
-                    },
-                )["ids"]
-
-                self.log.info(f"Created new matching transaction for {transaction}: {created_ids}")
-
-                with self.tracer.start_as_current_span(
-                    "lunchmoney.group",
-                    attributes={"transactions": [transaction.id, *created_ids]},
-                ):
-                    group_id = call_lunchmoney(
-                        "POST",
-                        "/v1/transactions/group",
-                        json={
-                            "date": transaction.date,
-                            "payee": f"{to_account.alias} {candidate_kind.lower()} {ft_account.alias}",
-                            "category_id": category.id,
-                            "notes": "; ".join(
-                                filter(
-                                    lambda x: x,
-                                    [
-                                        f"{transaction.currency.upper()} {abs(Decimal(transaction.amount))}",
-                                        transaction.notes,
-                                    ],
-                                )
-                            ),
-                            "tags": [
-                                tag.id for tag in transaction.tags
-                                if tag.name != self.needs_match_tag
-                            ],  # We exclude the original trigger tag
-                            "transactions": [transaction.id, *created_ids],
+                                    tag.id for tag in transaction.tags
+                                    if tag.name != self.needs_match_tag
+                                ],  # We exclude the original trigger tag
+                                "transactions": [transaction.id, ref(0, "ids")],
+                            },
                         },
-                    )
-
-                self.log.debug(
-                    "Created group with ID/error: %s",
-                    group_id,
+                    ],
+                    call_lunchmoney,
                 )
+
+            self.store.apply_create(created["ids"], [counterpart])
+            self.store.apply_group(group_id, [transaction.id, *created["ids"]])
+
+            self.diagnostics.info("created", "Created new matching transaction for %s: %s", transaction, created["ids"])
+            self.diagnostics.debug("grouped", "Created group with ID/error: %s", group_id)
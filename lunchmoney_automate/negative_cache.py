@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .utils import Transaction
+
+# Entries which haven't been looked up for this long are dropped (their transactions have
+# usually left every task's window by then)
+DEFAULT_MAX_AGE = 90 * 24 * 3600
+
+
+def fingerprint(*values: Any) -> str:
+    """A stable digest of some JSON-serializable values."""
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def transaction_fingerprint(transaction: Transaction) -> List[Any]:
+    """The fields of a transaction which decide whether (and how) it can be matched."""
+    return [
+        transaction.id,
+        transaction.date,
+        transaction.payee,
+        transaction.amount,
+        transaction.currency,
+        transaction.category_id,
+        transaction.asset_id,
+        transaction.plaid_account_id,
+        transaction.group_id,
+    ]
+
+
+class NegativeCache:
+    """
+    Remembers transactions which couldn't be matched, so that they aren't evaluated again on
+    every run.
+
+    Each entry is keyed by a scope (the task, and any configuration which affects matching)
+    and a transaction ID, and holds a fingerprint of the transaction's own fields together with
+    the bucket of candidates it was compared against. Once either of those changes (a new
+    candidate arrives, or the transaction is edited) the fingerprint no longer matches and the
+    transaction is evaluated again. When ``path`` is provided, the cache is kept in that file
+    between runs.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_age: float = DEFAULT_MAX_AGE,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def is_hopeless(self, scope: str, transaction_id: int, fingerprint: str) -> bool:
+        """Determines whether a transaction was already found to have no match, given the same candidates."""
+        key = f"{scope}:{transaction_id}"
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["fingerprint"] != fingerprint:
+                return False
+
+            entry["seen_at"] = self.clock()
+            self._dirty = True
+            return True
+
+    def add(self, scope: str, transaction_id: int, fingerprint: str) -> None:
+        with self._lock:
+            self.entries[f"{scope}:{transaction_id}"] = {"fingerprint": fingerprint, "seen_at": self.clock()}
+            self._dirty = True
+
+    def save(self) -> None:
+        """Writes the cache to its file (if it has one), dropping entries which haven't been used recently."""
+        with self._lock:
+            now = self.clock()
+            expired = [key for key, entry in self.entries.items() if now - entry["seen_at"] > self.max_age]
+            for key in expired:
+                del self.entries[key]
+
+            if self.path is None or not (self._dirty or expired):
+                return
+
+            # Write to a temporary file first so that an interrupted save can't corrupt the cache
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,136 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime
+import os
+import threading
+import time
+import tracemalloc
+from typing import Dict, Iterator, Optional
+
+from opentelemetry.trace import Span
+
+
+class ProfileState:
+    def __init__(self) -> None:
+        self.cpu_time: Dict[str, float] = defaultdict(float)
+        self.peak_memory: Dict[str, int] = defaultdict(int)
+        self.task_peak_memory = 0
+
+
+class Profiler:
+    """
+    Optionally profiles tasks (and the fetch, match and mutate phases within them).
+
+    When CPU profiling is enabled each task run is recorded using ``cProfile`` and written to
+    ``output_dir``, and when memory profiling is enabled ``tracemalloc`` is used to track peak
+    memory use. In both cases the figures are attached to the task's span, so regressions can be
+    spotted from traces. Note that ``tracemalloc`` tracks the whole process, so memory figures
+    include any other tasks running at the same time.
+    """
+
+    def __init__(self, cpu: bool = False, memory: bool = False, output_dir: str = "profiles") -> None:
+        self.cpu = cpu
+        self.memory = memory
+        self.output_dir = output_dir
+
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        """Configures profiling using ``LUNCHMONEY_PROFILE`` (e.g. ``cpu,memory``) and ``LUNCHMONEY_PROFILE_DIR``."""
+        modes = set(m.strip() for m in os.getenv("LUNCHMONEY_PROFILE", "").lower().split(",") if m.strip())
+        return cls(
+            cpu="cpu" in modes or "all" in modes,
+            memory="memory" in modes or "all" in modes,
+            output_dir=os.getenv("LUNCHMONEY_PROFILE_DIR", "profiles"),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.cpu or self.memory
+
+    @contextmanager
+    def task(self, name: str, span: Span) -> Iterator[None]:
+        if not self.enabled or getattr(self._local, "state", None) is not None:
+            yield
+            return
+
+        state = self._local.state = ProfileState()
+        profile = cProfile.Profile() if self.cpu else None
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.memory:
+            tracemalloc.reset_peak()
+
+        started = time.thread_time()
+        if profile is not None:
+            profile.enable()
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+            span.set_attribute("profile.cpu_time", time.thread_time() - started)
+            for phase, cpu_time in state.cpu_time.items():
+                span.set_attribute(f"profile.{phase}.cpu_time", cpu_time)
+
+            snapshot = None
+            if self.memory:
+                state.task_peak_memory = max(state.task_peak_memory, tracemalloc.get_traced_memory()[1])
+                span.set_attribute("profile.peak_memory", state.task_peak_memory)
+                for phase, peak_memory in state.peak_memory.items():
+                    span.set_attribute(f"profile.{phase}.peak_memory", peak_memory)
+
+                snapshot = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self._local.state = None
+            self._write_artifacts(name, span, profile, snapshot)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Accumulates the CPU time and peak memory used by a phase of the current task."""
+        state: Optional[ProfileState] = getattr(self._local, "state", None)
+        if state is None:
+            yield
+            return
+
+        if self.memory:
+            state.task_peak_memory = max(state.task_peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        started = time.thread_time()
+        try:
+            yield
+        finally:
+            state.cpu_time[name] += time.thread_time() - started
+
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                state.peak_memory[name] = max(state.peak_memory[name], peak)
+                state.task_peak_memory = max(state.task_peak_memory, peak)
+
+    def _write_artifacts(
+        self,
+        name: str,
+        span: Span,
+        profile: Optional[cProfile.Profile],
+        snapshot: Optional[tracemalloc.Snapshot],
+    ) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"{name}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}")
+
+        if profile is not None:
+            profile.dump_stats(f"{prefix}.prof")
+            span.set_attribute("profile.cpu_artifact", f"{prefix}.prof")
+
+        if snapshot is not None:
+            with open(f"{prefix}.memory.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{stat}\n")
+            span.set_attribute("profile.memory_artifact", f"{prefix}.memory.txt")
@@ -0,0 +1,86 @@
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
+from .store import matches
+from .utils import Account, Transaction
+
+
+class TransactionQuery:
+    """
+    Describes the transactions a task works on, as a set of predicates.
+
+    Every predicate which ``/v1/transactions`` can filter on (category, tag, account, status
+    and whether the transaction is a group) is sent as a request parameter, so that only the
+    transactions a task needs are downloaded. The rest (like whether a transaction has already
+    been grouped, or excluded categories and statuses) are applied locally.
+    """
+
+    def __init__(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        category_id: Optional[int] = None,
+        tag_id: Optional[int] = None,
+        account: Optional[Account] = None,
+        status: Optional[str] = None,
+        is_group: Optional[bool] = None,
+        grouped: Optional[bool] = None,
+        exclude_category_ids: Collection[int] = (),
+        exclude_statuses: Collection[str] = (),
+    ) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.category_id = category_id
+        self.tag_id = tag_id
+        self.account = account
+        self.status = status
+        self.is_group = is_group
+        self.grouped = grouped
+        self.exclude_category_ids = set(exclude_category_ids)
+        self.exclude_statuses = set(exclude_statuses)
+
+    def params(self) -> Dict[str, Any]:
+        """The ``/v1/transactions`` parameters for the predicates which can be pushed to Lunch Money."""
+        params: Dict[str, Any] = {}
+        if self.category_id is not None:
+            params["category_id"] = self.category_id
+        if self.tag_id is not None:
+            params["tag_id"] = self.tag_id
+        if self.account is not None:
+            params[f"{self.account.kind}_id"] = self.account.id
+        if self.status is not None:
+            params["status"] = self.status
+        if self.start_date is not None:
+            params["start_date"] = self.start_date
+        if self.end_date is not None:
+            params["end_date"] = self.end_date
+        if self.is_group is not None:
+            params["is_group"] = str(self.is_group).lower()
+
+        return params
+
+    def key(self) -> Tuple:
+        """Identifies the query by all of its predicates (whether pushed down or not)."""
+        return (
+            tuple(sorted(self.params().items())),
+            self.grouped,
+            tuple(sorted(self.exclude_category_ids)),
+            tuple(sorted(self.exclude_statuses)),
+        )
+
+    def matches(self, transaction: Transaction) -> bool:
+        """Determines whether a transaction satisfies every predicate (whether pushed down or not)."""
+        return matches(transaction, self.params()) and self._matches_locally(transaction)
+
+    def filter(self, transactions: Iterable[Transaction]) -> List[Transaction]:
+        """Applies the predicates which couldn't be pushed down to the transactions returned by Lunch Money."""
+        return [t for t in transactions if self._matches_locally(t)]
+
+    def _matches_locally(self, transaction: Transaction) -> bool:
+        if self.grouped is not None and (transaction.group_id is not None) != self.grouped:
+            return False
+        if transaction.category_id in self.exclude_category_ids:
+            return False
+        if transaction.status in self.exclude_statuses:
+            return False
+
+        return True
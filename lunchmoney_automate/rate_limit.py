@@ -0,0 +1,154 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .deadline import DeadlineExceeded
+
+
+class TokenBucket:
+    """
+    A token bucket which refills at ``rate`` tokens per second up to ``capacity``.
+
+    The bucket's rate is adaptive: it is cut whenever the API tells us we're going
+    too fast and slowly grows back towards its configured ``base_rate`` as requests
+    succeed again.
+    """
+
+    def __init__(self, rate: float, capacity: float, priority: int = 0, min_rate: float = 0.1) -> None:
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.priority = priority
+        self.min_rate = min_rate
+
+        self.tokens = capacity
+        self.updated_at: Optional[float] = None
+        self.waiting = 0
+
+    def refill(self, now: float) -> None:
+        if self.updated_at is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """The number of seconds until a token will be available."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    A process-wide rate limiter which gives reads and writes their own token buckets.
+
+    Requests with a lower priority yield to any waiting requests with a higher priority,
+    so that in-flight mutations are able to complete before we spend our quota on new reads.
+    A 429 response pauses every bucket until its ``Retry-After`` has elapsed and halves the
+    rate of the bucket which was throttled (additive increase, multiplicative decrease).
+    """
+
+    def __init__(
+        self,
+        buckets: Dict[str, TokenBucket] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.buckets = buckets or {
+            "read": TokenBucket(rate=10, capacity=10, priority=0),
+            "write": TokenBucket(rate=4, capacity=4, priority=1),
+        }
+        self.clock = clock
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def try_acquire(self, kind: str) -> float:
+        """
+        Attempts to take a token for the given kind of request, returning ``0`` if one was
+        taken or the number of seconds the caller should wait before trying again.
+        """
+        with self._cond:
+            return self._try_acquire(kind)
+
+    def acquire(self, kind: str, timeout: Optional[float] = None) -> float:
+        """
+        Blocks until a token is available for the given kind of request, returning the time spent
+        waiting. Raises ``DeadlineExceeded`` rather than waiting longer than ``timeout`` seconds.
+        """
+        started = self.clock()
+        with self._cond:
+            bucket = self.buckets[kind]
+            bucket.waiting += 1
+            try:
+                while True:
+                    delay = self._try_acquire(kind)
+                    if not delay:
+                        return self.clock() - started
+                    if timeout is not None and self.clock() - started + delay > timeout:
+                        raise DeadlineExceeded(f"No {kind} token available within {timeout:.2f}s")
+                    self._cond.wait(delay)
+            finally:
+                bucket.waiting -= 1
+                self._cond.notify_all()
+
+    def throttle(self, kind: str, retry_after: Optional[float] = None) -> None:
+        """Records that a request of the given kind was rejected with a 429 response."""
+        with self._cond:
+            now = self.clock()
+            bucket = self.buckets[kind]
+            bucket.refill(now)
+            bucket.rate = max(bucket.min_rate, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0)
+
+            pause = retry_after if retry_after is not None else 1 / bucket.rate
+            self.paused_until = max(self.paused_until, now + pause)
+            self._cond.notify_all()
+
+    def relax(self, kind: str) -> None:
+        """Records that a request of the given kind succeeded, slowly restoring its rate."""
+        with self._cond:
+            bucket = self.buckets[kind]
+            if bucket.rate < bucket.base_rate:
+                bucket.refill(self.clock())
+                bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate / 10)
+
+    def _try_acquire(self, kind: str) -> float:
+        now = self.clock()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        bucket = self.buckets[kind]
+        for other in self.buckets.values():
+            other.refill(now)
+            # Give way to higher priority requests which are still waiting for a token
+            if other.priority > bucket.priority and other.waiting and other.delay() == 0:
+                return 1 / other.rate
+
+        delay = bucket.delay()
+        if not delay:
+            bucket.tokens -= 1
+        return delay
+
+
+def request_kind(method: str) -> str:
+    return "read" if method.upper() in ("GET", "HEAD", "OPTIONS") else "write"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+limiter = RateLimiter()
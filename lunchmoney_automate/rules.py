@@ -0,0 +1,162 @@
+import logging
+from typing import Any, Callable, Collection, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from opentelemetry import trace
+
+from .query import TransactionQuery
+from .slicing import DateSlicer
+from .store import TransactionStore
+from .task import Task
+from .utils import Transaction, group
+
+log = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# A single condition on a transaction, like ("category_id", 85), which several rules may share
+Atom = Tuple[str, Any]
+
+
+def atoms(query: TransactionQuery, evaluated: Collection[Tuple[str, Any]] = ()) -> Tuple[List[Atom], List[Atom]]:
+    """
+    Splits a query into the conditions Lunch Money evaluates (its parameters) and those applied
+    locally, leaving out any parameters which are already known to hold.
+    """
+    pushed: List[Atom] = []
+    for key, value in query.params().items():
+        if (key, value) in evaluated:
+            continue
+        pushed.append((key, str(value).lower() == "true" if key == "is_group" else value))
+
+    local: List[Atom] = []
+    if query.grouped is not None:
+        local.append(("grouped", query.grouped))
+    if query.exclude_category_ids:
+        local.append(("exclude_category_ids", frozenset(query.exclude_category_ids)))
+    if query.exclude_statuses:
+        local.append(("exclude_statuses", frozenset(query.exclude_statuses)))
+
+    return pushed, local
+
+
+def evaluate(transaction: Transaction, atom: Atom) -> bool:
+    key, value = atom
+    if key == "start_date":
+        return transaction.date >= value
+    if key == "end_date":
+        return transaction.date <= value
+    if key == "is_group":
+        return bool(transaction.is_group) == value
+    if key == "tag_id":
+        return any(tag.id == value for tag in transaction.tags)
+    if key == "grouped":
+        return (transaction.group_id is not None) == value
+    if key == "exclude_category_ids":
+        return transaction.category_id not in value
+    if key == "exclude_statuses":
+        return transaction.status not in value
+
+    return getattr(transaction, key) == value
+
+
+class RuleEngine:
+    """
+    Evaluates the transaction queries of every task in a single pass.
+
+    Each rule (a task's query) is broken down into conditions, and each distinct condition is
+    evaluated once per transaction however many rules share it, with every transaction routed
+    to all of the rules it satisfies. ``prime`` uses this to fetch the transactions for all of
+    the tasks at once (with each distinct query sent once, however many tasks make it) and to
+    hand each task the transactions routed to its rules, so the tasks don't fetch and filter
+    the same transactions again.
+    """
+
+    def __init__(
+        self,
+        rules: Mapping[str, TransactionQuery],
+        evaluated: Collection[Tuple[str, Any]] = (),
+        slicer: Optional[DateSlicer] = None,
+        tasks: Optional[Mapping[str, Task]] = None,
+    ) -> None:
+        self.rules = dict(rules)
+        self.slicer = slicer or DateSlicer()
+        self._atoms = {name: atoms(query, evaluated) for name, query in self.rules.items()}
+
+        # The task each rule belongs to, when the rules are those of tasks
+        self._tasks: Dict[str, Task] = dict(tasks or {})
+
+    @classmethod
+    def for_tasks(cls, tasks: Mapping[str, Task]) -> "RuleEngine":
+        rules: Dict[str, TransactionQuery] = {}
+        owners: Dict[str, Task] = {}
+        for name, task in tasks.items():
+            for rule, query in task.rules().items():
+                rules[f"{name}.{rule}"] = query
+                owners[f"{name}.{rule}"] = task
+
+        slicer = next(iter(tasks.values())).slicer if tasks else None
+        return cls(rules, slicer=slicer, tasks=owners)
+
+    def classify(self, transactions: Iterable[Transaction]) -> Dict[str, List[Transaction]]:
+        """Routes each transaction to every rule it satisfies."""
+        routed: Dict[str, List[Transaction]] = {name: [] for name in self.rules}
+
+        for t in transactions:
+            results: Dict[Atom, bool] = {}
+
+            def holds(atom: Atom) -> bool:
+                result = results.get(atom)
+                if result is None:
+                    result = results[atom] = evaluate(t, atom)
+                return result
+
+            for name, (pushed, local) in self._atoms.items():
+                if all(holds(atom) for atom in pushed) and all(holds(atom) for atom in local):
+                    routed[name].append(t)
+
+        return routed
+
+    def prime(self, store: TransactionStore, call: Callable[..., Any]) -> Dict[str, List[Transaction]]:
+        """
+        Fetches the transactions for every rule, sending each distinct set of parameters (so
+        every request is still filtered by Lunch Money) once for each window of dates, then
+        routes all of them to the rules they satisfy in one pass and hands each task the
+        transactions for its rules.
+        """
+        routed: Dict[str, List[Transaction]] = {}
+        windows = group(self.rules.items(), key=lambda rule: (rule[1].start_date, rule[1].end_date))
+        for (start_date, end_date), rules in windows.items():
+            requests = group(rules, key=lambda rule: tuple(sorted(rule[1].params().items())))
+
+            with tracer.start_as_current_span(
+                "rules.prime", attributes={"rules": [name for name, _ in rules], "requests": len(requests)}
+            ):
+                transactions: Dict[int, Transaction] = {}
+                for key in requests:
+                    for t in store.query(
+                        dict(key),
+                        lambda params: self.slicer.fetch(
+                            params, lambda params: call("GET", "/v1/transactions", params=params)["transactions"]
+                        ),
+                    ):
+                        transactions[t.id] = t
+
+                # Every transaction was fetched for this window, so there's no need to check its date again
+                evaluated = {("start_date", start_date), ("end_date", end_date)}
+                window_routed = RuleEngine(dict(rules), evaluated=evaluated).classify(transactions.values())
+
+            generation = store.generation
+            for name, query in rules:
+                if name in self._tasks:
+                    self._tasks[name].classified[query.key()] = (generation, window_routed[name])
+
+            log.debug(
+                "%d transactions between %s and %s classified for %d rules with %d requests",
+                len(transactions),
+                start_date,
+                end_date,
+                len(rules),
+                len(requests),
+            )
+            routed.update(window_routed)
+
+        return routed
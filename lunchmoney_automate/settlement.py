@@ -0,0 +1,95 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+
+import numpy as np
+
+# How many of the most recent links are kept for each pair of accounts
+MAX_SAMPLES = 500
+
+
+class SettlementLags:
+    """
+    Records how many days apart the transactions linked for each pair of accounts were, so that
+    tasks can look for candidates (and fetch transactions) only as far apart as links for that
+    pair actually are.
+
+    Once a pair has ``min_samples`` links, its offset is the ``percentile``-th percentile of the
+    observed offsets, never exceeding the configured ceiling. Pairs with fewer links use the
+    ceiling. Pairs which are expected to be linked (like a transfer which couldn't be linked
+    yet) are tracked before they have any links. When ``path`` is provided, the observations are
+    kept in that file between runs.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        percentile: float = 95,
+        min_samples: int = 20,
+        max_samples: int = MAX_SAMPLES,
+    ) -> None:
+        self.path = path
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+
+        self.samples: Dict[str, Deque[int]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                for key, samples in json.load(f).items():
+                    self.samples[key] = deque(samples, maxlen=max_samples)
+
+    def record(self, key: str, offset_days: int) -> None:
+        with self._lock:
+            self.samples.setdefault(key, deque(maxlen=self.max_samples)).append(abs(int(offset_days)))
+            self._dirty = True
+
+    def expect(self, key: str) -> None:
+        """Tracks a pair which hasn't been linked (enough) yet, so that it keeps windows at their widest."""
+        with self._lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.max_samples)
+                self._dirty = True
+
+    def max_offset(self, key: str, ceiling: int) -> int:
+        """The most days apart two transactions for a pair are likely to be (and at most ``ceiling``)."""
+        with self._lock:
+            samples = list(self.samples.get(key, ()))
+
+        if len(samples) < self.min_samples:
+            return ceiling
+
+        return min(ceiling, int(math.ceil(np.percentile(samples, self.percentile))))
+
+    def widest(self, prefix: str, ceiling: int, keys: Iterable[str] = ()) -> Optional[int]:
+        """
+        The largest ``max_offset`` of the pairs whose keys start with ``prefix`` (and of the
+        configured pairs in ``keys``), or None until there are pairs and every one of them has
+        enough links to go by.
+        """
+        with self._lock:
+            counts = {key: len(samples) for key, samples in self.samples.items() if key.startswith(prefix)}
+            counts.update((key, len(self.samples.get(key, ()))) for key in keys)
+
+        if not counts or min(counts.values()) < self.min_samples:
+            return None
+
+        return max(self.max_offset(key, ceiling) for key in counts)
+
+    def save(self) -> None:
+        with self._lock:
+            if self.path is None or not self._dirty:
+                return
+
+            # Write to a temporary file first so that an interrupted save can't corrupt the observations
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({key: list(samples) for key, samples in self.samples.items()}, f)
+            os.replace(temp_path, self.path)
+            self._dirty = False
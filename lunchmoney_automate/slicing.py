@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import date, timedelta
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import utils
+
+# The most requests made at once for the slices of a single query
+SLICE_WORKERS = 4
+
+
+class DateSlicer:
+    """
+    Splits queries for long ranges of dates into slices which are fetched concurrently, so a
+    backfill (or a busy account) isn't one slow query followed by one huge response.
+
+    Slices are sized from the responses seen so far, aiming for about ``target_count``
+    transactions or ``target_seconds`` per request (whichever is reached first), between
+    ``min_days`` and ``max_days``. While a session is being recorded or replayed, slices are only
+    sized from the number of transactions (so a replay asks for the same slices as the recording,
+    however quickly its responses arrive). The slices' transactions are merged in date order, and each
+    transaction is only returned once even if it appears in more than one slice (when its date
+    changes between requests, for example), as it was in the last response to arrive.
+    """
+
+    def __init__(
+        self,
+        slice_days: int = 45,
+        min_days: int = 7,
+        max_days: int = 180,
+        target_count: int = 1000,
+        target_seconds: float = 2.0,
+        workers: int = SLICE_WORKERS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.slice_days = slice_days
+        self.min_days = min_days
+        self.max_days = max_days
+        self.target_count = target_count
+        self.target_seconds = target_seconds
+        self.workers = workers
+        self.clock = clock
+
+        # Smoothed transactions (and seconds) per day of the responses seen so far
+        self._per_day: Optional[Tuple[float, float]] = None
+        self._responses = 0
+        self._lock = threading.Lock()
+
+    def per_day(self) -> Optional[float]:
+        """The (smoothed) number of transactions per day in the responses seen so far, if any."""
+        with self._lock:
+            return None if self._per_day is None else self._per_day[0]
+
+    def slices(self, start_date: str, end_date: str) -> List[Tuple[str, str]]:
+        """Splits an (inclusive) range of dates into consecutive slices of the current size."""
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        with self._lock:
+            days = self.slice_days
+
+        slices = []
+        while start <= end:
+            slice_end = min(end, start + timedelta(days=days - 1))
+            slices.append((start.isoformat(), slice_end.isoformat()))
+            start = slice_end + timedelta(days=1)
+
+        return slices
+
+    def fetch(
+        self, params: Dict[str, Any], fetch: Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        if "start_date" not in params or "end_date" not in params:
+            return fetch(params)
+
+        slices = self.slices(params["start_date"], params["end_date"])
+        if len(slices) == 1:
+            _, result, elapsed = self._fetch_slice(params, fetch)
+            self._resize(params, result, elapsed)
+            return result
+
+        with ThreadPoolExecutor(max_workers=min(len(slices), self.workers), thread_name_prefix="lunchmoney-slice") as pool:
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    self._fetch_slice,
+                    {**params, "start_date": start_date, "end_date": end_date},
+                    fetch,
+                )
+                for start_date, end_date in slices
+            ]
+            results = [future.result() for future in futures]
+
+        # Resize in the order of the slices (rather than of their responses), so the same
+        # responses always lead to the same slices
+        for (start_date, end_date), (_, result, elapsed) in zip(slices, results):
+            self._resize({"start_date": start_date, "end_date": end_date}, result, elapsed)
+
+        # Later responses are the more recent copies of any transactions which appear in more than one
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for _, result, _ in sorted(results, key=lambda response: response[0]):
+            merged.update((item["id"], item) for item in result)
+
+        return sorted(merged.values(), key=lambda item: item["date"])
+
+    def _fetch_slice(
+        self, params: Dict[str, Any], fetch: Callable[[Dict[str, Any]], List[Dict[str, Any]]]
+    ) -> Tuple[int, List[Dict[str, Any]], float]:
+        """Fetches a single slice, returning the order its response arrived in, its transactions and how long it took."""
+        started = self.clock()
+        result = fetch(params)
+        elapsed = self.clock() - started
+
+        with self._lock:
+            self._responses += 1
+            return self._responses, result, elapsed
+
+    def _resize(self, params: Dict[str, Any], result: List[Dict[str, Any]], elapsed: float) -> None:
+        """Uses the size (and latency) of a slice's response to resize later slices."""
+        days = (date.fromisoformat(params["end_date"]) - date.fromisoformat(params["start_date"])).days + 1
+        count_per_day, seconds_per_day = len(result) / days, elapsed / days
+
+        with self._lock:
+            if self._per_day is not None:
+                count_per_day = (self._per_day[0] + count_per_day) / 2
+                seconds_per_day = (self._per_day[1] + seconds_per_day) / 2
+            self._per_day = (count_per_day, seconds_per_day)
+
+            ideal = self.target_count / max(count_per_day, 1e-9)
+            if not utils.recording():
+                ideal = min(ideal, self.target_seconds / max(seconds_per_day, 1e-9))
+            self.slice_days = int(max(self.min_days, min(self.max_days, ideal)))
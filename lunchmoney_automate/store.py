@@ -0,0 +1,324 @@
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .archive import TransactionArchive
+from .utils import Transaction
+
+# The /v1/transactions query parameters which we know how to evaluate locally
+LOCAL_PARAMS = {"category_id", "tag_id", "asset_id", "plaid_account_id", "status", "start_date", "end_date", "is_group"}
+
+
+def matches(transaction: Transaction, params: Dict[str, Any]) -> bool:
+    """Determines whether a transaction would be returned by a /v1/transactions query with the given parameters."""
+    for key, value in params.items():
+        if key == "start_date":
+            if transaction.date < value:
+                return False
+        elif key == "end_date":
+            if transaction.date > value:
+                return False
+        elif key == "is_group":
+            if bool(transaction.is_group) != (str(value).lower() == "true"):
+                return False
+        elif key == "tag_id":
+            if not any(tag.id == value for tag in transaction.tags):
+                return False
+        elif getattr(transaction, key) != value:
+            return False
+
+    return True
+
+
+class Window:
+    """The range of dates for which we have fetched a query's transactions."""
+
+    def __init__(self, start_date: str, end_date: str, ids: List[int], refreshed_at: float) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.ids = ids
+        self.refreshed_at = refreshed_at
+
+
+class TransactionStore:
+    """
+    An in-memory store of the transactions fetched during a run, which is shared by every task.
+
+    Each transaction is represented by a single ``Transaction`` instance no matter how many
+    queries return it, and mutations (grouping, ungrouping and creating transactions) are
+    written through to those instances. Repeated queries are served from the store, so later
+    tasks see the effects of earlier ones without fetching the transactions again. Queries which
+    only add filters we can evaluate locally (like a tag) are also served from broader queries.
+
+    Long-lived stores can also fetch incrementally: once a query has been fetched, later
+    queries for the same filters only fetch the most recent ``overlap_days`` (plus any newer
+    dates), until ``full_refresh_interval`` seconds have passed. Reference data (accounts and
+    categories) is kept for ``reference_ttl`` seconds, or for the store's lifetime by default.
+
+    When given an ``archive``, every transaction the store fetches (or changes) is added to it,
+    and queries read as much of their history as they can from the archive, only fetching the
+    most recent dates from Lunch Money.
+    """
+
+    def __init__(
+        self,
+        overlap_days: Optional[int] = None,
+        full_refresh_interval: float = 6 * 3600,
+        reference_ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        archive: Optional[TransactionArchive] = None,
+    ) -> None:
+        self.transactions: Dict[int, Transaction] = {}
+        self.queries: Dict[Tuple, Tuple[Dict[str, Any], List[int]]] = {}
+        self.windows: Dict[Tuple, Window] = {}
+        self.references: Dict[str, Tuple[float, Any]] = {}
+
+        self.overlap_days = overlap_days
+        self.full_refresh_interval = full_refresh_interval
+        self.reference_ttl = reference_ttl
+        self.clock = clock
+        self.archive = archive
+
+        # Counts the changes made to the transactions (rather than fetched from Lunch Money), so
+        # that anything worked out from them can tell whether it is still current
+        self.generation = 0
+
+        # The transactions created since the cached queries were last invalidated, with the
+        # generation they were created at
+        self._created: List[Tuple[int, Transaction]] = []
+        self._created_from = 0
+
+        self._lock = threading.RLock()
+
+    def reference(self, endpoint: str, fetch: Callable[[], Any]) -> Any:
+        """Gets reference data (like the list of accounts), fetching it if it isn't cached."""
+        with self._lock:
+            if endpoint in self.references:
+                fetched_at, data = self.references[endpoint]
+                if self.reference_ttl is None or self.clock() - fetched_at < self.reference_ttl:
+                    return data
+
+        data = fetch()
+
+        with self._lock:
+            self.references[endpoint] = (self.clock(), data)
+            return data
+
+    def query(
+        self,
+        params: Dict[str, Any],
+        fetch: Callable[[Dict[str, Any]], List[Dict[str, Any]]],
+    ) -> List[Transaction]:
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            transactions = self.cached(params)
+            if transactions is not None:
+                return transactions
+
+            shape = tuple((k, v) for k, v in key if k not in ("start_date", "end_date"))
+            window = self._incremental_window(shape, params)
+
+        archived_until = (
+            self.archive.fetch_from(params) if window is None and self.archive is not None else None
+        )
+        if archived_until is not None:
+            history = self.archive.read(params, until=archived_until)
+            data = fetch({**params, "start_date": archived_until})
+
+            with self._lock:
+                fetched = [self._upsert(item) for item in data]
+                fetched_ids = set(t.id for t in fetched)
+
+                # Transactions already in the store are more up to date than their archived copies
+                kept = [
+                    self.transactions.get(item["id"]) or self._upsert(item)
+                    for item in history
+                    if item["id"] not in fetched_ids
+                ]
+                transactions = [*(t for t in kept if matches(t, params)), *fetched]
+
+                self.archive.append(fetched)
+                self.archive.cover(params, full=False)
+        elif window is None:
+            data = fetch(params)
+
+            with self._lock:
+                transactions = [self._upsert(item) for item in data]
+                if self.archive is not None:
+                    self.archive.append(transactions)
+                    self.archive.cover(params, full=True)
+                if self.overlap_days is not None and "start_date" in params and "end_date" in params:
+                    self.windows[shape] = Window(
+                        params["start_date"], params["end_date"], [t.id for t in transactions], self.clock()
+                    )
+        else:
+            fetch_from = (
+                date.fromisoformat(window.end_date) - timedelta(days=self.overlap_days)
+            ).isoformat()
+            fetch_from = max(fetch_from, params["start_date"])
+            data = fetch({**params, "start_date": fetch_from})
+
+            with self._lock:
+                fetched = [self._upsert(item) for item in data]
+                fetched_ids = set(t.id for t in fetched)
+                kept = [
+                    self.transactions[id]
+                    for id in window.ids
+                    if id in self.transactions
+                    and id not in fetched_ids
+                    and params["start_date"] <= self.transactions[id].date < fetch_from
+                ]
+                transactions = [*kept, *fetched]
+
+                window.ids = [
+                    *(id for id in window.ids if id not in fetched_ids and self.transactions[id].date < fetch_from),
+                    *(t.id for t in fetched),
+                ]
+                window.end_date = max(window.end_date, params["end_date"])
+                if self.archive is not None:
+                    self.archive.append(fetched)
+
+        with self._lock:
+            self.queries[key] = (params, [t.id for t in transactions])
+            return transactions
+
+    def cached(self, params: Dict[str, Any]) -> Optional[List[Transaction]]:
+        """The transactions matching a query, if they can be worked out without fetching any."""
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            if key in self.queries:
+                _, ids = self.queries[key]
+                return [self.transactions[id] for id in ids if id in self.transactions]
+
+            broader = self._broader_query(params)
+            if broader is None:
+                return None
+
+            _, ids = broader
+            transactions = [
+                self.transactions[id]
+                for id in ids
+                if id in self.transactions and matches(self.transactions[id], params)
+            ]
+            self.queries[key] = (params, [t.id for t in transactions])
+            return transactions
+
+    def get(self, id: int) -> Optional[Transaction]:
+        return self.transactions.get(id)
+
+    def put(self, data: Dict[str, Any]) -> Transaction:
+        """Adds (or updates) a single transaction fetched from Lunch Money."""
+        with self._lock:
+            return self._upsert(data)
+
+    def invalidate(self) -> None:
+        """Forgets all of the cached queries, so that they will be fetched again (incrementally, if enabled)."""
+        with self._lock:
+            self.queries.clear()
+            self._created.clear()
+            self._created_from = self.generation
+
+    def created_since(self, generation: int) -> Optional[List[Transaction]]:
+        """
+        The transactions created after a generation of the store, or None if they're no longer
+        known (when the cached queries have been invalidated since).
+        """
+        with self._lock:
+            if generation < self._created_from:
+                return None
+
+            return [t for created_at, t in self._created if created_at > generation]
+
+    def apply_group(self, group_id: int, transaction_ids: Iterable[int]) -> None:
+        with self._lock:
+            changed = []
+            for id in transaction_ids:
+                if id in self.transactions:
+                    self.transactions[id].group_id = group_id
+                    changed.append(self.transactions[id])
+            self.generation += 1
+
+            if self.archive is not None:
+                self.archive.append(changed)
+
+    def apply_ungroup(self, transaction_ids: Iterable[int]) -> None:
+        self.apply_group(None, transaction_ids)
+
+    def apply_create(self, ids: List[int], transactions: List[Dict[str, Any]]) -> List[Transaction]:
+        """
+        Adds transactions created using POST /v1/transactions to the store (and any matching queries).
+        Their tags (which are sent as IDs) are filled in from the tags cached in the store, if any.
+        """
+        with self._lock:
+            _, tags = self.references.get("/v1/tags", (None, []))
+            tags_by_id = {tag["id"]: tag for tag in tags}
+
+            created = []
+            for id, data in zip(ids, transactions):
+                transaction = Transaction(**{
+                    **data,
+                    "id": id,
+                    "is_group": False,
+                    "group_id": None,
+                    "tags": [tags_by_id.get(tag, {"id": tag}) for tag in data.get("tags", [])],
+                })
+                self.transactions[id] = transaction
+                created.append(transaction)
+            self.generation += 1
+            self._created.extend((self.generation, t) for t in created)
+
+            if self.archive is not None:
+                self.archive.append(created)
+
+            for key, (params, query_ids) in list(self.queries.items()):
+                if not LOCAL_PARAMS.issuperset(params):
+                    # We can't tell whether the new transactions belong in this query, so re-fetch it next time
+                    del self.queries[key]
+                    continue
+
+                query_ids.extend(t.id for t in created if matches(t, params))
+
+            for shape, window in self.windows.items():
+                params = {**dict(shape), "start_date": window.start_date, "end_date": window.end_date}
+                if LOCAL_PARAMS.issuperset(params):
+                    window.ids.extend(t.id for t in created if matches(t, params))
+
+            return created
+
+    def _broader_query(self, params: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], List[int]]]:
+        """Finds a cached query which includes every transaction ``params`` could return, if there is one."""
+        for cached_params, ids in self.queries.values():
+            extra = set(params) - set(cached_params)
+            if (
+                extra
+                and LOCAL_PARAMS.issuperset(extra)
+                and all(k in params and params[k] == v for k, v in cached_params.items())
+            ):
+                return cached_params, ids
+
+        return None
+
+    def _incremental_window(self, shape: Tuple, params: Dict[str, Any]) -> Optional[Window]:
+        if self.overlap_days is None or "start_date" not in params or "end_date" not in params:
+            return None
+
+        window = self.windows.get(shape)
+        if window is None or self.clock() - window.refreshed_at >= self.full_refresh_interval:
+            return None
+
+        # We can only fill in the gap if we already have everything up to the overlap period
+        if window.start_date > params["start_date"] or window.end_date < params["start_date"]:
+            return None
+
+        return window
+
+    def _upsert(self, data: Dict[str, Any]) -> Transaction:
+        transaction = Transaction(**data)
+        existing = self.transactions.get(transaction.id)
+        if existing is None:
+            self.transactions[transaction.id] = transaction
+            return transaction
+
+        existing.__dict__.update(transaction.__dict__)
+        return existing
@@ -1,12 +1,255 @@
 from abc import ABC, abstractclassmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import contextvars
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
 import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 from opentelemetry import trace
+from opentelemetry.trace import Span
+
+from .coordination import Coordinator
+from .deadline import deadline, expired, remaining
+from .diagnostics import Diagnostics
+from .journal import Journal
+from .negative_cache import NegativeCache
+from .profiling import Profiler
+from .query import TransactionQuery
+from .settlement import SettlementLags
+from .slicing import DateSlicer
+from .store import TransactionStore
+from .usage import Usage, metered
+from .utils import Account, Category, Tag, Transaction, today
+
+T = TypeVar("T")
+
+# The most requests a task will make at once when prefetching the data it needs
+PREFETCH_WORKERS = 8
+
+# How many days beyond the longest expected settlement lag are still worked on, so that links
+# are still made when a counterpart arrives late or a few runs are missed
+LOOKBACK_MARGIN_DAYS = 7
 
 class Task(ABC):
+    lookback_days = 30
+
+    # The most time (in seconds) a single run of the task may take, if limited
+    time_budget: Optional[float] = None
+
     def __init__(self) -> None:
         self.log = logging.getLogger(self.__class__.__name__)
         self.tracer = trace.get_tracer(self.__class__.__name__)
+        self.journal = Journal()
+        self.negative_cache = NegativeCache()
+        self.store = TransactionStore()
+        self.profiler = Profiler.from_env()
+        self.diagnostics = Diagnostics(self.log)
+        self.settlement = SettlementLags()
+        self.slicer = DateSlicer()
+        self.unprocessed: List[Transaction] = []
+
+        # The transactions left to process as of the latest check of the deadline
+        self._remaining: Optional[Iterable[Transaction]] = None
+
+        # The requests made to Lunch Money by the task's latest run
+        self.usage = Usage()
+
+        # The transactions already fetched and routed to each of the task's queries (by
+        # ``RuleEngine.prime``), along with the generation of the store they were routed at
+        self.classified: Dict[Tuple, Tuple[int, List[Transaction]]] = {}
+
+        # When set, the coordinator and group sharing this task's units of work between runners
+        self.partition: Optional[Tuple[Coordinator, str]] = None
+
+        # Held while the task runs (or processes changes), since the daemon and events may both
+        # drive the same task, and the state above belongs to a single run at a time
+        self.lock = threading.RLock()
+        self.refresh_window()
+
+    def refresh_window(self) -> None:
+        """Moves the window of transactions this task works on so that it ends today."""
+        now = today()
+
+        self.start_date = (now - timedelta(days=self.window_days())).isoformat()
+        self.end_date = now.isoformat()
+
+    def window_days(self) -> int:
+        """
+        How many days of transactions a run works on. Tasks which know how far apart the
+        transactions they link are override this to work on fewer than ``lookback_days``.
+        """
+        return self.lookback_days
 
     @abstractclassmethod
     def run(self):
         pass
+
+    @contextmanager
+    def profile(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        Starts the span for a run of this task, profiling it if profiling is enabled and
+        bounding it by the task's time budget. Once the run completes (or fails), what it has
+        learned (which transactions couldn't be matched, and the settlement lags of its links) is
+        saved, a summary of its diagnostics is emitted, and any transactions which were left
+        unprocessed when the time ran out (or the run failed) are reported. The requests made by
+        the run are measured in ``usage``. Runs of the same task wait for one another, holding
+        its ``lock``.
+        """
+        with self.lock, self.tracer.start_as_current_span(name, attributes=attributes) as span:
+            self.unprocessed = []
+            self._remaining = None
+            self.diagnostics.reset()
+            failed = True
+            try:
+                with metered() as self.usage, self.profiler.task(name, span), deadline(self.time_budget):
+                    yield span
+                failed = False
+            finally:
+                if failed and self._remaining is not None:
+                    self.unprocessed.extend(self._remaining)
+                self._remaining = None
+
+                self.negative_cache.save()
+                self.settlement.save()
+
+                self.diagnostics.summary(span)
+                span.set_attribute("api.reads", self.usage.reads)
+                span.set_attribute("api.writes", self.usage.writes)
+                span.set_attribute("api.bytes", self.usage.bytes)
+                span.set_attribute("api.seconds", self.usage.seconds)
+
+                if self.unprocessed:
+                    span.set_attribute("unprocessed", [t.id for t in self.unprocessed])
+                    self.log.warning(
+                        f"{'Failed' if failed else 'Ran out of time'} before processing "
+                        f"{len(self.unprocessed)} transactions: "
+                        + ", ".join(str(t) for t in self.unprocessed)
+                    )
+
+    def phase(self, name: str):
+        """Marks a phase of the task (``fetch``, ``match`` or ``mutate``) so that it is profiled separately."""
+        return self.profiler.phase(name)
+
+    def rules(self) -> Dict[str, TransactionQuery]:
+        """
+        The queries a full run of this task will make, so that they can be evaluated together
+        with those of other tasks. Tasks which can't describe their work up front return none.
+        """
+        return {}
+
+    def max_writes(self, rule: str, transactions: List[Transaction]) -> int:
+        """
+        The most requests that change data a run may make for the transactions matching one of
+        its ``rules``, so that the cost of a run can be estimated before it is made.
+        """
+        return 0
+
+    def max_writes_for_count(self, rule: str, count: int) -> int:
+        """
+        Like ``max_writes``, for when only the number of transactions matching the rule can be
+        estimated (before they have ever been fetched).
+        """
+        return 0
+
+    def process(self, changed: List[Transaction]) -> None:
+        """
+        Processes a set of new or changed transactions. Tasks which can work out which
+        transactions are affected by a change should override this to avoid a full run.
+        """
+        self.run()
+
+    def _owns(self, unit: str) -> bool:
+        """Claims a unit of work for this runner, if it is responsible for it (always, unless the task is partitioned)."""
+        if self.partition is None:
+            return True
+
+        coordinator, group = self.partition
+        return coordinator.claim(group, unit)
+
+    def _prioritise(self, transactions: Iterable[Transaction]) -> List[Transaction]:
+        """Orders transactions so that, when working under a deadline, the highest-value ones are processed first."""
+        if remaining() is None:
+            return list(transactions)
+
+        return sorted(transactions, key=lambda t: abs(Decimal(t.amount)), reverse=True)
+
+    def _out_of_time(self, transactions: Iterable[Transaction]) -> bool:
+        """
+        Checks whether the deadline has passed, recording the transactions which won't be
+        processed if it has. Otherwise they're reported if the run fails before the next check.
+        """
+        if not expired():
+            self._remaining = transactions
+            return False
+
+        self._remaining = None
+        self.unprocessed.extend(transactions)
+        return True
+
+    def _prefetch(self, *fetches: Callable[[], T]) -> List[T]:
+        """
+        Runs independent fetches concurrently, waiting for all of them to complete. Each fetch
+        runs in a copy of the current context, so its spans are still part of the task's trace.
+        """
+        if len(fetches) <= 1:
+            return [fetch() for fetch in fetches]
+
+        with ThreadPoolExecutor(max_workers=min(len(fetches), PREFETCH_WORKERS), thread_name_prefix="lunchmoney-prefetch") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, fetch) for fetch in fetches]
+            return [future.result() for future in futures]
+
+    def _load_reference_data(self, call: Callable[..., Any]) -> Tuple[List[Account], List[Category]]:
+        """Loads the accounts and categories, fetching each of them at the same time."""
+        with self.tracer.start_as_current_span("lunchmoney.reference"):
+            assets, plaid_accounts, categories = self._prefetch(*(
+                partial(self.store.reference, endpoint, partial(call, "GET", endpoint))
+                for endpoint in ["/v1/assets", "/v1/plaid_accounts", "/v1/categories"]
+            ))
+
+        accounts = [
+            *(Account("asset", **asset) for asset in assets["assets"]),
+            *(Account("plaid_account", **asset) for asset in plaid_accounts["plaid_accounts"]),
+        ]
+        categories = [Category(**cat) for cat in categories["categories"]]
+
+        self.log.debug("%d accounts loaded from Lunch Money", len(accounts))
+        for account in accounts:
+            self.diagnostics.debug("account", "%s (%s)", account.alias, account.id)
+
+        self.log.debug("%d categories loaded from Lunch Money", len(categories))
+        return accounts, categories
+
+    def _load_tags(self, call: Callable[..., Any]) -> List[Tag]:
+        with self.tracer.start_as_current_span("lunchmoney.tags"):
+            tags = [Tag(**tag) for tag in self.store.reference("/v1/tags", lambda: call("GET", "/v1/tags"))]
+
+        self.log.debug("%d tags loaded from Lunch Money", len(tags))
+        return tags
+
+    def _query(self, query: TransactionQuery, call: Callable[..., Any]) -> List[Transaction]:
+        """
+        Fetches the transactions matching a query (pushing as many of its predicates as possible
+        to Lunch Money, and fetching long ranges of dates in concurrent slices). Transactions
+        which were routed to the query along with every other task's are used instead, checked
+        again (along with any transactions created since) if the store has changed since.
+        """
+        classified = self.classified.pop(query.key(), None)
+        if classified is not None:
+            generation, routed = classified
+            if generation == self.store.generation:
+                return routed
+
+            created = self.store.created_since(generation)
+            if created is not None:
+                return query.filter(routed) + [t for t in created if query.matches(t)]
+
+        transactions = self.store.query(
+            query.params(),
+            lambda params: self.slicer.fetch(
+                params, lambda params: call("GET", "/v1/transactions", params=params)["transactions"]
+            ),
+        )
+        return query.filter(transactions)
@@ -0,0 +1,226 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from opentelemetry import trace
+
+from .archive import TransactionArchive
+from .budget import CostEstimator, Estimate, report
+from .coordination import Coordinator, coordinated
+from .deadline import deadline
+from .journal import Journal
+from .link_spare_change import SpareChangeEngine
+from .link_transfers import LinkTransfersTask
+from .match_transfers import MatchTransfersTask
+from .negative_cache import NegativeCache
+from .store import TransactionStore
+from .rules import RuleEngine
+from .settlement import SettlementLags
+from .slicing import DateSlicer
+from .task import Task
+from .transport import create_transport
+from .usage import Usage, metered
+from .utils import Client, call_lunchmoney, current_client
+
+log = logging.getLogger(__name__)
+
+
+def create_tasks(config: Dict[str, Any]) -> Dict[str, Task]:
+    """Creates the tasks enabled in a ``LUNCHMONEY_CONFIG`` style configuration."""
+    tasks: Dict[str, Task] = {}
+    if "transfers" in config:
+        log.info("Link Transfers task enabled in configuration")
+        tasks["transfers"] = LinkTransfersTask(**config["transfers"])
+
+    if "match_transfers" in config:
+        log.info("Match Transfers task enabled in configuration")
+        tasks["match_transfers"] = MatchTransfersTask(**config["match_transfers"])
+
+    if "spare_change" in config:
+        log.info("Link Spare Change task enabled in configuration")
+        tasks["spare_change"] = SpareChangeEngine(config["spare_change"])
+
+    if "lookback_days" in config:
+        for task in tasks.values():
+            task.lookback_days = config["lookback_days"]
+            task.refresh_window()
+
+    for name, budget in config.get("time_budgets", {}).items():
+        if name in tasks:
+            tasks[name].time_budget = budget
+
+    return tasks
+
+
+class Tenant:
+    """
+    A single Lunch Money budget, with its own token, rate limits, tasks and store.
+
+    Besides the usual task configuration, a tenant's config may include ``journal``,
+    ``negative_cache``, ``settlement`` and ``archive`` paths (the equivalents of
+    ``LUNCHMONEY_JOURNAL``, ``LUNCHMONEY_NEGATIVE_CACHE``, ``LUNCHMONEY_SETTLEMENT`` and
+    ``LUNCHMONEY_ARCHIVE``), a ``deadline`` (in seconds) for
+    the tenant's run, the ``transport`` to use (like ``LUNCHMONEY_TRANSPORT``), whether to
+    ``fuse_rules`` (fetching the transactions for every task at once) and its ``coordination``
+    with other runners.
+    """
+
+    def __init__(self, name: str, token: str, config: Dict[str, Any]) -> None:
+        self.name = name
+        self.client = Client(token, transport=create_transport(config.get("transport")))
+        self.tasks = create_tasks(config)
+        self.store = TransactionStore(
+            archive=TransactionArchive(config["archive"]) if config.get("archive") else None
+        )
+        self.journal = Journal(config.get("journal"))
+        self.deadline: Optional[float] = config.get("deadline")
+        self.fuse_rules: bool = config.get("fuse_rules", False)
+        self.coordinator = Coordinator.from_config(config.get("coordination"))
+        self.partition: bool = (config.get("coordination") or {}).get("partition", False)
+
+        negative_cache = NegativeCache(config.get("negative_cache"))
+        settlement = SettlementLags(config.get("settlement"))
+        self.slicer = DateSlicer()
+        for task in self.tasks.values():
+            task.store = self.store
+            task.journal = self.journal
+            task.negative_cache = negative_cache
+            task.settlement = settlement
+            task.slicer = self.slicer
+
+
+class TenantResult:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.duration = 0.0
+        self.task_durations: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.unprocessed: Dict[str, List[int]] = {}
+
+        # The estimated and actual requests made to Lunch Money by each task
+        self.estimates: Dict[str, Estimate] = {}
+        self.usage: Dict[str, Usage] = {}
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.errors
+
+    def __str__(self) -> str:
+        tasks = ", ".join(f"{name}:{duration:.2f}s" for name, duration in self.task_durations.items())
+        status = "ok" if self.succeeded else f"failed ({', '.join(self.errors)})"
+        unprocessed = sum(len(ids) for ids in self.unprocessed.values())
+        return f"{self.name} {status} in {self.duration:.2f}s [{tasks}]" + (
+            f" with {unprocessed} transactions left unprocessed" if unprocessed else ""
+        )
+
+
+class MultiTenantRunner:
+    """
+    Runs the tasks for many Lunch Money budgets on a shared worker pool.
+
+    Each tenant's API calls use its own token, connection and rate limiter (through
+    ``current_client``), so a tenant which is slow, throttled or failing only holds up its own
+    worker while the others carry on.
+    """
+
+    def __init__(
+        self,
+        tenants: List[Tenant],
+        workers: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.tenants = tenants
+        self.workers = workers
+        self.clock = clock
+
+        self.tracer = trace.get_tracer(self.__class__.__name__)
+
+    @classmethod
+    def from_config(cls, tenants: List[Dict[str, Any]], workers: int = 4) -> "MultiTenantRunner":
+        """Creates a runner from a list of ``{"name": ..., "token": ..., "config": {...}}`` entries."""
+        return cls(
+            [
+                Tenant(tenant.get("name", f"tenant-{i}"), tenant["token"], tenant.get("config", {}))
+                for i, tenant in enumerate(tenants)
+            ],
+            workers=workers,
+        )
+
+    def run(self) -> List[TenantResult]:
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lunchmoney-tenant") as pool:
+            results = list(pool.map(self._run_tenant, self.tenants))
+
+        for result in results:
+            if result.succeeded:
+                log.info(f"Tenant {result}")
+            else:
+                log.error(f"Tenant {result}")
+
+            for line in report(result.estimates, result.usage):
+                log.info(f"Tenant {result.name} API usage {line}")
+
+        return results
+
+    def _run_tenant(self, tenant: Tenant) -> TenantResult:
+        result = TenantResult(tenant.name)
+        started = self.clock()
+
+        token = current_client.set(tenant.client)
+        try:
+            with self.tracer.start_as_current_span(
+                "tenant.run", attributes={"tenant": tenant.name}
+            ) as span, deadline(tenant.deadline):
+                with metered() as estimate_usage:
+                    for task in tenant.tasks.values():
+                        task.refresh_window()
+                    result.estimates = CostEstimator(tenant.store, tenant.slicer).estimate(
+                        tenant.tasks, fused=tenant.fuse_rules
+                    )
+                result.usage["estimate"] = estimate_usage
+
+                try:
+                    tenant.journal.resume(call_lunchmoney)
+                except Exception as ex:
+                    # Running the tasks could repeat the incomplete operations, so skip this tenant
+                    log.exception(f"Unable to resume incomplete operations for {tenant.name}: {ex}")
+                    result.errors["journal"] = str(ex)
+                    span.record_exception(ex)
+                    return result
+
+                if tenant.fuse_rules:
+                    try:
+                        with metered() as prime_usage:
+                            RuleEngine.for_tasks(tenant.tasks).prime(tenant.store, call_lunchmoney)
+                        result.usage["rules"] = prime_usage
+                    except Exception as ex:
+                        # The tasks can still fetch their own transactions
+                        log.warning(f"Unable to fetch transactions for every task at once for {tenant.name}: {ex}")
+
+                for name, task in tenant.tasks.items():
+                    task_started = self.clock()
+                    try:
+                        with coordinated(tenant.coordinator, f"{tenant.name}/{name}", task, tenant.partition) as held:
+                            if not held:
+                                log.info(f"Skipping task {name} for {tenant.name} since another runner is working on it")
+                                continue
+
+                            task.refresh_window()
+                            task.run()
+                            result.usage[name] = task.usage
+                    except Exception as ex:
+                        log.exception(f"Task {name} failed for {tenant.name}: {ex}")
+                        result.errors[name] = str(ex)
+                        result.usage[name] = task.usage
+                        span.record_exception(ex)
+                    finally:
+                        result.task_durations[name] = self.clock() - task_started
+                        if task.unprocessed:
+                            result.unprocessed[name] = [t.id for t in task.unprocessed]
+
+                span.set_attribute("duration", self.clock() - started)
+        finally:
+            current_client.reset(token)
+            result.duration = self.clock() - started
+
+        return result
@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+from .archive import TransactionArchive
+from .store import TransactionStore
+from .utils import Transaction
+
+
+def transaction(id, date, **data):
+    return {
+        "id": id,
+        "date": date,
+        "payee": "Coffee",
+        "amount": "4.5000",
+        "currency": "usd",
+        "asset_id": 73,
+        "category_id": 85,
+        "status": "cleared",
+        "is_group": False,
+        "group_id": None,
+        "tags": [],
+        **data,
+    }
+
+
+def test_archive_round_trip(tmp_path):
+    archive = TransactionArchive(str(tmp_path))
+    tags = [{"id": 801, "name": "needs-pair"}]
+    archive.append([
+        Transaction(**transaction(1, "2020-01-01", tags=tags)),
+        Transaction(**transaction(2, "2020-01-05", asset_id=None, plaid_account_id=9)),
+        Transaction(**transaction(3, "2020-01-09")),
+    ])
+    archive.append([Transaction(**transaction(1, "2020-01-01", tags=tags, group_id=5555))])
+
+    # A new instance reads the archive back from disk
+    archive = TransactionArchive(str(tmp_path))
+    history = archive.read({"asset_id": 73, "start_date": "2020-01-01", "end_date": "2020-01-31"}, until="2020-01-08")
+    assert history == [
+        transaction(
+            1, "2020-01-01", tags=tags, group_id=5555, notes=None, plaid_account_id=None, parent_id=None, recurring_id=None
+        )
+    ]
+
+    assert [t["id"] for t in archive.read({"tag_id": 801}, until="2020-02-01")] == [1]
+    assert [t["id"] for t in archive.read({"category_id": 85}, until="2020-02-01")] == [1, 2, 3]
+
+
+def test_moved_transactions_leave_their_old_account(tmp_path):
+    archive = TransactionArchive(str(tmp_path))
+    archive.append([Transaction(**transaction(1, "2020-01-01")), Transaction(**transaction(2, "2020-01-02"))])
+    archive.append([Transaction(**transaction(1, "2020-01-01", asset_id=74))])
+
+    # A new instance finds where each transaction was archived before moving it again
+    archive = TransactionArchive(str(tmp_path))
+    assert [t["id"] for t in archive.read({"asset_id": 73}, until="2020-02-01")] == [2]
+    assert [(t["id"], t["asset_id"]) for t in archive.read({"category_id": 85}, until="2020-02-01")] == [(1, 74), (2, 73)]
+
+    archive.append([Transaction(**transaction(1, "2020-01-01"))])
+    assert [t["id"] for t in archive.read({"asset_id": 73}, until="2020-02-01")] == [1, 2]
+    assert archive.read({"asset_id": 74}, until="2020-02-01") == []
+
+
+def test_store_reads_history_from_archive(tmp_path):
+    now = [0.0]
+    params = {"category_id": 85, "start_date": "2019-01-01", "end_date": "2020-01-10"}
+
+    fetch = MagicMock(return_value=[transaction(1, "2019-03-01"), transaction(2, "2020-01-09")])
+    TransactionStore(archive=TransactionArchive(str(tmp_path), clock=lambda: now[0])).query(params, fetch)
+
+    # The next run only fetches the most recent dates
+    fetch = MagicMock(return_value=[transaction(2, "2020-01-09", group_id=84389), transaction(3, "2020-01-11")])
+    store = TransactionStore(archive=TransactionArchive(str(tmp_path), overlap_days=3, clock=lambda: now[0]))
+    transactions = store.query({**params, "end_date": "2020-01-11"}, fetch)
+
+    fetch.assert_called_once_with({**params, "start_date": "2020-01-07", "end_date": "2020-01-11"})
+    assert [t.id for t in transactions] == [1, 2, 3]
+    assert store.get(2).group_id == 84389
+
+    # Once the history is too old, it is fetched in full again
+    now[0] = 30 * 24 * 3600
+    fetch = MagicMock(return_value=[])
+    TransactionStore(archive=TransactionArchive(str(tmp_path), clock=lambda: now[0])).query(params, fetch)
+    fetch.assert_called_once_with(params)
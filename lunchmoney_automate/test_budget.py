@@ -0,0 +1,88 @@
+from datetime import date
+import math
+from unittest.mock import MagicMock, patch
+
+from .archive import TransactionArchive
+from .budget import TRANSACTION_BYTES, TRANSACTIONS_PER_DAY, CostEstimator, Estimate, report
+from .link_transfers import LinkTransfersTask
+from .store import TransactionStore
+from .transport import RequestsTransport
+from .usage import Usage, metered
+from .utils import Client, Transaction, call_lunchmoney, current_client
+
+
+def test_requests_are_metered():
+    client = Client("tenant-token")
+    client.transport = RequestsTransport(MagicMock())
+    client.transport.session.request.return_value = MagicMock(status_code=200, headers={}, content=b'{"assets": []}')
+    client.transport.session.request.return_value.json.return_value = {"assets": []}
+
+    token = current_client.set(client)
+    try:
+        call_lunchmoney("GET", "/v1/assets")
+        with metered() as usage:
+            call_lunchmoney("GET", "/v1/assets")
+            call_lunchmoney("POST", "/v1/transactions/group", json={})
+    finally:
+        current_client.reset(token)
+
+    assert (usage.reads, usage.writes, usage.bytes) == (1, 1, 28)
+    assert usage.seconds >= 0
+
+
+def test_estimates_reads_from_the_window(call_lunchmoney):
+    task = LinkTransfersTask()
+    estimator = CostEstimator(task.store, task.slicer)
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+        estimate = estimator.estimate({"transfers": task})["transfers"]
+        task.run()
+
+    # Without an archive, the number of transactions is estimated from the number of days
+    days = (date.fromisoformat(task.end_date) - date.fromisoformat(task.start_date)).days + 1
+    count = math.ceil(days * TRANSACTIONS_PER_DAY)
+    assert estimate.reads == len(task.slicer.slices(task.start_date, task.end_date))
+    assert (estimate.writes, estimate.bytes) == (count // 2, count * TRANSACTION_BYTES)
+
+    # Once the run has cached its transactions, running again wouldn't fetch them again
+    assert str(estimator.estimate({"transfers": task})["transfers"]) == "reads=0 writes<=0 bytes~0"
+
+    # Without them, the estimate uses the rate of the transactions fetched so far
+    uncached = LinkTransfersTask(create_if_missing=True)
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+        estimate = CostEstimator(uncached.store, task.slicer).estimate({"transfers": uncached})["transfers"]
+    count = math.ceil(days * task.slicer.per_day())
+    assert (estimate.writes, estimate.bytes) == (2 * count, count * TRANSACTION_BYTES)
+
+
+def test_estimates_writes_from_the_archive(call_lunchmoney, tmp_path):
+    archive = TransactionArchive(str(tmp_path))
+    task = LinkTransfersTask()
+    task.store = TransactionStore(archive=archive)
+    archive.append([
+        Transaction(
+            id=id, date=task.end_date, payee="Transfer", amount="10.0000", currency="usd",
+            asset_id=73, category_id=85, status="cleared", is_group=False, group_id=None, tags=[],
+        )
+        for id in range(1, 5)
+    ])
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+        estimate = CostEstimator(task.store, task.slicer).estimate({"transfers": task})["transfers"]
+
+    assert estimate.writes == 2
+    assert estimate.bytes == 4 * TRANSACTION_BYTES
+
+
+def test_report_flags_tasks_over_estimate():
+    usage = Usage()
+    for method in ["GET", "GET", "POST", "POST", "POST"]:
+        usage.record(method, 100, 0.5)
+
+    lines = report({"transfers": Estimate(reads=2, writes=2, bytes=None)}, {"transfers": usage, "rules": Usage()})
+
+    assert lines == [
+        "transfers: estimated reads=2 writes<=2 bytes~?, actual reads=2 writes=3 bytes=500 latency=2.50s (over estimate)",
+        "rules: estimated -, actual reads=0 writes=0 bytes=0 latency=0.00s",
+        "total: estimated reads=2 writes<=2 bytes~?, actual reads=2 writes=3 bytes=500 latency=2.50s",
+    ]
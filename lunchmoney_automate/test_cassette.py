@@ -0,0 +1,126 @@
+import gzip
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from .cassette import Cassette, CassetteError
+from .link_transfers import LinkTransfersTask
+from .rate_limit import RateLimiter
+from .slicing import DateSlicer
+from .utils import call_lunchmoney
+
+
+def make_response(status_code: int, body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["Content-Type"] = "application/json"
+    response.headers["Set-Cookie"] = "session=secret"
+    response._content = json.dumps(body).encode("utf-8")
+    return response
+
+
+def record(path, monkeypatch):
+    monkeypatch.setenv("LUNCHMONEY_TOKEN", "test-token")
+
+    cassette = Cassette(str(path), "record")
+    responses = [
+        make_response(200, {"assets": [{"id": 72, "note": "test-token"}]}),
+        make_response(200, {"transactions": []}),
+    ]
+    with patch("lunchmoney_automate.utils.cassette", cassette), patch(
+        "lunchmoney_automate.utils.limiter", RateLimiter()
+    ), patch("lunchmoney_automate.utils.session.request", side_effect=responses):
+        call_lunchmoney("GET", "/v1/assets")
+        call_lunchmoney("GET", "/v1/transactions", params={"asset_id": 72})
+
+    cassette.close()
+
+
+def test_cassette_records_without_token(tmp_path, monkeypatch):
+    path = tmp_path / "session.jsonl.gz"
+    record(path, monkeypatch)
+
+    with gzip.open(path, "rt") as f:
+        content = f.read()
+
+    assert "test-token" not in content
+    assert "session=secret" not in content
+
+    interactions = [json.loads(line) for line in content.splitlines()]
+    assert [i["request"]["endpoint"] for i in interactions] == ["/v1/assets", "/v1/transactions"]
+    assert interactions[1]["request"]["params"] == {"asset_id": 72}
+
+
+@pytest.mark.parametrize(["mode", "sleeps"], [("replay", 2), ("replay-fast", 0)])
+def test_cassette_replays_offline(tmp_path, monkeypatch, mode, sleeps):
+    path = tmp_path / "session.jsonl.gz"
+    record(path, monkeypatch)
+    monkeypatch.delenv("LUNCHMONEY_TOKEN")
+
+    sleep = MagicMock()
+    cassette = Cassette(str(path), mode, sleep=sleep)
+    with patch("lunchmoney_automate.utils.cassette", cassette), patch(
+        "lunchmoney_automate.utils.session.request"
+    ) as request_mock, patch("lunchmoney_automate.utils.limiter") as limiter:
+        assert call_lunchmoney("GET", "/v1/transactions", params={"asset_id": 72}) == {"transactions": []}
+        assert call_lunchmoney("GET", "/v1/assets") == {"assets": [{"id": 72, "note": "<redacted>"}]}
+
+        with pytest.raises(CassetteError):
+            call_lunchmoney("GET", "/v1/assets")
+
+    request_mock.assert_not_called()
+    limiter.acquire.assert_not_called()
+    assert sleep.call_count == sleeps
+
+
+def test_replays_work_on_the_recorded_dates(tmp_path):
+    path = tmp_path / "session.jsonl.gz"
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({
+            "request": {"method": "GET", "endpoint": "/v1/assets", "params": None, "json": None},
+            "response": {"status_code": 200, "headers": {}, "body": "{}"},
+            "elapsed": 0.1,
+            "recorded_on": "2020-01-15",
+        }) + "\n")
+
+    with patch("lunchmoney_automate.utils.cassette", Cassette(str(path), "replay-fast")):
+        task = LinkTransfersTask()
+
+    assert (task.start_date, task.end_date) == ("2019-12-16", "2020-01-15")
+
+
+def test_replays_fetch_the_recorded_slices(tmp_path, monkeypatch):
+    monkeypatch.setenv("LUNCHMONEY_TOKEN", "test-token")
+    path = tmp_path / "session.jsonl.gz"
+    params = {"category_id": 85, "start_date": "2020-01-01", "end_date": "2020-03-31"}
+
+    def fetch(params):
+        return call_lunchmoney("GET", "/v1/transactions", params=params)["transactions"]
+
+    def respond(method, url, params=None, **kwargs):
+        # Slow enough that the slices would be resized from the latency of the responses
+        time.sleep(0.01)
+        return make_response(200, {"transactions": [{"id": params["start_date"], "date": params["start_date"]}]})
+
+    cassette = Cassette(str(path), "record")
+    slicer = DateSlicer(slice_days=10, min_days=1, target_seconds=0.05)
+    with patch("lunchmoney_automate.utils.cassette", cassette), patch(
+        "lunchmoney_automate.utils.limiter", RateLimiter()
+    ), patch("lunchmoney_automate.utils.session.request", side_effect=respond):
+        recorded = [slicer.fetch(params, fetch) for _ in range(2)]
+    cassette.close()
+
+    slicer = DateSlicer(slice_days=10, min_days=1, target_seconds=0.05)
+    with patch("lunchmoney_automate.utils.cassette", Cassette(str(path), "replay-fast")):
+        replayed = [slicer.fetch(params, fetch) for _ in range(2)]
+
+    assert len(recorded[0]) > 1
+    assert replayed == recorded
+
+
+def test_cassette_rejects_unknown_modes(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "session.jsonl.gz"), "rewind")
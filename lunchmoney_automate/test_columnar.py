@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from .columnar import NONE, TransactionTable, date_ordinal, to_minor_units
+from .utils import Account, Transaction
+
+
+@pytest.fixture
+def table():
+    return TransactionTable([
+        Transaction(id=1, date="2020-01-01", payee="To Savings", amount="10.0000", asset_id=72, category_id=85),
+        Transaction(id=2, date="2020-01-03", payee="To Savings", amount="10.0000", plaid_account_id=72),
+        Transaction(id=3, date="2020-01-02", payee="From Checking", amount="-0.5300", asset_id=72),
+    ])
+
+
+@pytest.mark.parametrize(
+    ["amount", "expected"],
+    [("10.0000", 100000), ("-0.53", -5300), ("0.0900", 900)],
+)
+def test_to_minor_units(amount: str, expected: int):
+    assert to_minor_units(amount) == expected
+
+
+def test_columns(table: TransactionTable):
+    assert list(table.ids) == [1, 2, 3]
+    assert list(table.asset_ids) == [72, NONE, 72]
+    assert list(table.plaid_account_ids) == [NONE, 72, NONE]
+    assert list(table.category_ids) == [85, NONE, NONE]
+    assert list(table.dates - date_ordinal("2020-01-01")) == [0, 2, 1]
+    assert table.payees[0] == table.payees[1] == table.payee_code("To Savings")
+    assert table.payee_code("To Nowhere") == NONE
+
+
+def test_candidate_selection(table: TransactionTable):
+    account = Account("asset", id=72, name="Savings")
+
+    mask = table.account_mask(account) & (table.amounts == to_minor_units("10.0000"))
+    assert table.select(mask) == [table.transactions[0]]
+
+    offsets = table.date_offsets("2020-01-03")
+    nearest = table.first(table.payees == table.payee_code("To Savings"), key=offsets)
+    assert nearest.id == 2
+
+
+def test_remove(table: TransactionTable):
+    table.remove(table.transactions[0])
+
+    assert len(table) == 2
+    assert [t.id for t in table] == [2, 3]
+    assert not np.any(table.account_mask(Account("asset", id=72)) & (table.ids == 1))
+
+
+def test_amount_index(table: TransactionTable):
+    assert [t.id for t in table.select(table.amounts_near(table.convert("10.0000", "usd")))] == [1, 2]
+    assert [t.id for t in table.select(table.amounts_between(-10000, 0))] == [3]
+
+    table.remove(table.transactions[0])
+    assert [t.id for t in table.select(table.amounts_near(100000))] == [2]
+
+
+def test_amount_index_with_exchange_rates():
+    table = TransactionTable(
+        [
+            Transaction(id=1, date="2020-01-02", amount="135.0000", currency="cad"),
+            Transaction(id=2, date="2020-01-02", amount="100.0000", currency="usd"),
+            Transaction(id=3, date="2020-01-02", amount="100.0000", currency="eur"),
+            Transaction(id=4, date="2020-01-02", amount="5.0000", currency="gbp"),
+        ],
+        exchange_rates={"USD": 1, "CAD": "0.74"},
+    )
+
+    amount = table.convert("100.0000", "usd")
+    assert [t.id for t in table.select(table.amounts_near(amount))] == [2]
+    assert [t.id for t in table.select(table.amounts_near(amount, tolerance=0.01))] == [1, 2]
+
+    # Transactions in currencies without a rate never match
+    assert np.isnan(table.convert("100.0000", "eur"))
+    assert not table.amounts_between(-np.inf, np.inf)[2]
+    assert not table.amounts_near(-table.convert("-100.0000", "eur"), tolerance=0.02).any()
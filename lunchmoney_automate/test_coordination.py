@@ -0,0 +1,75 @@
+from .coordination import Coordinator, coordinated
+from .link_spare_change import SpareChangeEngine, SpareChangePair
+from .utils import Account
+
+
+def test_only_one_runner_holds_a_lease(tmp_path):
+    now = [0.0]
+    path = str(tmp_path / "runs.db")
+    first = Coordinator(path, owner="first", ttl=60, clock=lambda: now[0])
+    second = Coordinator(path, owner="second", ttl=60, clock=lambda: now[0])
+
+    with coordinated(first, "home/transfers", None) as held:
+        assert held
+        assert not second.acquire("home/transfers")
+
+        # A lease which hasn't been renewed (because its runner died) can be taken over
+        now[0] = 120
+        assert second.acquire("home/transfers")
+
+    assert first.acquire("home/spare_change")
+
+
+def test_units_are_partitioned_between_runners(tmp_path):
+    path = str(tmp_path / "runs.db")
+    runners = [Coordinator(path, owner=f"runner-{i}") for i in range(3)]
+    for runner in runners:
+        runner.join("home/spare_change")
+    for runner in runners:
+        assert runner.join("home/spare_change") == ["runner-0", "runner-1", "runner-2"]
+
+    units = [f"asset:{i}" for i in range(30)]
+    owned = [[unit for unit in units if runner.owns("home/spare_change", unit)] for runner in runners]
+
+    assert sorted(unit for units in owned for unit in units) == sorted(units)
+    assert all(owned)
+
+
+def test_runners_joining_later_never_share_units(tmp_path):
+    path = str(tmp_path / "runs.db")
+    first = Coordinator(path, owner="first")
+    second = Coordinator(path, owner="second")
+    units = [f"asset:{i}" for i in range(30)]
+
+    # The first runner starts alone, claiming some units before the second one joins
+    first.join("home/transfers")
+    claimed = {runner: set() for runner in ("first", "second")}
+    claimed["first"] = set(unit for unit in units[:10] if first.claim("home/transfers", unit))
+    assert claimed["first"] == set(units[:10])
+
+    second.join("home/transfers")
+    for unit in units:
+        if second.claim("home/transfers", unit):
+            claimed["second"].add(unit)
+        if first.claim("home/transfers", unit):
+            claimed["first"].add(unit)
+
+    assert not claimed["first"] & claimed["second"]
+    assert claimed["first"] | claimed["second"] == set(units)
+    assert claimed["second"]
+
+    # Leaving releases the units' claims
+    first.leave("home/transfers")
+    assert all(second.claim("home/transfers", unit) for unit in units)
+
+
+def test_pairs_sharing_accounts_are_one_unit():
+    accounts = {id: Account("asset", id=id, name=f"Account {id}") for id in range(1, 6)}
+    pairs = [
+        (SpareChangePair(f"Account {main}", f"Account {savings}"), accounts[main], accounts[savings], set())
+        for main, savings in [(1, 2), (3, 2), (4, 5)]
+    ]
+
+    units = SpareChangeEngine([])._work_units(pairs)
+
+    assert units == ["asset:1,asset:2,asset:3", "asset:1,asset:2,asset:3", "asset:4,asset:5"]
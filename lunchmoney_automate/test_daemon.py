@@ -0,0 +1,77 @@
+import threading
+import time
+from unittest.mock import patch
+
+from .daemon import Daemon
+from .events import EventProcessor
+from .store import TransactionStore
+from .task import Task
+
+
+class RecordingTask(Task):
+    def __init__(self, fail: bool = False) -> None:
+        super().__init__()
+        self.runs = 0
+        self.fail = fail
+
+    def run(self):
+        self.runs += 1
+        if self.fail:
+            raise Exception("Task failed")
+
+
+def test_tasks_run_on_their_own_interval():
+    quick, slow = RecordingTask(), RecordingTask()
+    store = TransactionStore()
+
+    daemon = Daemon({"quick": quick, "slow": slow}, intervals={"quick": 0.01, "slow": 60}, store=store)
+    daemon.run(max_runs=4)
+
+    assert quick.runs == 3
+    assert slow.runs == 1
+    assert quick.store is store and slow.store is store
+
+
+def test_failing_tasks_do_not_stop_the_daemon():
+    failing, healthy = RecordingTask(fail=True), RecordingTask()
+
+    daemon = Daemon({"failing": failing, "healthy": healthy}, intervals={}, default_interval=0.01, store=TransactionStore())
+    daemon.run(max_runs=4)
+
+    assert failing.runs == 2
+    assert healthy.runs == 2
+
+
+class SlowTask(RecordingTask):
+    def __init__(self) -> None:
+        super().__init__()
+        self.active = 0
+        self.overlapped = False
+        self.started = threading.Event()
+
+    def run(self):
+        self._work()
+
+    def process(self, changed):
+        self._work()
+
+    def _work(self):
+        self.active += 1
+        self.overlapped |= self.active > 1
+        self.started.set()
+        time.sleep(0.05)
+        self.active -= 1
+
+
+def test_events_wait_for_the_daemon_to_finish_running_a_task():
+    task, store = SlowTask(), TransactionStore()
+    daemon = Daemon({"slow": task}, intervals={}, store=store)
+    thread = threading.Thread(target=daemon.run, kwargs={"max_runs": 1})
+    thread.start()
+    task.started.wait(5)
+
+    with patch("lunchmoney_automate.events.call_lunchmoney", return_value={"id": 1, "date": "2020-01-01"}):
+        EventProcessor([task], store).process([1])
+    thread.join()
+
+    assert not task.overlapped
@@ -0,0 +1,89 @@
+import json
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from .deadline import DeadlineExceeded, deadline, expired, remaining
+from .link_transfers import LinkTransfersTask
+from .rate_limit import RateLimiter
+from .settlement import SettlementLags
+from .utils import REQUEST_TIMEOUT, call_lunchmoney
+
+
+def test_deadlines_nest():
+    assert remaining() is None
+
+    with deadline(60):
+        assert 59 < remaining() <= 60
+
+        with deadline(120):
+            assert remaining() <= 60
+
+        with deadline(0):
+            assert expired()
+
+        assert not expired()
+
+    assert remaining() is None
+
+
+def test_requests_are_bounded_by_the_deadline(monkeypatch):
+    monkeypatch.setenv("LUNCHMONEY_TOKEN", "test-token")
+
+    ok = MagicMock(status_code=200, headers={})
+    ok.json.return_value = {"assets": []}
+
+    with patch("lunchmoney_automate.utils.limiter", RateLimiter()), patch(
+        "lunchmoney_automate.utils.session.request", return_value=ok
+    ) as request_mock:
+        call_lunchmoney("GET", "/v1/assets")
+        assert request_mock.call_args.kwargs["timeout"] == REQUEST_TIMEOUT
+
+        with deadline(5):
+            call_lunchmoney("GET", "/v1/assets")
+            assert request_mock.call_args.kwargs["timeout"] <= 5
+
+        with deadline(0), pytest.raises(DeadlineExceeded):
+            call_lunchmoney("GET", "/v1/assets")
+
+    assert request_mock.call_count == 2
+
+
+def test_tasks_stop_when_their_budget_runs_out(call_lunchmoney):
+    task = LinkTransfersTask()
+    task.time_budget = 60
+
+    # The budget runs out after the first (most valuable) transfer has been linked
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney), patch(
+        "lunchmoney_automate.task.expired", side_effect=[False, True]
+    ):
+        task.run()
+
+    call_lunchmoney.assert_any_call('POST', '/v1/transactions/group', json={
+        'date': '2020-01-02',
+        'payee': 'Test Asset 2 to Test Asset 1',
+        'category_id': 85,
+        'notes': 'USD 100.0000',
+        'tags': [],
+        'transactions': [605, 604]
+    })
+    assert [t.id for t in task.unprocessed] == [608]
+
+
+def test_failed_runs_save_what_they_learned_and_report_what_is_left(call_lunchmoney, tmp_path, caplog):
+    task = LinkTransfersTask(create_if_missing=True)
+    task.settlement = SettlementLags(str(tmp_path / "settlement.json"))
+
+    # The deadline passes while the counterpart of the second transfer is being created
+    task.journal.execute = MagicMock(side_effect=[[84389], DeadlineExceeded("No time left")])
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney), caplog.at_level(logging.INFO):
+        with pytest.raises(DeadlineExceeded):
+            task.run()
+
+    with open(tmp_path / "settlement.json") as f:
+        assert sum(len(samples) for samples in json.load(f).values()) == 1
+
+    assert [t.id for t in task.unprocessed] == [608]
+    assert any(r.getMessage().startswith("Summary:") for r in caplog.records)
+    assert any(r.getMessage().startswith("Failed before processing 1 transactions") for r in caplog.records)
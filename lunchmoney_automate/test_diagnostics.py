@@ -0,0 +1,50 @@
+import logging
+from unittest.mock import MagicMock
+
+from .diagnostics import Diagnostics, lazy
+
+
+def test_messages_are_sampled_and_summarised(caplog):
+    diagnostics = Diagnostics(logging.getLogger("test_diagnostics"), sample_first=2, sample_every=5)
+
+    with caplog.at_level(logging.DEBUG, logger="test_diagnostics"):
+        for i in range(1, 11):
+            diagnostics.debug("skipped", "Skipping %d", i)
+        diagnostics.warning("no_match", "No match for %d", 42)
+
+        span = MagicMock()
+        counts = diagnostics.summary(span)
+
+    assert [r.getMessage() for r in caplog.records] == [
+        "Skipping 1",
+        "Skipping 2",
+        "Skipping 5",
+        "Skipping 10",
+        "No match for 42",
+        "Summary: no_match=1, skipped=10",
+    ]
+    assert counts == {"skipped": 10, "no_match": 1}
+    span.set_attribute.assert_any_call("diagnostics.skipped", 10)
+
+
+def test_mutations_are_never_sampled(caplog):
+    diagnostics = Diagnostics(logging.getLogger("test_diagnostics"), sample_first=2, sample_every=5)
+
+    with caplog.at_level(logging.DEBUG, logger="test_diagnostics"):
+        for i in range(1, 11):
+            diagnostics.info("linked", "Found link %d", i)
+            diagnostics.debug("grouped", "Created group %d", i)
+
+    assert [r.getMessage() for r in caplog.records if r.diagnostic == "linked"] == [f"Found link {i}" for i in range(1, 11)]
+    assert len([r for r in caplog.records if r.diagnostic == "grouped"]) == 10
+
+
+def test_disabled_messages_are_not_rendered(caplog):
+    diagnostics = Diagnostics(logging.getLogger("test_diagnostics"))
+    expensive = MagicMock(return_value=3)
+
+    with caplog.at_level(logging.INFO, logger="test_diagnostics"):
+        diagnostics.debug("candidates", "%s candidates", lazy(expensive))
+
+    expensive.assert_not_called()
+    assert diagnostics.counts["candidates"] == 1
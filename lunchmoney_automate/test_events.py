@@ -0,0 +1,61 @@
+import queue
+from unittest.mock import patch
+
+from .events import EventProcessor, EventServer, publish
+from .link_spare_change import LinkSpareChangeTask
+from .link_transfers import LinkTransfersTask
+from .store import TransactionStore
+
+
+def test_event_server_accepts_notifications():
+    events = queue.Queue()
+    server = EventServer(events, port=0)
+    server.start()
+
+    try:
+        publish(server.url, [605, 607])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [events.get_nowait(), events.get_nowait()] == [605, 607]
+
+
+def test_process_changed_transactions(lunchmoney_api_calls, call_lunchmoney):
+    transactions = {t["id"]: t for t in lunchmoney_api_calls["GET /v1/transactions"]["transactions"]}
+    lunchmoney_api_calls["GET /v1/transactions/605"] = transactions[605]
+    lunchmoney_api_calls["GET /v1/transactions/607"] = transactions[607]
+
+    processor = EventProcessor(
+        [LinkTransfersTask(), LinkSpareChangeTask('Test Asset 2', 'Test Asset 1')],
+        TransactionStore(),
+    )
+
+    with patch("lunchmoney_automate.events.call_lunchmoney", call_lunchmoney), patch(
+        "lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney
+    ), patch("lunchmoney_automate.link_spare_change.call_lunchmoney", call_lunchmoney):
+        processor.process([605, 607])
+
+    # Candidates are only fetched for the window around the changed transactions
+    call_lunchmoney.assert_any_call('GET', '/v1/transactions', params={
+        'category_id': 85,
+        'start_date': '2019-12-19',
+        'end_date': '2020-01-16',
+        'is_group': "false",
+    })
+    call_lunchmoney.assert_any_call('POST', '/v1/transactions/group', json={
+        'date': '2020-01-02',
+        'payee': 'Test Asset 2 to Test Asset 1',
+        'category_id': 85,
+        'notes': 'USD 100.0000',
+        'tags': [],
+        'transactions': [605, 604]
+    })
+    call_lunchmoney.assert_any_call('POST', '/v1/transactions/group', json={
+        'date': '2020-01-02',
+        'payee': 'Walmart',
+        'category_id': 83,
+        'notes': None,
+        'tags': [],
+        'transactions': [603, 606, 607]
+    })
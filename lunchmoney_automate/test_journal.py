@@ -0,0 +1,86 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from .deadline import DeadlineExceeded, deadline
+from .journal import Journal, ref, resolve
+
+
+def create_and_group_steps():
+    return [
+        {"method": "POST", "endpoint": "/v1/transactions", "json": {"transactions": [{"payee": "To Test Asset 1"}]}},
+        {"method": "POST", "endpoint": "/v1/transactions/group", "json": {"transactions": [608, ref(0, "ids")]}},
+    ]
+
+
+def test_resolve():
+    results = [{"ids": [610, 609]}, 84389]
+
+    assert resolve({"id": ref(1)}, results) == {"id": 84389}
+    assert resolve({"transactions": [608, ref(0, "ids")]}, results) == {"transactions": [608, 609, 610]}
+    assert resolve({"tags": [801, 802]}, results) == {"tags": [801, 802]}
+
+
+def test_execute_in_memory():
+    call = MagicMock(side_effect=[{"ids": [609]}, 84389])
+
+    assert Journal().execute("test", create_and_group_steps(), call) == [{"ids": [609]}, 84389]
+    call.assert_any_call("POST", "/v1/transactions/group", json={"transactions": [608, 609]})
+
+
+def test_resume_after_rejected_step(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+
+    rejected = MagicMock(side_effect=[{"ids": [609]}, requests.HTTPError("503 Service Unavailable")])
+    with pytest.raises(requests.HTTPError):
+        Journal(path).execute("test", create_and_group_steps(), rejected)
+
+    journal = Journal(path)
+    assert len(journal.pending()) == 1
+
+    call = MagicMock(return_value=84389)
+    assert journal.resume(call) == 1
+
+    # The transaction isn't created a second time, only grouped
+    call.assert_called_once_with("POST", "/v1/transactions/group", json={"transactions": [608, 609]})
+    assert journal.pending() == []
+
+
+def test_resume_after_deadline(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+
+    # The deadline passes before the group request is sent
+    out_of_time = MagicMock(side_effect=[{"ids": [609]}, DeadlineExceeded("No time left")])
+    with pytest.raises(DeadlineExceeded):
+        Journal(path).execute("test", create_and_group_steps(), out_of_time)
+
+    # Or before the next operation's first step, which is never marked as started
+    with deadline(0), pytest.raises(DeadlineExceeded):
+        Journal(path).execute("test", create_and_group_steps(), MagicMock())
+
+    journal = Journal(path)
+    assert [entry.in_doubt for entry in journal.pending()] == [False, False]
+
+    call = MagicMock(side_effect=[84389, {"ids": [610]}, 84390])
+    assert journal.resume(call) == 2
+
+    # The counterpart isn't left ungrouped
+    call.assert_any_call("POST", "/v1/transactions/group", json={"transactions": [608, 609]})
+    assert journal.pending() == []
+
+
+def test_resume_skips_in_doubt_operations(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    with open(path, "w") as f:
+        f.write(json.dumps({"type": "intent", "entry": "a", "name": "test", "steps": create_and_group_steps()}) + "\n")
+        f.write(json.dumps({"type": "started", "entry": "a", "step": 0}) + "\n")
+        f.write('{"type": "compl')
+
+    journal = Journal(str(path))
+    call = MagicMock()
+    assert journal.resume(call) == 0
+
+    call.assert_not_called()
+    assert journal.pending() == []
@@ -1,6 +1,6 @@
 from unittest.mock import patch
 
-from .link_spare_change import LinkSpareChangeTask
+from .link_spare_change import LinkSpareChangeTask, SpareChangeEngine
 
 
 def test_link_spare_change(call_lunchmoney):
@@ -29,3 +29,61 @@ def test_link_spare_change(call_lunchmoney):
             'tags': [],
             'transactions': [603, 606, 607]
         })
+
+
+def test_spare_change_engine_fetches_each_account_once(call_lunchmoney):
+    task = SpareChangeEngine([
+        {"main_account": "Test Asset 2", "savings_account": "Test Asset 1"},
+        {"main_account": "Test Asset 3", "savings_account": "Test Asset 1"},
+        {"main_account": "Test Asset 2", "savings_account": "Test Asset 4", "ignore_categories": []},
+    ])
+
+    with patch('lunchmoney_automate.link_spare_change.call_lunchmoney', side_effect=call_lunchmoney) as lunchmoney_mock:
+        task.run()
+
+        transaction_queries = [
+            call.kwargs["params"]
+            for call in lunchmoney_mock.call_args_list
+            if call.args == ('GET', '/v1/transactions')
+        ]
+        assert sorted(q["asset_id"] for q in transaction_queries) == [72, 73, 74, 75]
+
+        lunchmoney_mock.assert_any_call('GET', '/v1/assets')
+        lunchmoney_mock.assert_any_call('POST', '/v1/transactions/group', json={
+            'date': '2020-01-02',
+            'payee': 'Walmart',
+            'category_id': 83,
+            'notes': None,
+            'tags': [],
+            'transactions': [603, 606, 607]
+        })
+
+
+def test_spare_change_in_the_same_group_is_regrouped_once(lunchmoney_api_calls, call_lunchmoney):
+    lunchmoney_api_calls["GET /v1/transactions"]["transactions"].extend([
+        {
+            **lunchmoney_api_calls["GET /v1/transactions"]["transactions"][1],
+            "id": 610,
+            "payee": "Target",
+            "amount": "7.9100",
+            "asset_id": 73,
+        },
+        {
+            **lunchmoney_api_calls["GET /v1/transactions"]["transactions"][5],
+            "id": 611,
+        },
+    ])
+    lunchmoney_api_calls["DELETE /v1/transactions/group/701"] = {"transactions": [606, 607, 611]}
+
+    task = LinkSpareChangeTask('Test Asset 2', 'Test Asset 1')
+
+    with patch('lunchmoney_automate.link_spare_change.call_lunchmoney', side_effect=call_lunchmoney) as lunchmoney_mock:
+        task.run()
+
+        mutations = [call for call in lunchmoney_mock.call_args_list if call.args[0] != "GET"]
+        assert [call.args for call in mutations] == [
+            ('DELETE', '/v1/transactions/group/701'),
+            ('POST', '/v1/transactions/group'),
+        ]
+        assert mutations[1].kwargs["json"]["payee"] == "Target"
+        assert mutations[1].kwargs["json"]["transactions"] == [603, 606, 607, 610, 611]
@@ -29,3 +29,22 @@ def test_link_transactions(call_lunchmoney):
             'tags': [],
             'transactions': [605, 604]
     })
+
+
+def test_link_transactions_across_currencies(lunchmoney_api_calls, call_lunchmoney):
+    transactions = {t["id"]: t for t in lunchmoney_api_calls["GET /v1/transactions"]["transactions"]}
+    transactions[605].update({"amount": "-135.0000", "currency": "cad"})
+
+    task = LinkTransfersTask(exchange_rates={"usd": 1, "cad": 0.74}, amount_tolerance=0.01)
+
+    with patch('lunchmoney_automate.link_transfers.call_lunchmoney', side_effect=call_lunchmoney) as lunchmoney_mock:
+        task.run()
+
+        lunchmoney_mock.assert_any_call('POST', '/v1/transactions/group', json={
+            'date': '2020-01-02',
+            'payee': 'Test Asset 2 to Test Asset 1',
+            'category_id': 85,
+            'notes': 'CAD 135.0000',
+            'tags': [],
+            'transactions': [605, 604]
+        })
@@ -18,11 +18,13 @@ def test_match_transactions(call_lunchmoney):
         lunchmoney_mock.assert_any_call("GET", "/v1/assets")
         lunchmoney_mock.assert_any_call("GET", "/v1/plaid_accounts")
         lunchmoney_mock.assert_any_call("GET", "/v1/categories")
+        lunchmoney_mock.assert_any_call("GET", "/v1/tags")
         lunchmoney_mock.assert_any_call(
             "GET",
             "/v1/transactions",
             params={
                 "category_id": 85,
+                "tag_id": 801,
                 "start_date": task.start_date,
                 "end_date": task.end_date,
                 "is_group": "false",
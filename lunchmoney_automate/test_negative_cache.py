@@ -0,0 +1,57 @@
+import logging
+from unittest.mock import patch
+
+from .link_transfers import LinkTransfersTask
+from .negative_cache import NegativeCache
+from .store import TransactionStore
+
+
+def test_negative_cache(tmp_path):
+    clock = [0.0]
+    path = str(tmp_path / "negative-cache.json")
+
+    cache = NegativeCache(path, max_age=100, clock=lambda: clock[0])
+    cache.add("link_transfers", 608, "abc")
+    cache.add("link_transfers", 609, "def")
+    cache.save()
+
+    cache = NegativeCache(path, max_age=100, clock=lambda: clock[0])
+    assert cache.is_hopeless("link_transfers", 608, "abc")
+    assert not cache.is_hopeless("link_transfers", 608, "changed")
+    assert not cache.is_hopeless("link_spare_change", 608, "abc")
+
+    # Entries which aren't used expire
+    clock[0] = 50
+    cache.is_hopeless("link_transfers", 608, "abc")
+    clock[0] = 120
+    cache.save()
+    assert len(NegativeCache(path)) == 1
+
+
+def test_unmatched_transactions_are_only_reevaluated_when_candidates_change(lunchmoney_api_calls, call_lunchmoney, caplog):
+    caplog.set_level(logging.WARNING)
+    cache = NegativeCache()
+
+    def run():
+        task = LinkTransfersTask()
+        task.negative_cache = cache
+        task.store = TransactionStore()
+        with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+            task.run()
+
+        return [r.message for r in caplog.records if r.message.startswith("No match for 2020-01-03 From Test Asset 2")]
+
+    assert len(run()) == 1
+    assert len(run()) == 1
+
+    # A new candidate (even one which doesn't match) means the transaction is evaluated again
+    lunchmoney_api_calls["GET /v1/transactions"]["transactions"].append({
+        **lunchmoney_api_calls["GET /v1/transactions"]["transactions"][6],
+        "id": 610,
+        "date": "2020-02-20",
+        "payee": "To Test Asset 2",
+        "amount": "5.0000",
+        "asset_id": 73,
+        "tags": [],
+    })
+    assert len(run()) == 2
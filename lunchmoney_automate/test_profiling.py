@@ -0,0 +1,47 @@
+import os
+from unittest.mock import MagicMock
+
+from .profiling import Profiler
+
+
+def test_disabled_profiler_does_nothing(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path))
+    span = MagicMock()
+
+    with profiler.task("task", span):
+        with profiler.phase("fetch"):
+            pass
+
+    span.set_attribute.assert_not_called()
+    assert os.listdir(tmp_path) == []
+
+
+def test_profiler_from_env(monkeypatch):
+    monkeypatch.setenv("LUNCHMONEY_PROFILE", "cpu, memory")
+    monkeypatch.setenv("LUNCHMONEY_PROFILE_DIR", "/tmp/profiles")
+
+    profiler = Profiler.from_env()
+    assert profiler.cpu and profiler.memory
+    assert profiler.output_dir == "/tmp/profiles"
+
+
+def test_profiler_records_task_and_phases(tmp_path):
+    profiler = Profiler(cpu=True, memory=True, output_dir=str(tmp_path))
+    span = MagicMock()
+
+    with profiler.task("link_transfers", span):
+        with profiler.phase("fetch"):
+            data = [bytearray(1024) for _ in range(100)]
+        with profiler.phase("match"):
+            sum(range(1000))
+        del data
+
+    attributes = {call.args[0]: call.args[1] for call in span.set_attribute.call_args_list}
+    assert attributes["profile.cpu_time"] >= attributes["profile.fetch.cpu_time"]
+    assert "profile.match.cpu_time" in attributes
+    assert attributes["profile.fetch.peak_memory"] >= 100 * 1024
+    assert attributes["profile.peak_memory"] >= attributes["profile.fetch.peak_memory"]
+
+    assert os.path.exists(attributes["profile.cpu_artifact"])
+    assert os.path.exists(attributes["profile.memory_artifact"])
+    assert sorted(os.listdir(tmp_path))[0].startswith("link_transfers-")
@@ -0,0 +1,62 @@
+from .query import TransactionQuery
+from .utils import Account, Transaction
+
+
+def transaction(**data) -> Transaction:
+    return Transaction(**{
+        "id": 1,
+        "date": "2020-01-02",
+        "category_id": 85,
+        "asset_id": 73,
+        "plaid_account_id": None,
+        "status": "cleared",
+        "is_group": False,
+        "group_id": None,
+        "tags": [{"id": 801, "name": "needs-pair", "description": ""}],
+        **data,
+    })
+
+
+def test_supported_predicates_are_pushed_down():
+    query = TransactionQuery(
+        "2020-01-01",
+        "2020-01-31",
+        category_id=85,
+        tag_id=801,
+        account=Account("plaid_account", id=91, name="401k"),
+        status="cleared",
+        is_group=False,
+        grouped=False,
+        exclude_category_ids=[83],
+    )
+
+    assert query.params() == {
+        "category_id": 85,
+        "tag_id": 801,
+        "plaid_account_id": 91,
+        "status": "cleared",
+        "start_date": "2020-01-01",
+        "end_date": "2020-01-31",
+        "is_group": "false",
+    }
+
+
+def test_remaining_predicates_are_applied_locally():
+    query = TransactionQuery(grouped=False, exclude_category_ids=[83], exclude_statuses=["recurring"])
+    transactions = [
+        transaction(id=1),
+        transaction(id=2, group_id=701),
+        transaction(id=3, category_id=83),
+        transaction(id=4, status="recurring"),
+    ]
+
+    assert [t.id for t in query.filter(transactions)] == [1]
+
+
+def test_matches_applies_every_predicate():
+    query = TransactionQuery(category_id=85, tag_id=801, is_group=False, grouped=False)
+
+    assert query.matches(transaction())
+    assert not query.matches(transaction(tags=[]))
+    assert not query.matches(transaction(category_id=83))
+    assert not query.matches(transaction(group_id=701))
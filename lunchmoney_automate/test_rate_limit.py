@@ -0,0 +1,104 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from .deadline import DeadlineExceeded
+from .rate_limit import RateLimiter, TokenBucket, parse_retry_after, request_kind
+from .utils import call_lunchmoney
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_limiter(clock: FakeClock) -> RateLimiter:
+    return RateLimiter(
+        buckets={
+            "read": TokenBucket(rate=2, capacity=2, priority=0),
+            "write": TokenBucket(rate=1, capacity=1, priority=1),
+        },
+        clock=clock,
+    )
+
+
+def test_token_bucket_budgets():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    assert limiter.try_acquire("read") == 0
+    assert limiter.try_acquire("read") == 0
+    assert limiter.try_acquire("read") == pytest.approx(0.5)
+
+    # Writes have their own budget
+    assert limiter.try_acquire("write") == 0
+
+    clock.now = 0.5
+    assert limiter.try_acquire("read") == 0
+
+
+def test_reads_yield_to_waiting_writes():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    limiter.buckets["write"].waiting = 1
+    assert limiter.try_acquire("read") > 0
+
+    limiter.buckets["write"].waiting = 0
+    assert limiter.try_acquire("read") == 0
+
+
+def test_throttle_and_relax():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    limiter.throttle("read", retry_after=3)
+    assert limiter.buckets["read"].rate == 1
+    assert limiter.try_acquire("write") == pytest.approx(3)
+
+    clock.now = 3
+    assert limiter.try_acquire("write") == 0
+
+    for _ in range(20):
+        limiter.relax("read")
+    assert limiter.buckets["read"].rate == 2
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [(None, None), ("", None), ("5", 5.0), ("-1", 0.0), ("not a date", None)],
+)
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_request_kind():
+    assert request_kind("GET") == "read"
+    assert request_kind("post") == "write"
+    assert request_kind("DELETE") == "write"
+
+
+def test_acquire_gives_up_at_the_deadline():
+    limiter = RateLimiter()
+    limiter.throttle("read", retry_after=60)
+
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire("read", timeout=1)
+
+    assert limiter.buckets["read"].waiting == 0
+
+
+def test_call_lunchmoney_retries_rate_limited_requests(monkeypatch):
+    monkeypatch.setenv("LUNCHMONEY_TOKEN", "test-token")
+
+    throttled = MagicMock(status_code=429, headers={"Retry-After": "0"})
+    ok = MagicMock(status_code=200, headers={})
+    ok.json.return_value = {"assets": []}
+
+    with patch("lunchmoney_automate.utils.limiter", RateLimiter()), patch(
+        "lunchmoney_automate.utils.session.request", side_effect=[throttled, ok]
+    ) as request_mock:
+        assert call_lunchmoney("GET", "/v1/assets") == {"assets": []}
+        assert request_mock.call_count == 2
@@ -0,0 +1,91 @@
+from unittest.mock import patch
+
+from .link_spare_change import SpareChangeEngine
+from .link_transfers import LinkTransfersTask
+from .match_transfers import MatchTransfersTask
+from .query import TransactionQuery
+from .rules import RuleEngine
+from .store import TransactionStore
+from .utils import Transaction
+
+
+def test_classify_routes_to_every_matching_rule():
+    transactions = [
+        Transaction(id=1, date="2020-01-01", category_id=85, status="cleared", tags=[{"id": 801}]),
+        Transaction(id=2, date="2020-01-02", category_id=85, status="cleared", group_id=5, tags=[]),
+        Transaction(id=3, date="2020-01-03", category_id=86, status="recurring", tags=[]),
+    ]
+    engine = RuleEngine({
+        "transfers": TransactionQuery(category_id=85, grouped=False),
+        "tagged": TransactionQuery(category_id=85, tag_id=801),
+        "other": TransactionQuery(exclude_category_ids={85}, exclude_statuses={"cleared"}),
+    })
+
+    routed = engine.classify(transactions)
+
+    assert {name: [t.id for t in ts] for name, ts in routed.items()} == {
+        "transfers": [1],
+        "tagged": [1],
+        "other": [3],
+    }
+
+
+def test_prime_fetches_once_for_every_task(call_lunchmoney):
+    store = TransactionStore()
+    tasks = {
+        "transfers": LinkTransfersTask(),
+        "match_transfers": MatchTransfersTask(needs_match_tag="needs-pair"),
+        "spare_change": SpareChangeEngine([{"main_account": "Test Asset 2", "savings_account": "Test Asset 1"}]),
+    }
+    for task in tasks.values():
+        task.store = store
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney), patch(
+        "lunchmoney_automate.match_transfers.call_lunchmoney", call_lunchmoney
+    ), patch("lunchmoney_automate.link_spare_change.call_lunchmoney", call_lunchmoney):
+        RuleEngine.for_tasks(tasks).prime(store, call_lunchmoney)
+        primed = len([c for c in call_lunchmoney.call_args_list if c.args == ("GET", "/v1/transactions")])
+        assert all(task.classified for task in tasks.values())
+
+        for task in tasks.values():
+            task.run()
+
+    # Each distinct query is sent once (still filtered by Lunch Money), and the tasks send none of their own
+    transaction_calls = [c for c in call_lunchmoney.call_args_list if c.args == ("GET", "/v1/transactions")]
+    params = [tuple(sorted(c.kwargs["params"].items())) for c in transaction_calls]
+    assert len(params) == primed == len(set(params))
+    assert all({"category_id", "asset_id", "plaid_account_id"} & set(c.kwargs["params"]) for c in transaction_calls)
+
+    # The tasks took the transactions routed to their rules
+    assert not any(task.classified for task in tasks.values())
+
+    assert store.get(604).group_id == 84389
+    assert store.get(605).group_id == 84389
+
+
+def test_tasks_keep_their_routed_transactions_after_another_task_changes_the_store(call_lunchmoney):
+    store = TransactionStore()
+    spare_change = SpareChangeEngine([{"main_account": "Test Asset 2", "savings_account": "Test Asset 1"}])
+    transfers = LinkTransfersTask()
+    transfers.lookback_days = 60
+    transfers.refresh_window()
+    for task in (spare_change, transfers):
+        task.store = store
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney), patch(
+        "lunchmoney_automate.link_spare_change.call_lunchmoney", call_lunchmoney
+    ):
+        RuleEngine.for_tasks({"spare_change": spare_change, "transfers": transfers}).prime(store, call_lunchmoney)
+        assert spare_change.start_date != transfers.start_date
+        generation = store.generation
+
+        spare_change.run()
+        assert store.generation > generation
+
+        # The transfers were routed in an earlier window, and are only checked again rather than queried
+        with patch.object(store, "query", wraps=store.query) as query:
+            transfers.run()
+        query.assert_not_called()
+
+    assert not transfers.classified
+    assert store.get(604).group_id == 84389
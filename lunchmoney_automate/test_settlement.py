@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from .link_transfers import LinkTransfersTask
+from .settlement import SettlementLags
+from .task import LOOKBACK_MARGIN_DAYS
+
+
+def test_max_offset_follows_observed_lags(tmp_path):
+    path = str(tmp_path / "settlement.json")
+    lags = SettlementLags(path, percentile=90, min_samples=10)
+
+    for offset in [0, 1, 1, 2, 1, 0, -2, 1, 3, 1]:
+        lags.record("link_transfers:A|B", offset)
+    lags.record("link_transfers:A|C", 1)
+
+    assert lags.max_offset("link_transfers:A|B", ceiling=14) == 3
+    assert lags.max_offset("link_transfers:A|B", ceiling=2) == 2
+    assert lags.max_offset("link_transfers:A|C", ceiling=14) == 14
+
+    # The window can't be sized until every pair has enough links
+    assert lags.widest("link_transfers:", ceiling=14) is None
+
+    lags.save()
+    lags = SettlementLags(path, percentile=90, min_samples=1)
+    assert lags.widest("link_transfers:", ceiling=14) == 3
+
+    # Pairs which are configured (or expected) but haven't been linked yet keep the window at its widest
+    assert lags.widest("link_transfers:", ceiling=14, keys=["link_transfers:A|D"]) is None
+    lags.expect("link_transfers:A|E")
+    assert lags.widest("link_transfers:", ceiling=14) is None
+
+
+def test_links_size_the_window(call_lunchmoney):
+    task = LinkTransfersTask()
+    assert task.window_days() == task.lookback_days
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+        task.run()
+
+    assert sum(len(samples) for samples in task.settlement.samples.values()) == 1
+
+    task.settlement.min_samples = 1
+    task.refresh_window()
+
+    assert task.window_days() < task.lookback_days
+    assert date.fromisoformat(task.start_date) == (
+        date.fromisoformat(task.end_date) - timedelta(days=task.window_days())
+    )
+    assert task.window_days() >= LOOKBACK_MARGIN_DAYS
+
+
+def test_lags_are_only_recorded_once_linked(call_lunchmoney):
+    task = LinkTransfersTask()
+    task.journal.execute = MagicMock(side_effect=requests.HTTPError("503 Service Unavailable"))
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney):
+        with pytest.raises(requests.HTTPError):
+            task.run()
+
+    assert not any(task.settlement.samples.values())
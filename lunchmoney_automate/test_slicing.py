@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+import threading
+import time
+from unittest.mock import MagicMock
+
+from .slicing import DateSlicer
+
+
+def test_slices_cover_the_range():
+    slicer = DateSlicer(slice_days=10)
+
+    assert slicer.slices("2020-01-01", "2020-01-25") == [
+        ("2020-01-01", "2020-01-10"),
+        ("2020-01-11", "2020-01-20"),
+        ("2020-01-21", "2020-01-25"),
+    ]
+
+
+def test_slices_are_merged_in_order_without_duplicates():
+    def fetch(params):
+        start = date.fromisoformat(params["start_date"])
+        items = [{"id": (start + timedelta(days=i)).toordinal(), "date": (start + timedelta(days=i)).isoformat()} for i in range(3)]
+        # A transaction whose date changed between requests shows up in two slices
+        return items + [{"id": 1, "date": params["end_date"]}]
+
+    slicer = DateSlicer(slice_days=10, min_days=1)
+    transactions = slicer.fetch({"category_id": 85, "start_date": "2020-01-01", "end_date": "2020-01-30"}, fetch)
+
+    ids = [t["id"] for t in transactions]
+    assert len(ids) == len(set(ids)) == 10
+    dates = [t["date"] for t in transactions]
+    assert dates == sorted(dates)
+
+
+def test_duplicates_keep_the_latest_response():
+    first_slice_waiting = threading.Event()
+    second_slice_done = threading.Event()
+
+    def fetch(params):
+        if params["start_date"] == "2020-01-01":
+            # The first slice's response arrives last, after the transaction moved into it
+            first_slice_waiting.set()
+            second_slice_done.wait(5)
+            time.sleep(0.05)
+            return [{"id": 1, "date": "2020-01-05", "payee": "Edited"}]
+
+        first_slice_waiting.wait(5)
+        second_slice_done.set()
+        return [{"id": 1, "date": "2020-01-15", "payee": "Original"}, {"id": 2, "date": "2020-01-12"}]
+
+    slicer = DateSlicer(slice_days=10, min_days=10)
+    transactions = slicer.fetch({"start_date": "2020-01-01", "end_date": "2020-01-20"}, fetch)
+
+    assert transactions == [{"id": 1, "date": "2020-01-05", "payee": "Edited"}, {"id": 2, "date": "2020-01-12"}]
+
+
+def test_slice_size_adapts_to_responses():
+    now = [0.0]
+    slicer = DateSlicer(slice_days=30, min_days=5, max_days=90, target_count=100, clock=lambda: now[0])
+
+    # A busy account: 50 transactions a day means slices of 2 days (limited to 5)
+    slicer.fetch({"start_date": "2020-01-01", "end_date": "2020-01-10"}, MagicMock(return_value=[{"id": i} for i in range(500)]))
+    assert slicer.slice_days == 5
+
+    # A quiet one lets the slices grow again
+    slicer = DateSlicer(slice_days=30, min_days=5, max_days=90, target_count=100, clock=lambda: now[0])
+    slicer.fetch({"start_date": "2020-01-01", "end_date": "2020-01-10"}, MagicMock(return_value=[]))
+    assert slicer.slice_days == 90
+
+    fetch = MagicMock(return_value=[])
+    slicer.fetch({"start_date": "2020-01-01", "end_date": "2020-12-31"}, fetch)
+    assert fetch.call_count == 5
@@ -0,0 +1,124 @@
+from unittest.mock import MagicMock, patch
+
+from .link_transfers import LinkTransfersTask
+from .match_transfers import MatchTransfersTask
+from .store import TransactionStore, matches
+from .utils import Transaction
+
+
+def test_matches():
+    transaction = Transaction(id=1, date="2020-01-02", category_id=85, asset_id=72, is_group=False)
+
+    assert matches(transaction, {"category_id": 85, "start_date": "2020-01-01", "end_date": "2020-01-31", "is_group": "false"})
+    assert not matches(transaction, {"category_id": 84})
+    assert not matches(transaction, {"start_date": "2020-01-03"})
+    assert not matches(transaction, {"is_group": "true"})
+
+
+def test_query_is_cached():
+    store = TransactionStore()
+    fetch = MagicMock(return_value=[{"id": 1, "date": "2020-01-02", "category_id": 85}])
+
+    first = store.query({"category_id": 85}, fetch)
+    second = store.query({"category_id": 85}, fetch)
+
+    assert fetch.call_count == 1
+    assert first[0] is second[0]
+
+    store.invalidate()
+    assert store.query({"category_id": 85}, fetch)[0] is first[0]
+    assert fetch.call_count == 2
+
+
+def test_write_through():
+    store = TransactionStore()
+    store.query({"category_id": 85}, lambda params: [{"id": 1, "date": "2020-01-02", "category_id": 85, "is_group": False}])
+    store.query({"recurring_id": 5}, lambda params: [])
+
+    store.reference("/v1/tags", lambda: [{"id": 801, "name": "reviewed"}])
+
+    created = store.apply_create([2], [{"date": "2020-01-02", "category_id": 85, "asset_id": 73, "tags": [801, 802]}])
+    assert created[0].id == 2
+    assert [(tag.id, tag.name) for tag in created[0].tags] == [(801, "reviewed"), (802, None)]
+
+    store.apply_group(84389, [1, 2])
+    transactions = store.query({"category_id": 85}, MagicMock())
+    assert [(t.id, t.group_id) for t in transactions] == [(1, 84389), (2, 84389)]
+
+    # Queries we can't evaluate locally are invalidated when transactions are created
+    assert store.query({"recurring_id": 5}, lambda params: [{"id": 3, "date": "2020-01-02"}])[0].id == 3
+
+    store.apply_ungroup([1])
+    assert store.get(1).group_id is None
+
+
+def test_narrower_queries_are_served_locally():
+    store = TransactionStore()
+    fetch = MagicMock(return_value=[
+        {"id": 1, "date": "2020-01-02", "category_id": 85, "tags": [{"id": 801, "name": "needs-pair"}]},
+        {"id": 2, "date": "2020-01-02", "category_id": 85, "tags": []},
+    ])
+    store.query({"category_id": 85}, fetch)
+
+    assert [t.id for t in store.query({"category_id": 85, "tag_id": 801}, fetch)] == [1]
+    assert fetch.call_count == 1
+
+    # Filters which Lunch Money has to evaluate still need to be fetched
+    fetch.return_value = []
+    assert store.query({"category_id": 85, "recurring_id": 5}, fetch) == []
+    assert fetch.call_count == 2
+
+
+def test_later_tasks_see_earlier_mutations(call_lunchmoney):
+    store = TransactionStore()
+    link = LinkTransfersTask()
+    match = MatchTransfersTask(needs_match_tag="needs-pair")
+    link.store = match.store = store
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", call_lunchmoney), patch(
+        "lunchmoney_automate.match_transfers.call_lunchmoney", call_lunchmoney
+    ):
+        link.run()
+        assert store.get(604).group_id == 84389
+        assert store.get(605).group_id == 84389
+
+        match.run()
+
+    transaction_calls = [c for c in call_lunchmoney.call_args_list if c.args == ("GET", "/v1/transactions")]
+    assert len(transaction_calls) == 1
+
+
+def test_incremental_queries():
+    store = TransactionStore(overlap_days=2)
+    fetch = MagicMock(side_effect=[
+        [
+            {"id": 1, "date": "2020-01-01", "category_id": 85},
+            {"id": 2, "date": "2020-01-09", "category_id": 85},
+        ],
+        [
+            {"id": 2, "date": "2020-01-09", "category_id": 85, "group_id": 84389},
+            {"id": 3, "date": "2020-01-11", "category_id": 85},
+        ],
+    ])
+
+    store.query({"category_id": 85, "start_date": "2020-01-01", "end_date": "2020-01-10"}, fetch)
+    transactions = store.query({"category_id": 85, "start_date": "2020-01-01", "end_date": "2020-01-11"}, fetch)
+
+    fetch.assert_called_with({"category_id": 85, "start_date": "2020-01-08", "end_date": "2020-01-11"})
+    assert [t.id for t in transactions] == [1, 2, 3]
+    assert store.get(2).group_id == 84389
+
+
+def test_reference_ttl():
+    now = [0.0]
+    store = TransactionStore(reference_ttl=60, clock=lambda: now[0])
+    fetch = MagicMock(return_value={"assets": []})
+
+    store.reference("/v1/assets", fetch)
+    now[0] = 30
+    store.reference("/v1/assets", fetch)
+    assert fetch.call_count == 1
+
+    now[0] = 90
+    store.reference("/v1/assets", fetch)
+    assert fetch.call_count == 2
@@ -0,0 +1,42 @@
+import contextvars
+import threading
+
+from .task import Task
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class EmptyTask(Task):
+    def run(self):
+        pass
+
+
+def test_prefetch_runs_fetches_concurrently():
+    task = EmptyTask()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fetch(value):
+        # Every fetch has to be running at once for the barrier to be passed
+        barrier.wait()
+        return (value, request_id.get())
+
+    request_id.set("run-1")
+    assert task._prefetch(*(lambda v=v: fetch(v) for v in range(3))) == [
+        (0, "run-1"),
+        (1, "run-1"),
+        (2, "run-1"),
+    ]
+
+
+def test_load_reference_data(call_lunchmoney):
+    task = EmptyTask()
+
+    accounts, categories = task._load_reference_data(call_lunchmoney)
+
+    assert [(a.kind, a.id) for a in accounts][:2] == [("asset", 72), ("asset", 73)]
+    assert "Transfers" in [c.name for c in categories]
+    assert call_lunchmoney.call_count == 3
+
+    # Reference data is cached by the store
+    task._load_reference_data(call_lunchmoney)
+    assert call_lunchmoney.call_count == 3
@@ -0,0 +1,61 @@
+from unittest.mock import MagicMock, patch
+
+from .tenants import MultiTenantRunner, Tenant, create_tasks
+from .transport import RequestsTransport
+from .utils import Client, call_lunchmoney, current_client
+
+
+def test_create_tasks():
+    tasks = create_tasks({
+        "transfers": {},
+        "spare_change": [{"main_account": "Test Asset 2", "savings_account": "Test Asset 1"}],
+    })
+
+    assert sorted(tasks) == ["spare_change", "transfers"]
+
+
+def test_call_lunchmoney_uses_current_client(monkeypatch):
+    monkeypatch.delenv("LUNCHMONEY_TOKEN", raising=False)
+
+    client = Client("tenant-token")
+    client.transport = RequestsTransport(MagicMock())
+    client.transport.session.request.return_value = MagicMock(status_code=200, headers={})
+    client.transport.session.request.return_value.json.return_value = {"assets": []}
+
+    token = current_client.set(client)
+    try:
+        assert call_lunchmoney("GET", "/v1/assets") == {"assets": []}
+    finally:
+        current_client.reset(token)
+
+    assert client.transport.session.request.call_args.kwargs["headers"]["Authorization"] == "Bearer tenant-token"
+    assert client.limiter.buckets["read"].tokens < client.limiter.buckets["read"].capacity
+
+
+def test_failing_tenants_do_not_affect_others(call_lunchmoney):
+    tokens = []
+
+    def call(method, endpoint, **kwargs):
+        token = current_client.get().token
+        tokens.append(token)
+        if token == "revoked":
+            raise Exception("401 Unauthorized")
+
+        return call_lunchmoney(method, endpoint, **kwargs)
+
+    healthy = Tenant("healthy", "valid", {"transfers": {}})
+    failing = Tenant("failing", "revoked", {"transfers": {}})
+
+    with patch("lunchmoney_automate.link_transfers.call_lunchmoney", side_effect=call):
+        results = MultiTenantRunner([failing, healthy], workers=2).run()
+
+    assert [r.name for r in results] == ["failing", "healthy"]
+    assert not results[0].succeeded and "transfers" in results[0].errors
+    assert results[1].succeeded
+    assert set(results[1].task_durations) == {"transfers"}
+    assert set(results[1].estimates) == {"transfers"} and not results[0].estimates
+    assert set(results[1].usage) == {"estimate", "transfers"}
+
+    assert set(tokens) == {"valid", "revoked"}
+    assert healthy.store.get(605).group_id == 84389
+    assert failing.store.get(605) is None
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from . import transport
+from .transport import HTTP2Transport, RequestsTransport, create_transport
+
+
+def test_create_transport(monkeypatch):
+    monkeypatch.delenv("LUNCHMONEY_TRANSPORT", raising=False)
+    session = MagicMock()
+
+    default = create_transport(session=session)
+    assert isinstance(default, RequestsTransport)
+    default.request("GET", "https://example.com", timeout=1)
+    session.request.assert_called_once_with("GET", "https://example.com", timeout=1)
+
+    with pytest.raises(ValueError):
+        create_transport("carrier-pigeon")
+
+
+def test_http2_transport_needs_httpx(monkeypatch):
+    monkeypatch.setattr(transport, "httpx", None)
+
+    with pytest.raises(ImportError):
+        HTTP2Transport()
+
+
+def test_http2_transport_multiplexes_requests():
+    pytest.importorskip("h2")
+    pytest.importorskip("httpx")
+    from benchmark_transport import H2StandIn
+
+    server = H2StandIn(delay=0.2)
+    http2 = HTTP2Transport(prior_knowledge=True)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda i: http2.request("GET", f"{server.url}/v1/transactions", timeout=5), range(8)))
+    finally:
+        http2.close()
+        server.shutdown()
+
+    assert [resp.json() for resp in responses] == [{"transactions": [], "has_more": False}] * 8
+    assert http2.negotiated
+    assert (server.connections, server.streams) == (1, 8)
+
+
+def test_http2_transport_falls_back_without_http2():
+    pytest.importorskip("httpx")
+    from benchmark_transport import StandInHandler
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    fallback = MagicMock()
+    http2 = HTTP2Transport(fallback=fallback)
+    try:
+        assert http2.request("GET", f"{url}/v1/transactions", timeout=5).json()["has_more"] is False
+        http2.request("POST", f"{url}/v1/transactions/group", json={"transactions": [1]}, timeout=5)
+    finally:
+        http2.close()
+        server.shutdown()
+
+    assert http2.negotiated is False
+    fallback.request.assert_called_once_with(
+        "POST", f"{url}/v1/transactions/group", json={"transactions": [1]}, timeout=5
+    )
@@ -1,6 +1,7 @@
+import gc
 import pytest
 from datetime import datetime
-from .utils import parse_date, group, Category
+from .utils import parse_date, group, Category, Tag, Transaction
 
 @pytest.mark.parametrize(
     ["text", "expected"],
@@ -30,4 +31,26 @@ def test_category():
                 })
 
     assert category.is_income == False
-    assert category.is_group == True
\ No newline at end of file
+    assert category.is_group == True
+
+def test_tags_and_strings_are_interned():
+    first, second = (
+        Transaction(**{"id": id, "payee": "".join(["Coff", "ee"]), "currency": "usd", "tags": [{"id": 801, "name": "needs-pair"}]})
+        for id in (1, 2)
+    )
+
+    assert first.tags[0] is second.tags[0]
+    assert first.payee is second.payee
+    assert Tag(id=801) is not first.tags[0]
+
+    with pytest.raises(AttributeError):
+        first.tags[0].name = "renamed"
+
+
+def test_unused_tags_are_released():
+    transaction = Transaction(**{"id": 1, "tags": [{"id": 802, "name": "tenant-only"}]})
+    assert (("id", 802), ("name", "tenant-only")) in Tag._interned
+
+    del transaction
+    gc.collect()
+    assert (("id", 802), ("name", "tenant-only")) not in Tag._interned
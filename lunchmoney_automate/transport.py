@@ -0,0 +1,125 @@
+from abc import ABC, abstractmethod
+import asyncio
+import logging
+from os import getenv
+import threading
+from typing import Any, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - HTTP/2 support is optional
+    httpx = None
+
+TRANSPORTS = ("requests", "http2")
+
+# The most connections the http2 transport opens, enough for every request a runner makes at
+# once (from its prefetches and slices) to have its own should HTTP/2 not be negotiated
+MAX_CONNECTIONS = 16
+
+log = logging.getLogger(__name__)
+
+
+class Transport(ABC):
+    """Sends HTTP requests to Lunch Money, returning ``requests`` responses whatever the underlying client."""
+
+    @abstractmethod
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class RequestsTransport(Transport):
+    """Sends requests over HTTP/1.1 using a ``requests`` session (and its pool of keep-alive connections)."""
+
+    def __init__(self, session: Optional[requests.Session] = None) -> None:
+        self.session = session or requests.Session()
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        return self.session.request(method, url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class HTTP2Transport(Transport):
+    """
+    Sends requests over HTTP/2 using ``httpx``, so that concurrent requests (like the group writes
+    from several tasks) are multiplexed over a single connection instead of each needing one of
+    their own. httpx's synchronous HTTP/2 client isn't safe to share between threads (concurrent
+    requests can open streams out of order), so the requests of every thread are sent by an
+    asynchronous client on an event loop of the transport's own.
+
+    When HTTP/2 isn't negotiated (the ``h2`` package is missing, or a proxy or the server doesn't
+    offer it), later requests are sent with a ``requests`` session instead, whose pool of
+    keep-alive connections is faster than httpx's over HTTP/1.1. With ``prior_knowledge``, HTTP/2
+    is spoken without negotiating it, which only servers known to support it (over plain HTTP)
+    will understand.
+
+    This needs the optional ``httpx[http2]`` dependency.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        prior_knowledge: bool = False,
+        fallback: Optional[Transport] = None,
+    ) -> None:
+        if httpx is None:
+            raise ImportError("The http2 transport needs httpx (pip install 'httpx[http2]')")
+
+        self.client = httpx.AsyncClient(
+            http1=not prior_knowledge,
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections),
+        )
+        self.fallback = fallback or RequestsTransport()
+        self.negotiated: Optional[bool] = None
+        self._lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="lunchmoney-http2", daemon=True)
+        self._thread.start()
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        if self.negotiated is False:
+            return self.fallback.request(method, url, **kwargs)
+
+        resp = asyncio.run_coroutine_threadsafe(self.client.request(method, url, **kwargs), self._loop).result()
+        with self._lock:
+            if self.negotiated is None:
+                self.negotiated = resp.http_version == "HTTP/2"
+                if not self.negotiated:
+                    log.warning(f"HTTP/2 wasn't negotiated ({resp.http_version} was), so falling back to requests")
+
+        # Convert the response so that callers (and their error handling) don't depend on the transport
+        response = requests.Response()
+        response.status_code = resp.status_code
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response._content = resp.content
+        response.encoding = resp.encoding
+        response.url = str(resp.url)
+        response.reason = resp.reason_phrase
+        return response
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.fallback.close()
+
+
+def create_transport(name: Optional[str] = None, session: Optional[requests.Session] = None) -> Transport:
+    """Creates a transport by name (``requests`` or ``http2``), defaulting to ``LUNCHMONEY_TRANSPORT``."""
+    name = name or getenv("LUNCHMONEY_TRANSPORT", "requests")
+    if name == "requests":
+        return RequestsTransport(session)
+    if name == "http2":
+        return HTTP2Transport()
+
+    raise ValueError(f"Unknown transport '{name}' (expected one of {', '.join(TRANSPORTS)})")
@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+from typing import Iterator, Optional
+
+from .rate_limit import request_kind
+
+
+class Usage:
+    """The requests made to Lunch Money by a run, and how much data and time they took."""
+
+    def __init__(self) -> None:
+        self.reads = 0
+        self.writes = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self) -> int:
+        return self.reads + self.writes
+
+    def record(self, method: str, size: int, seconds: float) -> None:
+        with self._lock:
+            if request_kind(method) == "read":
+                self.reads += 1
+            else:
+                self.writes += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def __str__(self) -> str:
+        return f"reads={self.reads} writes={self.writes} bytes={self.bytes} latency={self.seconds:.2f}s"
+
+
+# The usage that requests made in the current context count towards, if it is being measured
+current_usage: ContextVar[Optional[Usage]] = ContextVar("lunchmoney_usage", default=None)
+
+
+@contextmanager
+def metered() -> Iterator[Usage]:
+    """
+    Measures the requests made within the block (including those made by threads which copy
+    the current context). Metering nests, with requests only counting towards the innermost block.
+    """
+    usage = Usage()
+    token = current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_usage.reset(token)
+
+
+def record(method: str, size: int, seconds: float) -> None:
+    """Counts a request towards the usage being measured, if any."""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.record(method, size, seconds)
@@ -1,17 +1,78 @@
+import atexit
 from collections import defaultdict
+from contextvars import ContextVar
+from datetime import date, datetime
 import json
-from typing import Any, Callable, Dict, Iterable, List, TypeVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
 from os import getenv
+import sys
+import threading
+import time
+import weakref
 import dateparser
 from opentelemetry import trace
 
 import requests
 
+from .cassette import Cassette
+from .deadline import DeadlineExceeded, remaining
+from .rate_limit import RateLimiter, limiter, parse_retry_after, request_kind
+from .transport import Transport, create_transport
+from .usage import record
+
 T = TypeVar("T")
 S = TypeVar("S")
 
 tracer = trace.get_tracer(__name__)
 
+MAX_RATE_LIMIT_RETRIES = 5
+
+# The longest we'll wait for Lunch Money to respond to a request (when there's no earlier deadline)
+REQUEST_TIMEOUT = 30.0
+
+API_URL = "https://dev.lunchmoney.app"
+
+# A shared session keeps connections to Lunch Money alive between requests (and tasks)
+session = requests.Session()
+
+# The transport used for requests (over the shared session, unless LUNCHMONEY_TRANSPORT says otherwise)
+transport = create_transport(session=session)
+
+
+class Client:
+    """The token and connection state used to call Lunch Money for a single budget."""
+
+    def __init__(self, token: str, limiter: Optional[RateLimiter] = None, transport: Optional[Transport] = None) -> None:
+        self.token = token
+        self.limiter = limiter or RateLimiter()
+        self.transport = transport or create_transport()
+
+
+# The client for the budget being worked on, when running for several budgets at once
+# (otherwise LUNCHMONEY_TOKEN and the shared session and rate limiter are used)
+current_client: ContextVar[Optional[Client]] = ContextVar("lunchmoney_client", default=None)
+
+# When set, API sessions are recorded to (or replayed from) a cassette file
+cassette = Cassette.from_env()
+if cassette is not None:
+    atexit.register(cassette.close)
+
+
+def recording() -> bool:
+    """
+    Whether API sessions are being recorded or replayed, in which case a run should only depend
+    on the responses it gets (not on how long they took), so that its requests can be replayed.
+    """
+    return cassette is not None
+
+
+def today() -> date:
+    """The current (UTC) date, or the date a session was recorded on while it is being replayed."""
+    if cassette is not None and cassette.replaying and cassette.recorded_on is not None:
+        return cassette.recorded_on
+
+    return datetime.utcnow().date()
+
 class Wrapper:
     def __init__(self, **data: dict) -> None:
         for k, v in data.items():
@@ -50,12 +111,44 @@ class Category(Wrapper):
         super().__init__(**data)
 
 class Tag(Wrapper):
+    """
+    A tag, which (since the same few tags appear on thousands of transactions) is a shared,
+    immutable instance for each distinct set of values. Tags are only shared while a transaction
+    still refers to them, so the tags of transactions (or tenants) which are gone are released.
+    """
+
     id: str
     name: str
     description: str
 
+    _interned: "weakref.WeakValueDictionary[Any, Tag]" = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __new__(cls, **data: dict) -> "Tag":
+        key = tuple(sorted(data.items()))
+        try:
+            with cls._lock:
+                return cls._interned[key]
+        except TypeError:
+            # Values we can't hash (which Lunch Money doesn't send) can't be interned
+            key = None
+        except KeyError:
+            pass
+
+        tag = super().__new__(cls)
+        tag.__dict__.update({k: sys.intern(v) if type(v) is str else v for k, v in data.items()})
+        if key is not None:
+            with cls._lock:
+                tag = cls._interned.setdefault(key, tag)
+
+        return tag
+
     def __init__(self, **data: dict) -> None:
-        super().__init__(**data)
+        # Tags are initialised (or reused) by __new__
+        pass
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Tags are immutable")
 
     def __str__(self) -> str:
         return f"#{self.name}"
@@ -76,9 +169,16 @@ class Transaction(Wrapper):
     group_id: int
     tags: List[Tag]
 
+    # Strings which are repeated across many transactions, and so are interned to share them
+    INTERNED_FIELDS = ("payee", "currency", "status")
+
     def __init__(self, **data: dict) -> None:
         super().__init__(**data)
         self.tags = [Tag(**t) for t in (self.tags or [])]
+        for field in self.INTERNED_FIELDS:
+            value = self.__dict__.get(field)
+            if type(value) is str:
+                self.__dict__[field] = sys.intern(value)
 
     def __str__(self) -> str:
         return f"{self.date} {self.payee} [{self.currency.upper()} {self.amount}]"
@@ -100,8 +200,11 @@ def call_lunchmoney(
         "endpoint": endpoint,
         "headers": headers,
     }) as span:
-        token = getenv("LUNCHMONEY_TOKEN")
-        assert token is not None
+        client = current_client.get()
+        token = client.token if client is not None else getenv("LUNCHMONEY_TOKEN")
+        assert token is not None or (cassette is not None and cassette.replaying)
+        client_limiter = client.limiter if client is not None else limiter
+        client_transport = client.transport if client is not None else transport
 
         headers = {
             **(headers or {}),
@@ -109,14 +212,56 @@ def call_lunchmoney(
             "Accept": "application/json",
         }
 
-        resp = requests.request(
-            method, f"https://dev.lunchmoney.app{endpoint}", headers=headers, **kwargs
-        )
+        # Replayed responses don't count towards (or need to wait for) the rate limits
+        replaying = cassette is not None and cassette.replaying
+
+        kind = request_kind(method)
+        waited = 0.0
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            if not replaying:
+                waited += client_limiter.acquire(kind, timeout=remaining())
+
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded(f"No time left to call {method} {endpoint}")
+
+            timeout = REQUEST_TIMEOUT if left is None else min(REQUEST_TIMEOUT, left)
+            started = time.monotonic()
+            resp = _send(client_transport, method, endpoint, headers, token, timeout=timeout, **kwargs)
+            record(method, len(resp.content or b""), time.monotonic() - started)
+
+            if resp.status_code != 429:
+                if not replaying:
+                    client_limiter.relax(kind)
+                break
+
+            if not replaying:
+                client_limiter.throttle(kind, parse_retry_after(resp.headers.get("Retry-After")))
+
         span.set_attribute("status_code", resp.status_code)
+        span.set_attribute("rate_limit.waited", waited)
+        span.set_attribute("rate_limit.retries", attempt)
 
         resp.raise_for_status()
 
         return resp.json()
 
+
+def _send(
+    transport: Transport, method: str, endpoint: str, headers: dict, token: str, **kwargs
+) -> requests.Response:
+    url = f"{API_URL}{endpoint}"
+    if cassette is not None and cassette.replaying:
+        return cassette.replay(method, endpoint, kwargs, url)
+
+    started = time.monotonic()
+    resp = transport.request(method, url, headers=headers, **kwargs)
+
+    if cassette is not None:
+        cassette.record(method, endpoint, kwargs, resp, time.monotonic() - started, token=token)
+
+    return resp
+
+
 def parse_date(date: str):
     return dateparser.parse(date, date_formats=["%Y-%m-%d"])
\ No newline at end of file
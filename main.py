@@ -2,15 +2,29 @@ import datetime
 import logging
 import os
 import json
+import queue
+import signal
+import threading
 import tracing
-from typing import List
+from typing import Dict
 from opentelemetry import trace
 
+from lunchmoney_automate.archive import TransactionArchive
+from lunchmoney_automate.budget import CostEstimator, report
+from lunchmoney_automate.coordination import Coordinator, coordinated
+from lunchmoney_automate.daemon import Daemon
+from lunchmoney_automate.deadline import DeadlineExceeded, deadline
+from lunchmoney_automate.events import EventConsumer, EventProcessor, EventServer
+from lunchmoney_automate.journal import Journal
+from lunchmoney_automate.negative_cache import NegativeCache
+from lunchmoney_automate.rules import RuleEngine
+from lunchmoney_automate.settlement import SettlementLags
+from lunchmoney_automate.slicing import DateSlicer
+from lunchmoney_automate.store import TransactionStore
 from lunchmoney_automate.task import Task
-
-from lunchmoney_automate.link_transfers import LinkTransfersTask
-from lunchmoney_automate.match_transfers import MatchTransfersTask
-from lunchmoney_automate.link_spare_change import LinkSpareChangeTask
+from lunchmoney_automate.tenants import MultiTenantRunner, create_tasks
+from lunchmoney_automate.usage import Usage, metered
+from lunchmoney_automate.utils import call_lunchmoney
 
 def main() -> None:
     tracer = trace.get_tracer("lunchmoney-automate")
@@ -18,25 +32,135 @@ def main() -> None:
         with tracer.start_as_current_span("configuration.load"):
             logging.info("Loading configuration...")
             config = json.loads(os.getenv("LUNCHMONEY_CONFIG", "{}"))
+            daemon_config = config.get("daemon")
+            events_config = config.get("events")
+            coordination_config = config.get("coordination") or {}
+
+        tenants = os.getenv("LUNCHMONEY_TENANTS")
+        if tenants is not None:
+            with open(tenants, "r") as f:
+                tenants_config = json.load(f)
+
+            logging.info(f"Running tasks for {len(tenants_config['tenants'])} tenants...")
+            MultiTenantRunner.from_config(tenants_config["tenants"], workers=tenants_config.get("workers", 4)).run()
+            return
 
         with tracer.start_as_current_span("tasks.load"):
-            tasks: List[Task] = []
-            if "transfers" in config:
-                logging.info("Link Transfers task enabled in configuration")
-                tasks.append(LinkTransfersTask(**config["transfers"]))
+            tasks: Dict[str, Task] = create_tasks(config)
+
+            journal = Journal(os.getenv("LUNCHMONEY_JOURNAL"))
+            negative_cache = NegativeCache(os.getenv("LUNCHMONEY_NEGATIVE_CACHE"))
+            settlement = SettlementLags(os.getenv("LUNCHMONEY_SETTLEMENT"))
+            slicer = DateSlicer()
+            coordinator = Coordinator.from_config(coordination_config)
+            partition = coordination_config.get("partition", False)
+            archive = TransactionArchive(os.getenv("LUNCHMONEY_ARCHIVE")) if os.getenv("LUNCHMONEY_ARCHIVE") else None
+            store = TransactionStore(
+                overlap_days=daemon_config.get("overlap_days", 3),
+                full_refresh_interval=daemon_config.get("full_refresh_interval", 6 * 3600),
+                reference_ttl=daemon_config.get("reference_ttl", 3600),
+                archive=archive,
+            ) if daemon_config is not None else TransactionStore(archive=archive)
+            for task in tasks.values():
+                task.journal = journal
+                task.negative_cache = negative_cache
+                task.settlement = settlement
+                task.slicer = slicer
+                task.store = store
+                task.refresh_window()
+
+    one_shot = daemon_config is None and events_config is None
+    if one_shot:
+        with tracer.start_as_current_span("tasks.estimate"), metered() as estimate_usage:
+            estimates = CostEstimator(store, slicer).estimate(tasks, fused=bool(config.get("fuse_rules")))
+        for name, estimate in estimates.items():
+            logging.info(f"Estimated cost of {name}: {estimate}")
+
+        if os.getenv("LUNCHMONEY_ESTIMATE"):
+            return
+
+    logging.info("Resuming any incomplete operations from the previous run...")
+    journal.resume(call_lunchmoney)
+
+    if one_shot:
+        actuals: Dict[str, Usage] = {"estimate": estimate_usage}
+        with tracer.start_as_current_span("tasks.run"), deadline(config.get("deadline")):
+            if config.get("fuse_rules"):
+                logging.info("Fetching transactions for every task at once...")
+                with metered() as prime_usage:
+                    RuleEngine.for_tasks(tasks).prime(store, call_lunchmoney)
+                actuals["rules"] = prime_usage
+
+            logging.info("Running tasks...")
+            for name, task in tasks.items():
+                with coordinated(coordinator, name, task, partition) as held:
+                    if not held:
+                        logging.info(f"Skipping task {name} since another runner is working on it")
+                        continue
+
+                    try:
+                        task.run()
+                    except DeadlineExceeded as ex:
+                        logging.warning(f"Task {name} stopped early: {ex}")
+                    actuals[name] = task.usage
+
+            unprocessed = {name: len(task.unprocessed) for name, task in tasks.items() if task.unprocessed}
+            if unprocessed:
+                logging.warning(f"Transactions left unprocessed when time ran out: {unprocessed}")
+
+        logging.info("API usage compared with the estimate:")
+        for line in report(estimates, actuals):
+            logging.info(line)
+        return
+
+    stopped = threading.Event()
+
+    if events_config is not None:
+        events = queue.Queue()
+        consumer = EventConsumer(
+            EventProcessor(list(tasks.values()), store),
+            events,
+            batch_delay=events_config.get("batch_delay", 1.0),
+        )
+        server = EventServer(
+            events,
+            host=events_config.get("host", "127.0.0.1"),
+            port=events_config.get("port", 8080),
+        )
+
+        logging.info(f"Listening for transaction events on {server.url}...")
+        consumer.start()
+        server.start()
+
+    daemon = None
+    if daemon_config is not None:
+        daemon = Daemon(
+            tasks,
+            intervals=daemon_config.get("intervals", {}),
+            store=store,
+            default_interval=daemon_config.get("default_interval", 3600),
+            workers=daemon_config.get("workers", 4),
+            coordinator=coordinator,
+            partition=partition,
+        )
+
+    def stop(*_):
+        stopped.set()
+        if daemon is not None:
+            daemon.stop()
 
-            if "match_transfers" in config:
-                logging.info("Match Transfers task enabled in configuration")
-                tasks.append(MatchTransfersTask(**config["match_transfers"]))
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
 
-            if "spare_change" in config:
-                logging.info("Link Spare Change task enabled in configuration")
-                tasks.extend([LinkSpareChangeTask(**item) for item in config["spare_change"]])
+    if daemon is not None:
+        logging.info("Running tasks as a daemon...")
+        daemon.run()
+    else:
+        stopped.wait()
 
-    with tracer.start_as_current_span("tasks.run"):
-        logging.info("Running tasks...")
-        for task in tasks:
-            task.run()
+    if events_config is not None:
+        server.shutdown()
+        consumer.stop()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()